@@ -0,0 +1,38 @@
+"""Add shortcodes to clients and sequences
+
+Revision ID: 3f6b2d1c9a7e
+Revises: 8ec856570cc2
+Create Date: 2026-10-19 10:12:31.442187
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3f6b2d1c9a7e"  # pragma: allowlist secret
+down_revision = "8ec856570cc2"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    for table in ("clientsequences", "clients"):
+        op.add_column(table, sa.Column("shortcode", sa.Unicode(), nullable=True), schema="takbackend")
+        # Existing rows get hex codes, new ones base62 from the model default, lookups do not care
+        op.execute(
+            f"UPDATE takbackend.{table} SET shortcode = substr(md5(random()::text || pk::text), 1, 10)"
+            " WHERE shortcode IS NULL"
+        )
+        op.alter_column(table, "shortcode", nullable=False, schema="takbackend")
+    op.create_index(
+        "clientsequences_shortcode_unique", "clientsequences", ["shortcode"], unique=True, schema="takbackend"
+    )
+    op.create_index("clients_shortcode_unique", "clients", ["shortcode"], unique=True, schema="takbackend")
+
+
+def downgrade() -> None:
+    op.drop_index("clients_shortcode_unique", table_name="clients", schema="takbackend")
+    op.drop_index("clientsequences_shortcode_unique", table_name="clientsequences", schema="takbackend")
+    op.drop_column("clients", "shortcode", schema="takbackend")
+    op.drop_column("clientsequences", "shortcode", schema="takbackend")
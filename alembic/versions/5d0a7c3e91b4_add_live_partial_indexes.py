@@ -0,0 +1,45 @@
+"""Add partial indexes for the soft-delete filtered access patterns
+
+Revision ID: 5d0a7c3e91b4
+Revises: b81e4c0d5f23
+Create Date: 2026-10-19 15:58:12.204511
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5d0a7c3e91b4"  # pragma: allowlist secret
+down_revision = "b81e4c0d5f23"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+# index name, table, column
+INDEXES = (
+    ("takinstances_live_ownerid_idx", "takinstances", "ownerid"),
+    ("takinstances_live_grouping_idx", "takinstances", "grouping"),
+    ("clientsequences_live_server_idx", "clientsequences", "server"),
+    ("clients_live_sequence_idx", "clients", "sequence"),
+    ("clients_live_server_idx", "clients", "server"),
+)
+
+
+def upgrade() -> None:
+    # CONCURRENTLY so the tables are not locked for writes while building, it can't run inside transaction
+    with op.get_context().autocommit_block():
+        for name, table, column in INDEXES:
+            op.create_index(
+                name,
+                table,
+                [column],
+                schema="takbackend",
+                postgresql_where=sa.text("deleted IS NULL"),
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, schema="takbackend", postgresql_concurrently=True)
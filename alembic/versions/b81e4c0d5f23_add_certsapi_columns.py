@@ -0,0 +1,61 @@
+"""Add derived certs-api connection columns to tak-instance
+
+Revision ID: b81e4c0d5f23
+Revises: 3f6b2d1c9a7e
+Create Date: 2026-10-19 11:02:47.918311
+
+"""
+from typing import Optional
+
+from alembic import op
+import sqlalchemy as sa
+from cryptography.fernet import Fernet
+
+from takbackend.config import FIELD_ENCRYPTION_KEY
+
+
+# revision identifiers, used by Alembic.
+revision = "b81e4c0d5f23"  # pragma: allowlist secret
+down_revision = "3f6b2d1c9a7e"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def encrypt_field(value: str) -> Optional[str]:
+    """Frozen copy of security.encrypt_field as of this revision, None if key not configured"""
+    if not FIELD_ENCRYPTION_KEY:
+        return None
+    return Fernet(str(FIELD_ENCRYPTION_KEY).encode("utf-8")).encrypt(value.encode("utf-8")).decode("ascii")
+
+
+def upgrade() -> None:
+    op.add_column("takinstances", sa.Column("dns_name", sa.String(), nullable=True), schema="takbackend")
+    op.add_column("takinstances", sa.Column("certsapi_base", sa.String(), nullable=True), schema="takbackend")
+    op.add_column("takinstances", sa.Column("certsapi_token", sa.String(), nullable=True), schema="takbackend")
+    op.execute(
+        "UPDATE takbackend.takinstances SET dns_name = tfoutputs->'dns_name'->>'value',"
+        " certsapi_base = 'https://' || (tfoutputs->'dns_name'->>'value') || '/api'"
+        " WHERE tfoutputs->'dns_name'->>'value' IS NOT NULL"
+    )
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.text(
+            "SELECT pk, tfoutputs->'cert_api_token'->>'value' FROM takbackend.takinstances"
+            " WHERE tfoutputs->'cert_api_token'->>'value' IS NOT NULL"
+        )
+    ).fetchall()
+    for pk, token in rows:
+        encrypted = encrypt_field(token)
+        if encrypted is None:
+            # No key configured, get_http_options falls back to tfoutputs
+            break
+        conn.execute(
+            sa.text("UPDATE takbackend.takinstances SET certsapi_token = :token WHERE pk = :pk"),
+            {"token": encrypted, "pk": pk},
+        )
+
+
+def downgrade() -> None:
+    op.drop_column("takinstances", "certsapi_token", schema="takbackend")
+    op.drop_column("takinstances", "certsapi_base", schema="takbackend")
+    op.drop_column("takinstances", "dns_name", schema="takbackend")
@@ -0,0 +1,55 @@
+"""Cascade old instance soft-deletes to sequences and clients, add the archive tables
+
+Revision ID: c7e1f4a2b9d6
+Revises: 5d0a7c3e91b4
+Create Date: 2026-10-19 17:21:05.631842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "c7e1f4a2b9d6"  # pragma: allowlist secret
+down_revision = "5d0a7c3e91b4"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+TABLES = ("takinstances", "clientsequences", "clients")
+
+
+def upgrade() -> None:
+    # Before the cascade deleting an instance left its sequences and clients live
+    for child in ("clientsequences", "clients"):
+        op.execute(
+            f"""UPDATE takbackend.{child} AS child SET deleted = parent.deleted, updated = now()
+            FROM takbackend.takinstances AS parent
+            WHERE child.server = parent.pk AND parent.deleted IS NOT NULL AND child.deleted IS NULL"""
+        )
+    # Same columns without defaults, foreign keys or indexes, see models/archive.py
+    for table in TABLES:
+        op.execute(f"CREATE TABLE takbackend.{table}_archive (LIKE takbackend.{table} INCLUDING COMMENTS)")
+        op.add_column(
+            f"{table}_archive",
+            sa.Column("archived", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+            schema="takbackend",
+        )
+        op.create_primary_key(f"{table}_archive_pkey", f"{table}_archive", ["pk"], schema="takbackend")
+    with op.get_context().autocommit_block():
+        for table in TABLES:
+            op.create_index(
+                f"{table}_deleted_idx",
+                table,
+                ["deleted"],
+                schema="takbackend",
+                postgresql_where=sa.text("deleted IS NOT NULL"),
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for table in reversed(TABLES):
+            op.drop_index(f"{table}_deleted_idx", table_name=table, schema="takbackend", postgresql_concurrently=True)
+    for table in reversed(TABLES):
+        op.drop_table(f"{table}_archive", schema="takbackend")
@@ -0,0 +1,117 @@
+"""Optionally hash partition clients on server, only when CLIENTS_PARTITIONS is set
+
+Revision ID: e2a9b6d41c07
+Revises: c7e1f4a2b9d6
+Create Date: 2026-10-19 18:40:33.117290
+
+"""
+from typing import List
+
+from alembic import op
+import sqlalchemy as sa
+
+from takbackend.config import CLIENTS_PARTITIONS
+
+
+# revision identifiers, used by Alembic.
+revision = "e2a9b6d41c07"  # pragma: allowlist secret
+down_revision = "c7e1f4a2b9d6"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+# Frozen copy of models.clients.repartition_clients_ddl as of this revision
+PARTITION_COUNT_SQL = "SELECT count(*) FROM pg_inherits WHERE inhparent = 'takbackend.clients'::regclass"
+FOREIGN_KEYS = [
+    ("sequence", "takbackend.clientsequences"),
+    ("server", "takbackend.takinstances"),
+]
+# name, columns, unique, where
+INDEXES = [
+    ("clients_deleted_idx", ["deleted"], False, "deleted IS NOT NULL"),
+    ("clients_live_sequence_idx", ["sequence"], False, "deleted IS NULL"),
+    ("clients_live_server_idx", ["server"], False, "deleted IS NULL"),
+    ("clients_shortcode_unique", ["shortcode"], True, None),
+    ("server_name_unique", ["server", "name"], True, None),
+]
+SHORTCODES_DDL = [
+    "CREATE TABLE IF NOT EXISTS takbackend.clients_shortcodes (shortcode VARCHAR PRIMARY KEY, client UUID NOT NULL)",
+    "TRUNCATE takbackend.clients_shortcodes",
+    "INSERT INTO takbackend.clients_shortcodes (shortcode, client) SELECT shortcode, pk FROM takbackend.clients",
+    """CREATE OR REPLACE FUNCTION takbackend.clients_shortcodes_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM takbackend.clients_shortcodes WHERE shortcode = OLD.shortcode;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        INSERT INTO takbackend.clients_shortcodes (shortcode, client) VALUES (NEW.shortcode, NEW.pk);
+    END IF;
+    RETURN NULL;
+END
+$$""",
+    "CREATE TRIGGER clients_shortcodes_sync AFTER INSERT OR DELETE OR UPDATE OF shortcode ON takbackend.clients"
+    " FOR EACH ROW EXECUTE FUNCTION takbackend.clients_shortcodes_sync()",
+]
+SHORTCODES_DROP_DDL = [
+    "DROP TABLE IF EXISTS takbackend.clients_shortcodes",
+    "DROP FUNCTION IF EXISTS takbackend.clients_shortcodes_sync()",
+]
+
+
+def repartition_ddl(partitions: int) -> List[str]:
+    """Rebuild clients with the given number of hash partitions on server, plain table for 0"""
+    statements = ["CREATE TABLE takbackend.clients_repartition (LIKE takbackend.clients INCLUDING DEFAULTS)"]
+    if partitions:
+        statements[0] += " PARTITION BY HASH (server)"
+        statements.extend(
+            f"CREATE TABLE takbackend.clients_repartition_p{idx} PARTITION OF takbackend.clients_repartition"
+            f" FOR VALUES WITH (MODULUS {partitions}, REMAINDER {idx})"
+            for idx in range(partitions)
+        )
+    statements += [
+        "INSERT INTO takbackend.clients_repartition SELECT * FROM takbackend.clients",
+        "DROP TABLE takbackend.clients",
+        "ALTER TABLE takbackend.clients_repartition RENAME TO clients",
+    ]
+    statements.extend(
+        f"ALTER TABLE takbackend.clients_repartition_p{idx} RENAME TO clients_p{idx}" for idx in range(partitions)
+    )
+
+    def column_list(columns: List[str], unique: bool = True) -> str:
+        """Quoted column list, partition key appended for unique ones"""
+        if unique and partitions and "server" not in columns:
+            columns = columns + ["server"]
+        return ", ".join(f'"{column}"' for column in columns)
+
+    if not partitions:
+        statements.append("ALTER TABLE takbackend.clients ALTER COLUMN server DROP NOT NULL")
+    statements.append(f"ALTER TABLE takbackend.clients ADD CONSTRAINT clients_pkey PRIMARY KEY ({column_list(['pk'])})")
+    for column, referred in FOREIGN_KEYS:
+        statements.append(
+            f"ALTER TABLE takbackend.clients ADD CONSTRAINT clients_{column}_fkey FOREIGN KEY ({column})"
+            f" REFERENCES {referred} (pk)"
+        )
+    for name, columns, unique, where in INDEXES:
+        statement = (
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON takbackend.clients ({column_list(columns, unique)})"
+        )
+        if where is not None:
+            statement += f" WHERE {where}"
+        statements.append(statement)
+    statements.extend(SHORTCODES_DDL if partitions else SHORTCODES_DROP_DDL)
+    statements.append("ANALYZE takbackend.clients")
+    return statements
+
+
+def upgrade() -> None:
+    # Plain table stays as is unless asked, use the partition-clients CLI command to change later
+    if not CLIENTS_PARTITIONS:
+        return
+    for statement in repartition_ddl(CLIENTS_PARTITIONS):
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    if not op.get_bind().execute(sa.text(PARTITION_COUNT_SQL)).scalar():
+        return
+    for statement in repartition_ddl(0):
+        op.execute(statement)
@@ -0,0 +1,31 @@
+"""Add certs-api probe result columns to takinstances
+
+Revision ID: f4c8a1d2e3b5
+Revises: e2a9b6d41c07
+Create Date: 2026-10-19 21:05:12.530418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "f4c8a1d2e3b5"  # pragma: allowlist secret
+down_revision = "e2a9b6d41c07"  # pragma: allowlist secret
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The archive table must have the same columns, archival copies all of them
+    for table in ("takinstances", "takinstances_archive"):
+        op.add_column(table, sa.Column("certsapi_ready", sa.Boolean(), nullable=True), schema="takbackend")
+        op.add_column(
+            table, sa.Column("certsapi_checked", sa.DateTime(timezone=True), nullable=True), schema="takbackend"
+        )
+
+
+def downgrade() -> None:
+    for table in ("takinstances_archive", "takinstances"):
+        op.drop_column(table, "certsapi_checked", schema="takbackend")
+        op.drop_column(table, "certsapi_ready", schema="takbackend")
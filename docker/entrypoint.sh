@@ -1,8 +1,12 @@
 #!/bin/bash -l
 set -e
 if [ "$#" -eq 0 ]; then
+  # Metrics are shared between the gunicorn workers via files in this dir, stale ones must not survive restarts
+  export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/takbackend_metrics}"
+  rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+  mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
   # FIXME: can we know the traefik internal docker ip easily ?
-  exec gunicorn takbackend.api:APP --bind 0.0.0.0:8000 --forwarded-allow-ips='*' -w 4 -k uvicorn.workers.UvicornWorker
+  exec gunicorn takbackend.api:APP --bind 0.0.0.0:8000 --forwarded-allow-ips='*' -w 4 -k uvicorn.workers.UvicornWorker -c python:takbackend.gunicorn_conf
 else
   exec "$@"
 fi
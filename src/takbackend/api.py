@@ -1,17 +1,32 @@
 """Main API entrypoint"""
-from typing import Mapping
+from typing import Any, Dict, Mapping
 import logging
 
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Response
 from libadvian.logging import init_logging
 from arkia11napi.middleware import DBWrapper
 
-from .config import STATIC_PATH, LOG_LEVEL
+from .config import LOG_LEVEL, PROFILING_ENABLED
 from .views.instances import INSTANCE_ROUTER
 from .views.callbacks import CALLBACKS_ROUTER
 from .views.instructions import INSTRUCTIONS_ROUTER
 from .views.clients import CLIENTS_ROUTER
+from .views.csequences import CSEQUENCES_ROUTER
+from .views.metrics import METRICS_ROUTER, COLLECTED_UPDATER
+from .views.profiling import PROFILING_ROUTER
+from .metrics import MetricsMiddleware
+from .compression import CompressionMiddleware
+from .staticassets import STATIC_FILES
+from .profiling import ProfilingMiddleware
+from .security import PipelineTokens, init_signing_key
+from .cachebus import LISTENER as INVALIDATION_LISTENER
+from .archival import ARCHIVAL_JOB
+from .readiness import WATCHER as READINESS_WATCHER
+from .prober import FLEET_PROBER
+from .mailer import DISPATCHER as MAIL_DISPATCHER
+from . import replica
+from . import warmup
+from .tracing import init_tracing, shutdown_tracing
 
 from . import models
 from . import __version__
@@ -19,18 +34,148 @@ from . import __version__
 
 LOGGER = logging.getLogger(__name__)
 APP = FastAPI(docs_url="/api/docs", openapi_url="/api/openapi.json", version=__version__)
-APP.mount("/static", StaticFiles(directory=str(STATIC_PATH)), name="static")
+APP.mount("/static", STATIC_FILES, name="static")
 APP.include_router(INSTRUCTIONS_ROUTER)
 APP.include_router(CALLBACKS_ROUTER)
 APP.include_router(INSTANCE_ROUTER)
 APP.include_router(CLIENTS_ROUTER)
+APP.include_router(CSEQUENCES_ROUTER)
+APP.include_router(METRICS_ROUTER)
+APP.add_middleware(CompressionMiddleware)
+APP.add_middleware(MetricsMiddleware)
+if PROFILING_ENABLED:
+    APP.include_router(PROFILING_ROUTER)
+    APP.add_middleware(ProfilingMiddleware)
+init_tracing(APP)
 WRAPPER = DBWrapper(gino=models.db)
 WRAPPER.init_app(APP)
 
 init_logging(LOG_LEVEL)
 
 
+@APP.on_event("startup")
+async def start_pipelinetokens() -> None:
+    """Fetch the pipeline secrets now and keep them fresh in the background"""
+    tokens = PipelineTokens.singleton()
+    try:
+        await tokens.ensure()
+    except Exception as exc:  # pylint: disable=W0703
+        # Do not prevent startup, the refresher will keep trying
+        LOGGER.exception("Could not fetch pipeline secrets: {}".format(exc))
+    tokens.start_refresher()
+
+
+@APP.on_event("shutdown")
+async def stop_pipelinetokens() -> None:
+    """Stop the refresher and close the keyvault client"""
+    await PipelineTokens.singleton().stop()
+
+
+@APP.on_event("startup")
+async def check_signing_key() -> None:
+    """Complain now if the client cookie secret is missing"""
+    init_signing_key()
+
+
 @APP.get("/api/v1", tags=["misc"])
 async def hello() -> Mapping[str, str]:
     """Say hello"""
     return {"message": "Hello World"}
+
+
+@APP.on_event("startup")
+async def start_invalidation_listener() -> None:
+    """Listen for cache invalidations from other workers"""
+    INVALIDATION_LISTENER.start()
+
+
+@APP.on_event("shutdown")
+async def stop_invalidation_listener() -> None:
+    """Stop listening for cache invalidations"""
+    await INVALIDATION_LISTENER.stop()
+
+
+@APP.on_event("startup")
+async def connect_replica() -> None:
+    """Create the read replica pool if configured"""
+    await replica.connect()
+
+
+@APP.on_event("shutdown")
+async def disconnect_replica() -> None:
+    """Close the read replica pool"""
+    await replica.disconnect()
+
+
+@APP.on_event("startup")
+async def warm_up() -> None:
+    """Warm up before the worker starts accepting requests, must be the last startup hook that touches DB"""
+    await warmup.warm_up()
+
+
+@APP.get("/api/v1/ready", tags=["misc"])
+async def ready(response: Response) -> Dict[str, Any]:
+    """Is this worker warmed up, 503 until it is"""
+    if not warmup.READY:
+        response.status_code = 503
+    return {"ready": warmup.READY, "warmup": warmup.TIMINGS}
+
+
+@APP.on_event("startup")
+async def start_collected_metrics() -> None:
+    """Keep the pool and cache gauges of this worker up to date"""
+    COLLECTED_UPDATER.start()
+
+
+@APP.on_event("shutdown")
+async def stop_collected_metrics() -> None:
+    """Stop updating the pool and cache gauges"""
+    await COLLECTED_UPDATER.stop()
+
+
+@APP.on_event("startup")
+async def start_archival() -> None:
+    """Periodically move old soft-deleted rows to the archive tables"""
+    ARCHIVAL_JOB.start()
+
+
+@APP.on_event("shutdown")
+async def stop_archival() -> None:
+    """Stop the archival job"""
+    await ARCHIVAL_JOB.stop()
+
+
+@APP.on_event("startup")
+async def start_readiness_watcher() -> None:
+    """Watch the instances someone is waiting for"""
+    READINESS_WATCHER.start()
+
+
+@APP.on_event("shutdown")
+async def stop_readiness_watcher() -> None:
+    """Stop the readiness watcher"""
+    await READINESS_WATCHER.stop()
+
+
+@APP.on_event("startup")
+async def start_fleet_prober() -> None:
+    """Periodically check which instances have their certs-api up"""
+    FLEET_PROBER.start()
+
+
+@APP.on_event("shutdown")
+async def stop_fleet_prober() -> None:
+    """Stop the fleet prober"""
+    await FLEET_PROBER.stop()
+
+
+@APP.on_event("shutdown")
+async def stop_mail_dispatcher() -> None:
+    """Close the SMTP connection"""
+    await MAIL_DISPATCHER.stop()
+
+
+@APP.on_event("shutdown")
+async def stop_tracing() -> None:
+    """Flush the pending spans"""
+    shutdown_tracing()
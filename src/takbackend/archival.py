@@ -0,0 +1,100 @@
+"""Move long ago soft-deleted rows to the archive tables so the hot tables and their indexes stay small"""
+from typing import Any, Dict, Optional
+import asyncio
+import datetime
+import logging
+
+import sqlalchemy as sa
+
+from .config import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_INTERVAL
+from .models import db, ARCHIVE_TABLES
+
+LOGGER = logging.getLogger(__name__)
+LOCK_KEY = 0x74616B61  # pg_try_advisory_lock key, only one worker/process archives at a time
+
+
+def batch_query(model: Any, cutoff: datetime.datetime, batch_size: int) -> Any:
+    """Single statement that deletes one batch from the hot table and inserts it to the archive table
+
+    Rows still referenced from the hot tables are skipped, rows locked by someone else are left for next time."""
+    table = model.__table__
+    candidates = sa.select([table.c.pk]).where(table.c.deleted < cutoff)
+    for other in ARCHIVE_TABLES:
+        for fkey in other.__table__.foreign_keys:
+            if fkey.column.table is table:
+                candidates = candidates.where(~sa.exists().where(fkey.parent == table.c.pk))
+    candidates = candidates.limit(batch_size).with_for_update(skip_locked=True)
+    moved = table.delete().where(table.c.pk.in_(candidates)).returning(*table.columns).cte("moved")
+    names = [column.name for column in table.columns]
+    return ARCHIVE_TABLES[model].insert().from_select(names, sa.select([moved.c[name] for name in names]))
+
+
+async def archive_deleted(
+    older_than_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE
+) -> Optional[Dict[str, int]]:
+    """Archive rows soft-deleted more than older_than_days ago, each batch in its own transaction.
+
+    Returns moved row counts per table or None if someone else is already archiving"""
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=older_than_days)
+    moved: Dict[str, int] = {}
+    async with db.acquire() as conn:
+        # Session level lock, released below (or when the connection dies)
+        if not await conn.scalar(sa.select([sa.func.pg_try_advisory_lock(LOCK_KEY)])):
+            LOGGER.info("Archival already running elsewhere")
+            return None
+        try:
+            for model in ARCHIVE_TABLES:
+                tablename = model.__tablename__
+                moved[tablename] = 0
+                query = batch_query(model, cutoff, batch_size)
+                while True:
+                    async with conn.transaction():
+                        status, _ = await conn.status(query)
+                    count = int(status.split()[-1])  # "INSERT 0 <count>"
+                    moved[tablename] += count
+                    if count < batch_size:
+                        break
+                LOGGER.debug("Archived {} rows from {}".format(moved[tablename], tablename))
+        finally:
+            await conn.scalar(sa.select([sa.func.pg_advisory_unlock(LOCK_KEY)]))
+    return moved
+
+
+class ArchivalJob:
+    """Run archive_deleted every ARCHIVE_INTERVAL seconds in background"""
+
+    def __init__(self) -> None:
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    async def run(self) -> None:
+        """Archive forever"""
+        while True:
+            await asyncio.sleep(ARCHIVE_INTERVAL)
+            try:
+                moved = await archive_deleted()
+                if moved and any(moved.values()):
+                    LOGGER.info("Archived {}".format(moved))
+            except Exception as exc:  # pylint: disable=W0703
+                LOGGER.exception("Archival failed {}".format(exc))
+
+    def start(self) -> None:
+        """Start in background unless disabled"""
+        if not ARCHIVE_INTERVAL:
+            return
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self.run(), name="archival_job")
+
+    async def stop(self) -> None:
+        """Stop the background task"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+ARCHIVAL_JOB = ArchivalJob()
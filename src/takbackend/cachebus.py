@@ -0,0 +1,144 @@
+"""Cross-worker cache invalidation via Postgres LISTEN/NOTIFY
+
+The model write helpers (TAKInstance.create_new, soft_delete_many etc) call publish(kind, key) and every worker
+(including the writer) calls the callbacks subscribed to that kind.
+If the listening connection is lost all caches are cleared since we might have missed events.
+"""
+from typing import Any, Callable, Dict, List, Optional, TYPE_CHECKING
+from collections import defaultdict
+import asyncio
+import json
+import logging
+
+import asyncpg
+import sqlalchemy as sa
+
+from . import dbconfig
+from .models.base import db
+
+if TYPE_CHECKING:
+    from .models.instance import SoftDeleted
+
+LOGGER = logging.getLogger(__name__)
+CHANNEL = "takbackend_invalidate"
+KEEPALIVE_INTERVAL = 30
+RECONNECT_INTERVAL = 5
+MAX_KEYS_PER_NOTIFY = 100  # NOTIFY payload must be under 8000 bytes
+ALL_KEYS = "*"  # Given to callbacks when everything must go
+MAX_KEYS_BEFORE_FLUSH = 1000  # Publish ALL_KEYS instead of more keys than this
+
+TAKINSTANCE = "takinstance"  # key is the instance pk, evict everything derived from the instance (incl. sequences)
+CLIENTSEQUENCE = "clientsequence"  # key is the sequence pk
+CLIENT = "client"  # key is the client pk
+
+InvalidationCallback = Callable[[str], None]
+SUBSCRIBERS: Dict[str, List[InvalidationCallback]] = defaultdict(list)
+
+
+def subscribe(kind: str, callback: InvalidationCallback) -> None:
+    """Call callback with the key when kind with key is invalidated (ALL_KEYS if everything is)"""
+    SUBSCRIBERS[kind].append(callback)
+
+
+def dispatch(kind: str, key: str) -> None:
+    """Call the subscribers of kind"""
+    for callback in SUBSCRIBERS.get(kind, []):
+        try:
+            callback(key)
+        except Exception as exc:  # pylint: disable=W0703
+            LOGGER.exception("Invalidation callback failed {}".format(exc))
+
+
+def dispatch_all() -> None:
+    """Tell everyone to drop everything"""
+    for kind in list(SUBSCRIBERS.keys()):
+        dispatch(kind, ALL_KEYS)
+
+
+async def publish(kind: str, *keys: Any) -> None:
+    """Evict locally right away and notify all workers, inside transaction the notify is delivered on commit"""
+    strkeys = [str(key) for key in keys]
+    for key in strkeys:
+        dispatch(kind, key)
+    for idx in range(0, len(strkeys), MAX_KEYS_PER_NOTIFY):
+        payload = json.dumps({"kind": kind, "keys": strkeys[idx : idx + MAX_KEYS_PER_NOTIFY]})
+        await db.status(sa.select([sa.func.pg_notify(CHANNEL, payload)]))
+
+
+async def publish_soft_deleted(deleted: "SoftDeleted") -> None:
+    """Invalidate everything TAKInstance.soft_delete_many marked deleted, big cascades just flush the kind"""
+    for kind, keys in (
+        (TAKINSTANCE, [instance.pk for instance in deleted.instances]),
+        (CLIENTSEQUENCE, deleted.sequence_pks),
+        (CLIENT, deleted.client_pks),
+    ):
+        if len(keys) > MAX_KEYS_BEFORE_FLUSH:
+            await publish(kind, ALL_KEYS)
+        elif keys:
+            await publish(kind, *keys)
+
+
+class InvalidationListener:
+    """LISTEN on dedicated connection and dispatch the notifications"""
+
+    def __init__(self) -> None:
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    @staticmethod
+    def _on_notify(_conn: Any, _pid: int, _channel: str, payload: str) -> None:
+        """asyncpg listener callback"""
+        try:
+            data = json.loads(payload)
+            for key in data["keys"]:
+                dispatch(data["kind"], key)
+        except (ValueError, KeyError, TypeError) as exc:
+            LOGGER.error("Invalid invalidation payload {}: {}".format(payload, exc))
+
+    async def _listen(self) -> None:
+        """Connect, listen and keep the connection alive until it's lost"""
+        conn = await asyncpg.connect(str(dbconfig.DSN), ssl=dbconfig.SSL)
+        lost = asyncio.Event()
+        conn.add_termination_listener(lambda _conn: lost.set())
+        try:
+            await conn.add_listener(CHANNEL, self._on_notify)
+            # Anything could have happened while we were not listening
+            dispatch_all()
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), timeout=KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    await conn.fetchval("SELECT 1")
+        finally:
+            if not conn.is_closed():
+                await conn.close()
+
+    async def run(self) -> None:
+        """Listen forever, reconnecting as needed"""
+        while True:
+            try:
+                await self._listen()
+                LOGGER.warning("Invalidation listener connection lost")
+            except Exception as exc:  # pylint: disable=W0703
+                LOGGER.exception("Invalidation listener failed {}".format(exc))
+            dispatch_all()
+            await asyncio.sleep(RECONNECT_INTERVAL)
+
+    def start(self) -> None:
+        """Start listening in background"""
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self.run(), name="invalidation_listener")
+
+    async def stop(self) -> None:
+        """Stop listening"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+LISTENER = InvalidationListener()
@@ -1,22 +1,44 @@
 """helpers for dealing with the certs api on the actual takserver instance"""
-from typing import Optional, Any, Tuple, Dict, cast
+from typing import Optional, Any, Tuple, Dict, Sequence, cast
 import logging
 from pathlib import Path
 import datetime
 import asyncio
+import contextlib
 
 import aiohttp
 from aiohttp.client_exceptions import ClientError
 
 from .models import TAKInstance
+from .config import CERTSAPI_CONCURRENCY
+from .security import encrypt_field, decrypt_field
+from .metrics import OUTBOUND_LATENCY, OUTBOX_DEPTH
+from .tracing import span
 
 LOGGER = logging.getLogger(__name__)
 CERTAPI_PING_INTERVAL = 30
 CERTAPI_PING_TIMEOUT = datetime.timedelta(minutes=30)
 
 
+def certsapi_fields(tfoutputs: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """Validate tfoutputs and derive the certs-api connection columns, raises ValueError if not valid"""
+    try:
+        bearer_token = str(tfoutputs["cert_api_token"]["value"])
+        dns_name = str(tfoutputs["dns_name"]["value"])
+    except (KeyError, TypeError) as exc:
+        raise ValueError(f"tfoutputs not valid: {exc}") from exc
+    return {
+        "dns_name": dns_name,
+        "certsapi_base": f"https://{dns_name}/api",
+        "certsapi_token": encrypt_field(bearer_token),
+    }
+
+
 def get_http_options(instance: TAKInstance) -> Tuple[str, Dict[str, str]]:
     """get the api base and auth (etc headers"""
+    if instance.certsapi_base and instance.certsapi_token:
+        return instance.certsapi_base, {"Authorization": f"Bearer {decrypt_field(instance.certsapi_token)}"}
+    # Token could not be stored encrypted, parse from tfoutputs
     instance.tfoutputs = cast(Dict[str, Any], instance.tfoutputs)
     bearer_token = instance.tfoutputs["cert_api_token"]["value"]
     dns_name = instance.tfoutputs["dns_name"]["value"]
@@ -25,14 +47,18 @@ def get_http_options(instance: TAKInstance) -> Tuple[str, Dict[str, str]]:
     return api_base, headers
 
 
-async def ping_certsapi(instance: TAKInstance) -> bool:
-    """Check that certsapi is up"""
+async def ping_certsapi(instance: TAKInstance, session: Optional[aiohttp.ClientSession] = None) -> bool:
+    """Check that certsapi is up, pass session to reuse its connection pool when pinging many"""
     api_base, headers = get_http_options(instance)
+    url = f"{api_base}/v1"
     try:
-        async with aiohttp.ClientSession(headers=headers) as session:
-            url = f"{api_base}/v1"
+        async with contextlib.AsyncExitStack() as stack:
+            if session is None:
+                session = await stack.enter_async_context(aiohttp.ClientSession())
             LOGGER.debug("GETting {}".format(url))
-            async with session.get(url) as resp:
+            with OUTBOUND_LATENCY.labels("certsapi", "ping").time():
+                resp = await session.get(url, headers=headers)
+            async with resp:
                 if resp.status == 200:
                     return True
                 LOGGER.info("Non 200 response {}".format(resp))
@@ -45,18 +71,18 @@ async def ping_certsapi(instance: TAKInstance) -> bool:
 async def ping_until_ok(instance: TAKInstance) -> bool:
     """Calls ping_certsapi until it responds with True or we time out"""
     started = datetime.datetime.now()
-    while not await ping_certsapi(instance):
-        if (datetime.datetime.now() - started) > CERTAPI_PING_TIMEOUT:
-            LOGGER.debug("Timed out waiting for certsapi for {}".format(str(instance.pk)))
-            return False
-        LOGGER.debug("waiting for certsapi for {}".format(str(instance.pk)))
-        await asyncio.sleep(CERTAPI_PING_INTERVAL)
+    with span("certsapi.ping_until_ok", instance=str(instance.pk)):
+        while not await ping_certsapi(instance):
+            if (datetime.datetime.now() - started) > CERTAPI_PING_TIMEOUT:
+                LOGGER.debug("Timed out waiting for certsapi for {}".format(str(instance.pk)))
+                return False
+            LOGGER.debug("waiting for certsapi for {}".format(str(instance.pk)))
+            await asyncio.sleep(CERTAPI_PING_INTERVAL)
     return True
 
 
-async def get_or_create_client_zip(instance: TAKInstance, name: str, filepath: Path) -> bool:
-    """Get the given client to a temporary directory"""
-    api_base, headers = get_http_options(instance)
+async def fetch_client_zip(session: aiohttp.ClientSession, api_base: str, name: str) -> bytes:
+    """Get the client zip contents, create the client if it does not exist yet"""
 
     async def get_client_zip(session: aiohttp.ClientSession) -> Optional[bytes]:
         """do the get, DRY"""
@@ -69,7 +95,7 @@ async def get_or_create_client_zip(instance: TAKInstance, name: str, filepath: P
                 return None
             return await resp.read()
 
-    async with aiohttp.ClientSession(headers=headers) as session:
+    with span("certsapi.client_zip", client=name), OUTBOUND_LATENCY.labels("certsapi", "client_zip").time():
         content = await get_client_zip(session)
         if content is None:
             url = f"{api_base}/v1/clients"
@@ -78,10 +104,43 @@ async def get_or_create_client_zip(instance: TAKInstance, name: str, filepath: P
             async with session.post(url, json=data) as resp:
                 resp.raise_for_status()
                 content = await resp.read()
-        if not content:
-            raise ValueError("Could not get zip content")
+    if not content:
+        raise ValueError("Could not get zip content")
+    return content
 
+
+async def get_or_create_client_zip(instance: TAKInstance, name: str, filepath: Path) -> bool:
+    """Get the given client to a temporary directory"""
+    api_base, headers = get_http_options(instance)
+    async with aiohttp.ClientSession(headers=headers) as session:
+        content = await fetch_client_zip(session, api_base, name)
         with filepath.open("wb") as fpntr:
             fpntr.write(content)
 
     return True
+
+
+async def get_or_create_client_zips(
+    instance: TAKInstance, names: Sequence[str], limit: int = CERTSAPI_CONCURRENCY
+) -> Dict[str, bytes]:
+    """Get many clients zips using single session and at most limit requests in flight"""
+    api_base, headers = get_http_options(instance)
+    semaphore = asyncio.Semaphore(limit)
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+
+        async def fetch_one(name: str) -> bytes:
+            """Wait for the semaphore and fetch"""
+            queued = OUTBOX_DEPTH.labels("certsapi")
+            queued.inc()
+            try:
+                await semaphore.acquire()
+            finally:
+                queued.dec()
+            try:
+                return await fetch_client_zip(session, api_base, name)
+            finally:
+                semaphore.release()
+
+        contents = await asyncio.gather(*(fetch_one(name) for name in names))
+    return dict(zip(names, contents))
@@ -0,0 +1,163 @@
+"""gzip/brotli compression of the responses
+
+The instruction pages with their inline base64 QR codes and zips and the JSON listings compress well and the
+field users are often on weak links. Brotli is used when the compression extra is installed and the client accepts it.
+Already encoded, streamed (server-sent events, files) and non-compressible responses (zip, images) are passed as is.
+"""
+from typing import Any, Awaitable, Callable, List, MutableMapping, Optional, Sequence, Tuple
+import gzip
+import importlib.util
+
+from .config import COMPRESSION_MIN_SIZE, COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_QUALITY
+
+# Imported only when first needed
+BROTLI_AVAILABLE = importlib.util.find_spec("brotli") is not None
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+# Compressing these gains next to nothing
+SKIP_CONTENT_TYPES = (
+    "application/zip",
+    "application/gzip",
+    "text/event-stream",
+    "image/",
+    "video/",
+    "audio/",
+    "font/woff",
+)
+ETAG_SUFFIXES = {"gzip": "-gz", "br": "-br"}  # each encoding is a different representation so needs its own ETag
+
+
+def accepted_encodings(accept_encoding: str) -> List[str]:
+    """The content-codings from Accept-Encoding the client accepts (q > 0)"""
+    ret: List[str] = []
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            ret.append(coding.strip().lower())
+    return ret
+
+
+def choose_encoding(accept_encoding: str, available: Sequence[str]) -> Optional[str]:
+    """Best of the available encodings the client accepts, available is in order of preference"""
+    accepted = accepted_encodings(accept_encoding)
+    for coding in available:
+        if coding in accepted or "*" in accepted:
+            return coding
+    return None
+
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """Compress with the given content-coding, level defaults to the configured one"""
+    if encoding == "br":
+        import brotli  # pylint: disable=C0415,E0401 ; # optional dependency
+
+        return bytes(brotli.compress(data, quality=COMPRESSION_BROTLI_QUALITY if level is None else level))
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=COMPRESSION_GZIP_LEVEL if level is None else level, mtime=0)
+    raise ValueError(f"Unsupported encoding {encoding}")
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """The ETag of the encoded representation, identity keeps the original"""
+    suffix = ETAG_SUFFIXES.get(encoding, "")
+    if not suffix or not etag.endswith('"'):
+        return etag
+    return etag[:-1] + suffix + '"'
+
+
+def available_encodings() -> Tuple[str, ...]:
+    """What we can compress with, in order of preference"""
+    if BROTLI_AVAILABLE:
+        return ("br", "gzip")
+    return ("gzip",)
+
+
+class CompressionMiddleware:  # pylint: disable=R0903
+    """Compress single-message responses of at least minimum_size bytes"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = available_encodings()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = ""
+        for key, value in scope["headers"]:
+            if key == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept, self.encodings) if accept else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        passthru = False
+
+        async def send_wrapper(message: Message) -> None:
+            """Hold the response start until we know if the body gets compressed"""
+            nonlocal start, passthru
+            if passthru or message["type"] not in ("http.response.start", "http.response.body"):
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start = message
+                if not self._compressible(start):
+                    passthru = True
+                    await send(start)
+                return
+            assert start is not None
+            body = message.get("body", b"")
+            passthru = True
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                # Streamed or small, not worth it
+                await send(start)
+                await send(message)
+                return
+            compressed = compress(body, encoding)
+            headers = [
+                (
+                    key,
+                    encoded_etag(value.decode("latin-1"), encoding).encode("latin-1")
+                    if key.lower() == b"etag"
+                    else value,
+                )
+                for key, value in start["headers"]
+                if key.lower() != b"content-length"
+            ]
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+            headers.append((b"content-length", str(len(compressed)).encode("latin-1")))
+            await send({**start, "headers": headers})
+            await send({**message, "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _compressible(start: Message) -> bool:
+        """Check status and headers, also adds Vary when the body might get compressed"""
+        if start["status"] < 200 or start["status"] in (204, 304):
+            return False
+        content_type = b""
+        for key, value in start["headers"]:
+            key = key.lower()
+            if key == b"content-encoding":
+                return False
+            if key == b"content-type":
+                content_type = value.lower()
+        if content_type.decode("latin-1").startswith(SKIP_CONTENT_TYPES):
+            return False
+        start["headers"] = list(start["headers"]) + [(b"vary", b"Accept-Encoding")]
+        return True
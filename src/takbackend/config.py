@@ -3,6 +3,7 @@ from typing import Optional
 from pathlib import Path
 
 from starlette.config import Config
+from starlette.datastructures import Secret
 
 cfg = Config(".env")
 
@@ -28,5 +29,63 @@ DOCTEMPLATE_URL: str = cfg(
 )
 PIPELINE_SSHKEY_OVERRIDE: Optional[str] = cfg("PIPELINE_SSHKEY_OVERRIDE", default=None)
 PIPELINE_TOKEN_OVERRIDE: Optional[str] = cfg("PIPELINE_TOKEN_OVERRIDE", default=None)
+PIPELINE_TOKEN_TTL: int = cfg("PIPELINE_TOKEN_TTL", default=3600, cast=int)  # seconds
+PIPELINE_TOKEN_REFRESH_MARGIN: int = cfg("PIPELINE_TOKEN_REFRESH_MARGIN", default=300, cast=int)  # seconds
 PIPELINE_SUPPRESS: bool = cfg("PIPELINE_SUPPRESS", default=False, cast=bool)
+PIPELINE_CONCURRENCY: int = cfg("PIPELINE_CONCURRENCY", default=5, cast=int)
+CERTSAPI_CONCURRENCY: int = cfg("CERTSAPI_CONCURRENCY", default=8, cast=int)
+BULK_MAX_ITEMS: int = cfg("BULK_MAX_ITEMS", default=200, cast=int)
 ORDER_READY_SUBJECT: str = cfg("ORDER_READY_SUBJECT", default="Tässä PVArki-tilauksesi")
+CLIENT_COOKIE_SECRET: Optional[Secret] = cfg("CLIENT_COOKIE_SECRET", cast=Secret, default=None)  # required
+# For local development only: random signing key if CLIENT_COOKIE_SECRET is not set, cookies break on restart
+CLIENT_COOKIE_INSECURE_DEV: bool = cfg("CLIENT_COOKIE_INSECURE_DEV", default=False, cast=bool)
+CLIENT_COOKIE_MAX_AGE: int = cfg("CLIENT_COOKIE_MAX_AGE", default=60 * 60 * 24 * 90, cast=int)  # seconds
+# Crawler and link previewer tokens, not the brand names: in-app browsers of the same apps (Telegram-Android,
+# Slack/x.y, discord/x.y) are real users
+PREVIEW_USER_AGENTS: str = cfg(
+    "PREVIEW_USER_AGENTS",
+    default=(
+        r"\b(?:[\w-]*bot/|[\w-]*(?:crawler|spider)\b|googlebot|bingbot|bingpreview|telegrambot|discordbot"
+        r"|slackbot-linkexpanding|slack-imgproxy|twitterbot|linkedinbot|pinterestbot|redditbot|applebot"
+        r"|facebookexternalhit|facebot|whatsapp/|skypeuripreview|embedly|quora link preview|outbrain|vkshare"
+        r"|w3c_validator|google-pagerenderer|mattermost-bot|iframely)"
+    ),
+)
+FIELD_ENCRYPTION_KEY: Optional[Secret] = cfg("FIELD_ENCRYPTION_KEY", cast=Secret, default=None)  # Fernet key
+MODELCACHE_TTL: int = cfg("MODELCACHE_TTL", default=300, cast=int)  # seconds
+MODELCACHE_SIZE: int = cfg("MODELCACHE_SIZE", default=10000, cast=int)  # entries per cache
+METRICS_TOKEN: Optional[Secret] = cfg("METRICS_TOKEN", cast=Secret, default=None)  # Bearer for /metrics
+METRICS_PUBLIC: bool = cfg("METRICS_PUBLIC", default=False, cast=bool)  # Serve /metrics without METRICS_TOKEN
+METRICS_COLLECT_INTERVAL: int = cfg("METRICS_COLLECT_INTERVAL", default=15, cast=int)  # seconds, pool/cache gauges
+TRACING_EXPORTER: Optional[str] = cfg("TRACING_EXPORTER", default=None)  # console, file or otlp, unset disables
+TRACING_FILE: str = cfg("TRACING_FILE", default="/tmp/takbackend_traces.{pid}.jsonl")  # for the file exporter
+TRACING_SERVICE_NAME: str = cfg("TRACING_SERVICE_NAME", default="takbackend")
+PROFILING_ENABLED: bool = cfg("PROFILING_ENABLED", default=False, cast=bool)  # middleware is not even added if False
+PROFILING_HEADER: str = cfg("PROFILING_HEADER", default="x-takbackend-profile")
+PROFILING_PATH: Path = cfg("PROFILING_PATH", cast=Path, default=Path("/tmp/takbackend_profiles"))
+PROFILING_MIN_INTERVAL: int = cfg(
+    "PROFILING_MIN_INTERVAL", default=60, cast=int
+)  # seconds between profiled requests, shared by the workers on the host
+ARCHIVE_AFTER_DAYS: int = cfg("ARCHIVE_AFTER_DAYS", default=30, cast=int)  # soft-deleted rows older than this
+ARCHIVE_BATCH_SIZE: int = cfg("ARCHIVE_BATCH_SIZE", default=1000, cast=int)  # rows moved per transaction
+ARCHIVE_INTERVAL: int = cfg("ARCHIVE_INTERVAL", default=3600, cast=int)  # seconds between runs, 0 disables
+CLIENTS_PARTITIONS: int = cfg("CLIENTS_PARTITIONS", default=0, cast=int)  # hash partitions for clients, 0 = plain table
+WARMUP_DB_CONNECTIONS: int = cfg(
+    "WARMUP_DB_CONNECTIONS", default=4, cast=int
+)  # opened at startup, max DB_POOL_MAX_SIZE
+WARMUP_PRELOAD_INSTANCES: int = cfg("WARMUP_PRELOAD_INSTANCES", default=0, cast=int)  # most recent ones to modelcache
+WARMUP_TIMEOUT: float = cfg("WARMUP_TIMEOUT", default=30.0, cast=float)  # seconds, startup continues after this
+READINESS_POLL_INTERVAL: int = cfg("READINESS_POLL_INTERVAL", default=15, cast=int)  # seconds between watcher checks
+READINESS_PING_TIMEOUT: int = cfg("READINESS_PING_TIMEOUT", default=10, cast=int)  # seconds
+READINESS_KEEPALIVE: int = cfg("READINESS_KEEPALIVE", default=20, cast=int)  # seconds between SSE comments
+READINESS_STREAM_MAX: int = cfg("READINESS_STREAM_MAX", default=900, cast=int)  # seconds, EventSource reconnects
+PROBE_INTERVAL: int = cfg("PROBE_INTERVAL", default=300, cast=int)  # seconds between fleet certs-api sweeps, 0 disables
+PROBE_CONCURRENCY: int = cfg("PROBE_CONCURRENCY", default=32, cast=int)  # pings in flight during sweep
+PROBE_TIMEOUT: int = cfg("PROBE_TIMEOUT", default=10, cast=int)  # seconds per ping
+MAILER_RATE_LIMIT: float = cfg("MAILER_RATE_LIMIT", default=5.0, cast=float)  # messages per second, 0 = no limit
+MAILER_MAX_PER_CONNECTION: int = cfg("MAILER_MAX_PER_CONNECTION", default=100, cast=int)  # then reconnect
+MAILER_IDLE_TIMEOUT: float = cfg("MAILER_IDLE_TIMEOUT", default=30.0, cast=float)  # seconds before closing SMTP
+COMPRESSION_MIN_SIZE: int = cfg("COMPRESSION_MIN_SIZE", default=1024, cast=int)  # bytes, smaller bodies sent as is
+COMPRESSION_GZIP_LEVEL: int = cfg("COMPRESSION_GZIP_LEVEL", default=6, cast=int)
+COMPRESSION_BROTLI_QUALITY: int = cfg("COMPRESSION_BROTLI_QUALITY", default=5, cast=int)  # if brotli is installed
+STATIC_MAX_AGE: int = cfg("STATIC_MAX_AGE", default=300, cast=int)  # seconds, for the non-hashed static urls
@@ -1,14 +1,21 @@
 """CLI entrypoints for takbackend"""
-from typing import Any
+from typing import Any, Optional, Tuple
+from pathlib import Path
 import logging
 import asyncio
+import uuid
 
 import click
 
 from libadvian.logging import init_logging
 
 from takbackend import __version__, dbconfig, models
-from takbackend.dbdevhelpers import create_all, drop_all
+from takbackend.dbdevhelpers import create_all, drop_all, seed as seed_db
+from takbackend.loadgen import SCENARIOS, run_load
+from takbackend.dbcopy import export_fleet, import_fleet
+from takbackend.archival import archive_deleted
+from takbackend.config import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, CLIENTS_PARTITIONS
+from takbackend.pipelineclient import PipeLineClient
 
 
 LOGGER = logging.getLogger(__name__)
@@ -52,6 +59,141 @@ def drop_tables() -> None:
     asyncio.get_event_loop().run_until_complete(runner())
 
 
+@cligroup.command()
+@click.option("-g", "--grouping", help="Delete all instances in this grouping", default=None)
+@click.option("-p", "--pk", "pks", help="Delete instance with this UUID, can be given multiple times", multiple=True)
+def bulk_delete(grouping: Optional[str], pks: Tuple[str, ...]) -> None:
+    """Run the destroy pipelines for instances and mark deleted the ones whose destroy was triggered"""
+    if grouping is None and not pks:
+        raise click.UsageError("Give --grouping and/or --pk")
+
+    async def runner() -> None:
+        await models.db.set_bind(dbconfig.DSN)
+        query = models.TAKInstance.selection_query(grouping=grouping, pks=[uuid.UUID(pk) for pk in pks])
+        deleted, failed = await PipeLineClient().destroy_many(await query.gino.all())
+        for instance, error in failed:
+            click.echo(f"{instance.pk}: pipeline failed, not deleted: {error}", err=True)
+        click.echo(f"Deleted {len(deleted)} instances, {len(failed)} pipelines failed")
+
+    asyncio.get_event_loop().run_until_complete(runner())
+
+
+@cligroup.command()
+@click.option("-i", "--instances", help="Number of instances", default=100, show_default=True)
+@click.option("-s", "--sequences", help="Sequences per instance", default=2, show_default=True)
+@click.option("-c", "--clients", help="Clients per sequence", default=50, show_default=True)
+@click.option("-o", "--ownerid", help="Owner of the instances, random if not given", default=None)
+@click.option("-g", "--grouping", help="Grouping of the instances", default="seed", show_default=True)
+@click.option("--certsapi-base", help="Point the instances to this certs-api (stub)", default=None)
+def seed(  # pylint: disable=R0913
+    instances: int, sequences: int, clients: int, ownerid: Optional[str], grouping: str, certsapi_base: Optional[str]
+) -> None:
+    """Bulk insert completed instances with sequences and clients using COPY"""
+
+    async def runner() -> None:
+        await models.db.set_bind(dbconfig.DSN)
+        result = await seed_db(instances, sequences, clients, ownerid, grouping, certsapi_base)
+        click.echo(f"Inserted {result['counts']}")
+        click.echo(f"ownerid: {result['ownerid']}")
+        click.echo("sequence shortcodes: {}".format(" ".join(result["sequence_shortcodes"])))
+
+    asyncio.get_event_loop().run_until_complete(runner())
+
+
+@cligroup.command()
+@click.argument("base_url")
+@click.argument("scenario", type=click.Choice(sorted(SCENARIOS.keys())))
+@click.option("-t", "--target", "targets", help="Shortcode/pk for the scenario, can be given many times", multiple=True)
+@click.option("-c", "--concurrency", help="Concurrent requests", default=20, show_default=True)
+@click.option("-n", "--requests", help="Total requests", default=1000, show_default=True)
+@click.option("--token", help="Bearer token (JWT) for the requests", default=None)
+def loadgen(  # pylint: disable=R0913
+    base_url: str, scenario: str, targets: Tuple[str, ...], concurrency: int, requests: int, token: Optional[str]
+) -> None:
+    """Drive concurrent traffic against running server and print latency percentiles"""
+    try:
+        result = asyncio.get_event_loop().run_until_complete(
+            run_load(base_url, scenario, targets, concurrency, requests, token)
+        )
+    except ValueError as exc:
+        raise click.UsageError(str(exc)) from exc
+    click.echo(result.summary())
+
+
+@cligroup.command()
+@click.argument("directory", type=click.Path(file_okay=False, path_type=Path))
+def export_tables(directory: Path) -> None:
+    """Dump instances, sequences and clients to directory with binary COPY"""
+
+    async def runner() -> None:
+        await models.db.set_bind(dbconfig.DSN)
+        manifest = await export_fleet(directory)
+        for table, info in manifest["tables"].items():
+            click.echo(f"{table}: {info['rows']} rows")
+
+    asyncio.get_event_loop().run_until_complete(runner())
+
+
+@cligroup.command()
+@click.argument("directory", type=click.Path(exists=True, file_okay=False, path_type=Path))
+@click.option("--replace", is_flag=True, help="Empty the tables before loading")
+def import_tables(directory: Path, replace: bool) -> None:
+    """Load dump made with export-tables, pks and sequence counters are preserved"""
+
+    async def runner() -> None:
+        await models.db.set_bind(dbconfig.DSN)
+        try:
+            counts = await import_fleet(directory, replace=replace)
+        except ValueError as exc:
+            raise click.ClickException(str(exc)) from exc
+        for table, count in counts.items():
+            click.echo(f"{table}: {count} rows")
+
+    asyncio.get_event_loop().run_until_complete(runner())
+
+
+@cligroup.command()
+@click.option(
+    "-d",
+    "--days",
+    help="Archive rows deleted more than this many days ago",
+    default=ARCHIVE_AFTER_DAYS,
+    show_default=True,
+)
+@click.option("-b", "--batch-size", help="Rows moved per transaction", default=ARCHIVE_BATCH_SIZE, show_default=True)
+def archive(days: int, batch_size: int) -> None:
+    """Move old soft-deleted instances, sequences and clients to the archive tables"""
+
+    async def runner() -> None:
+        await models.db.set_bind(dbconfig.DSN)
+        moved = await archive_deleted(older_than_days=days, batch_size=batch_size)
+        if moved is None:
+            raise click.ClickException("Archival is already running elsewhere")
+        for table, count in moved.items():
+            click.echo(f"{table}: {count} rows")
+
+    asyncio.get_event_loop().run_until_complete(runner())
+
+
+@cligroup.command()
+@click.option(
+    "-p", "--partitions", help="Hash partitions, 0 for plain table", default=CLIENTS_PARTITIONS, show_default=True
+)
+def partition_clients(partitions: int) -> None:
+    """Rebuild the clients table hash partitioned on server, locks the table while copying the rows"""
+
+    async def runner() -> None:
+        await models.db.set_bind(dbconfig.DSN)
+        current = await models.Client.partition_count()
+        if current == partitions:
+            click.echo(f"clients already has {partitions} partitions")
+            return
+        await models.Client.repartition(partitions)
+        click.echo(f"clients repartitioned from {current} to {partitions} partitions")
+
+    asyncio.get_event_loop().run_until_complete(runner())
+
+
 def takbackend_cli() -> None:
     """models cli for quick and dirty devel ops, use alembic for actual migrations"""
     init_logging(logging.WARNING)
@@ -36,6 +36,13 @@ SSL = config("DB_SSL", cast=str, default="prefer")  # see asyncpg.connect()
 USE_CONNECTION_FOR_REQUEST = config("DB_USE_CONNECTION_FOR_REQUEST", cast=bool, default=True)
 RETRY_LIMIT = config("DB_RETRY_LIMIT", cast=int, default=1)
 RETRY_INTERVAL = config("DB_RETRY_INTERVAL", cast=int, default=1)
+# Optional read replica for the read-only endpoints, see replica.py
+REPLICA_DSN = config("DB_REPLICA_DSN", cast=make_url, default=None)
+REPLICA_POOL_MIN_SIZE = config("DB_REPLICA_POOL_MIN_SIZE", cast=int, default=1)
+REPLICA_POOL_MAX_SIZE = config("DB_REPLICA_POOL_MAX_SIZE", cast=int, default=16)
+REPLICA_FRESHNESS = config(
+    "DB_REPLICA_FRESHNESS", cast=float, default=5.0
+)  # seconds, newer writes are read from primary
 
 LOGGER.debug("DSN={}".format(DSN))
 LOGGER.debug("HOST={}".format(HOST))
@@ -0,0 +1,98 @@
+"""Export and import the fleet tables with Postgres binary COPY
+
+The export is a directory with one binary COPY file per table and a manifest telling which columns are in them.
+asyncpg streams the COPY data to/from the files so memory use does not depend on the table sizes.
+"""
+from typing import Any, Dict, List
+from pathlib import Path
+import json
+import logging
+
+import sqlalchemy
+
+from . import models, cachebus
+
+LOGGER = logging.getLogger(__name__)
+SCHEMA = "takbackend"
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+# In foreign key order
+FLEET_MODELS = (models.TAKInstance, models.ClientSequence, models.Client)
+
+
+def _columns(model: Any) -> List[str]:
+    """Column names of the model table"""
+    return [column.name for column in model.__table__.columns]
+
+
+async def _count(conn: Any, table: str) -> int:
+    """Row count"""
+    return int(await conn.scalar(sqlalchemy.text(f"SELECT count(*) FROM {SCHEMA}.{table}")))
+
+
+async def export_fleet(directory: Path) -> Dict[str, Any]:
+    """Dump the fleet tables to directory, consistent snapshot via REPEATABLE READ transaction"""
+    directory.mkdir(parents=True, exist_ok=True)
+    manifest: Dict[str, Any] = {"version": MANIFEST_VERSION, "tables": {}}
+    async with models.db.acquire() as conn:
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            for model in FLEET_MODELS:
+                table = model.__tablename__
+                columns = _columns(model)
+                filename = f"{table}.copy"
+                quoted = [f'"{column}"' for column in columns]
+                # COPY from query since partitioned tables can't be copied from directly
+                await conn.raw_connection.copy_from_query(
+                    f"SELECT {', '.join(quoted)} FROM {SCHEMA}.{table}",
+                    output=str(directory / filename),
+                    format="binary",
+                )
+                manifest["tables"][table] = {
+                    "file": filename,
+                    "columns": columns,
+                    "rows": await _count(conn, table),
+                }
+                LOGGER.info("Exported {} rows from {}".format(manifest["tables"][table]["rows"], table))
+    (directory / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    return manifest
+
+
+async def import_fleet(directory: Path, replace: bool = False) -> Dict[str, int]:
+    """Load the dump from directory in single transaction, with replace the tables are emptied first"""
+    manifest = json.loads((directory / MANIFEST_NAME).read_text(encoding="utf-8"))
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version {manifest.get('version')}")
+    for model in FLEET_MODELS:
+        table = model.__tablename__
+        if table not in manifest["tables"]:
+            raise ValueError(f"{table} missing from manifest")
+        unknown = set(manifest["tables"][table]["columns"]) - set(_columns(model))
+        if unknown:
+            raise ValueError(f"{table} in dump has columns not in database: {unknown}")
+
+    counts: Dict[str, int] = {}
+    async with models.db.acquire() as conn:
+        async with conn.transaction():
+            if replace:
+                tables = ", ".join(f"{SCHEMA}.{model.__tablename__}" for model in FLEET_MODELS)
+                await conn.status(sqlalchemy.text(f"TRUNCATE {tables}"))
+            for model in FLEET_MODELS:
+                table = model.__tablename__
+                info = manifest["tables"][table]
+                before = await _count(conn, table)
+                await conn.raw_connection.copy_to_table(
+                    table,
+                    source=str(directory / info["file"]),
+                    columns=info["columns"],
+                    schema_name=SCHEMA,
+                    format="binary",
+                )
+                counts[table] = await _count(conn, table) - before
+                if counts[table] != info["rows"]:
+                    raise ValueError(f"{table}: expected {info['rows']} rows, got {counts[table]}")
+                LOGGER.info("Imported {} rows to {}".format(counts[table], table))
+        for model in FLEET_MODELS:
+            await conn.status(sqlalchemy.text(f"ANALYZE {SCHEMA}.{model.__tablename__}"))
+    for kind in (cachebus.TAKINSTANCE, cachebus.CLIENTSEQUENCE, cachebus.CLIENT):
+        await cachebus.publish(kind, cachebus.ALL_KEYS)
+    return counts
@@ -1,16 +1,153 @@
 """DB related helpers for development"""
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import datetime
+import json
+import logging
+import uuid
+
 import sqlalchemy
 
 from . import models
+from .models.base import generate_shortcode
+from .models.clients import CLIENTS_SHORTCODES_DROP_DDL
+from .config import FIELD_ENCRYPTION_KEY, CLIENTS_PARTITIONS
+from .security import encrypt_field
+
+LOGGER = logging.getLogger(__name__)
+SEED_BATCH = 10000  # rows per COPY
 
 
 async def create_all() -> None:
     """Create all schemas and tables"""
     await models.db.status(sqlalchemy.schema.CreateSchema("takbackend"))
     await models.db.gino.create_all()
+    if CLIENTS_PARTITIONS:
+        await models.Client.repartition(CLIENTS_PARTITIONS)
 
 
 async def drop_all() -> None:
     """Drop all tables and schemas"""
     await models.db.gino.drop_all()
+    for statement in CLIENTS_SHORTCODES_DROP_DDL:
+        await models.db.status(sqlalchemy.text(statement))
     await models.db.status(sqlalchemy.schema.DropSchema("takbackend"))
+
+
+def _batched(records: Iterator[Tuple[Any, ...]], size: int = SEED_BATCH) -> Iterator[List[Tuple[Any, ...]]]:
+    """Split the record stream to lists of size"""
+    batch: List[Tuple[Any, ...]] = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _copy(conn: Any, model: Any, columns: Sequence[str], records: Iterator[Tuple[Any, ...]]) -> int:
+    """COPY the records to the model table in batches, returns row count"""
+    count = 0
+    for batch in _batched(records):
+        await conn.raw_connection.copy_records_to_table(
+            model.__tablename__, records=batch, columns=list(columns), schema_name="takbackend"
+        )
+        count += len(batch)
+    return count
+
+
+async def seed(  # pylint: disable=R0913,R0914
+    instances: int,
+    sequences: int,
+    clients: int,
+    ownerid: Optional[str] = None,
+    grouping: str = "seed",
+    certsapi_base: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Bulk insert instances, each with given number of sequences each with given number of clients, using COPY
+
+    The instances are completed ones with fake TF outputs, certsapi_base can be used to point them to a stub"""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    ownerid = ownerid or str(uuid.uuid4())
+    instance_pks = [uuid.uuid4() for _ in range(instances)]
+    sequence_rows: List[Tuple[uuid.UUID, uuid.UUID, str, str]] = [
+        (uuid.uuid4(), instance_pk, f"seq{seqno:03d}_", generate_shortcode())
+        for instance_pk in instance_pks
+        for seqno in range(sequences)
+    ]
+    max_clients = max(clients, 1)
+    zeros_count = len(f"{max_clients}")
+
+    def instance_records() -> Iterator[Tuple[Any, ...]]:
+        for idx, instance_pk in enumerate(instance_pks):
+            dns_name = f"seed{idx}.example.com"
+            token = f"seedtoken{idx}"
+            tfoutputs = {"dns_name": {"value": dns_name}, "cert_api_token": {"value": token}}
+            yield (
+                instance_pk,
+                now,
+                now,
+                ownerid,
+                "green",
+                grouping,
+                now,
+                json.dumps({"server_name": f"seed{idx}"}),
+                json.dumps(tfoutputs),
+                dns_name,
+                certsapi_base or f"https://{dns_name}/api",
+                encrypt_field(token) if FIELD_ENCRYPTION_KEY else None,
+            )
+
+    def sequence_records() -> Iterator[Tuple[Any, ...]]:
+        for sequence_pk, instance_pk, prefix, shortcode in sequence_rows:
+            yield (sequence_pk, now, now, instance_pk, prefix, max_clients, clients + 1, shortcode)
+
+    def client_records() -> Iterator[Tuple[Any, ...]]:
+        for sequence_pk, instance_pk, prefix, _ in sequence_rows:
+            for clientno in range(1, clients + 1):
+                name = f"{prefix}{clientno:0{zeros_count}}"
+                yield (uuid.uuid4(), now, now, instance_pk, sequence_pk, name, generate_shortcode())
+
+    async with models.db.acquire() as conn:
+        async with conn.transaction():
+            counts = {
+                "instances": await _copy(
+                    conn,
+                    models.TAKInstance,
+                    (
+                        "pk",
+                        "created",
+                        "updated",
+                        "ownerid",
+                        "color",
+                        "grouping",
+                        "tfcompleted",
+                        "tfinputs",
+                        "tfoutputs",
+                        "dns_name",
+                        "certsapi_base",
+                        "certsapi_token",
+                    ),
+                    instance_records(),
+                ),
+                "sequences": await _copy(
+                    conn,
+                    models.ClientSequence,
+                    ("pk", "created", "updated", "server", "prefix", "max_clients", "next_client_no", "shortcode"),
+                    sequence_records(),
+                ),
+                "clients": await _copy(
+                    conn,
+                    models.Client,
+                    ("pk", "created", "updated", "server", "sequence", "name", "shortcode"),
+                    client_records(),
+                ),
+            }
+        for model in (models.TAKInstance, models.ClientSequence, models.Client):
+            await conn.status(sqlalchemy.text(f"ANALYZE takbackend.{model.__tablename__}"))
+    LOGGER.info("Seeded {}".format(counts))
+    return {
+        "counts": counts,
+        "ownerid": ownerid,
+        "sequence_shortcodes": [row[3] for row in sequence_rows[:5]],
+    }
@@ -0,0 +1,9 @@
+"""Gunicorn config hooks, used with -c python:takbackend.gunicorn_conf"""
+from typing import Any
+
+from takbackend.metrics import mark_process_dead
+
+
+def child_exit(_server: Any, worker: Any) -> None:
+    """Clean up the dead worker's live metrics"""
+    mark_process_dead(worker.pid)
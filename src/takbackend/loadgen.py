@@ -0,0 +1,95 @@
+"""Simple load generator for running server, used via the loadgen CLI command"""
+from typing import Dict, List, Optional, Sequence, TYPE_CHECKING
+from collections import Counter
+from dataclasses import dataclass, field
+import asyncio
+import itertools
+import statistics
+import time
+
+if TYPE_CHECKING:
+    import aiohttp
+
+# scenario name -> path template, {target} is replaced with the targets in round-robin
+SCENARIOS: Dict[str, str] = {
+    "qrstorm": "/s/{target}",  # new devices scanning sequence QR, target is the sequence shortcode
+    "nextclient": "/api/v1/tak/sequences/nextclient/{target}",  # same with the long url, target is sequence pk
+    "instructions": "/c/{target}",  # client instruction pages, target is the client shortcode
+    "owner": "/api/v1/tak/instances/{target}/instructions",  # owner instructions, target is the instance pk
+    "list": "/api/v1/tak/instances",  # admin listing, needs token
+}
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    idx = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+@dataclass
+class LoadResult:
+    """Latencies and statuses of a run"""
+
+    elapsed: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    statuses: "Counter[str]" = field(default_factory=Counter)
+
+    def summary(self) -> str:
+        """Human readable summary"""
+        if not self.latencies:
+            return "no requests completed"
+        lines = [
+            f"requests: {len(self.latencies)} in {self.elapsed:.2f}s ({len(self.latencies) / self.elapsed:.1f} req/s)",
+            "statuses: " + ", ".join(f"{key}={value}" for key, value in sorted(self.statuses.items())),
+            "latency ms: "
+            + ", ".join(
+                [f"mean={statistics.mean(self.latencies) * 1000:.1f}"]
+                + [f"p{pct}={percentile(self.latencies, pct) * 1000:.1f}" for pct in (50, 90, 95, 99)]
+                + [f"max={max(self.latencies) * 1000:.1f}"]
+            ),
+        ]
+        return "\n".join(lines)
+
+
+async def run_load(  # pylint: disable=R0913,R0914
+    base_url: str,
+    scenario: str,
+    targets: Sequence[str],
+    concurrency: int,
+    requests: int,
+    token: Optional[str] = None,
+) -> LoadResult:
+    """Run requests total requests with concurrency workers, redirects are not followed"""
+    import aiohttp  # pylint: disable=C0415 ; # keep the other CLI commands quick to start
+
+    template = SCENARIOS[scenario]
+    if "{target}" in template and not targets:
+        raise ValueError(f"Scenario {scenario} needs targets")
+    urls = itertools.cycle([base_url.rstrip("/") + template.format(target=target) for target in targets or [""]])
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    remaining = itertools.count()
+    result = LoadResult()
+
+    async def worker(session: "aiohttp.ClientSession") -> None:
+        """Do requests until we have done enough"""
+        while next(remaining) < requests:
+            url = next(urls)
+            started = time.perf_counter()
+            try:
+                async with session.get(url, allow_redirects=False) as resp:
+                    await resp.read()
+                    result.statuses[str(resp.status)] += 1
+            except aiohttp.ClientError as exc:
+                result.statuses[type(exc).__name__] += 1
+            result.latencies.append(time.perf_counter() - started)
+
+    # No cookies so every request looks like a new device
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(
+        headers=headers, connector=connector, cookie_jar=aiohttp.DummyCookieJar()
+    ) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        result.elapsed = time.perf_counter() - started
+    return result
@@ -1,21 +1,180 @@
-"""Initialize email handling backend (fastapi-mail)"""
-from typing import Optional
+"""Outgoing email, queued and sent over a persistent SMTP connection
+
+The SMTP settings are the fastapi-mail MAIL_* ones (ConnectionConfig). Messages are sent by a single background task
+so a burst of ready emails (whole exercise finishing at once) reuses one connection instead of doing a handshake
+for each, and goes out at most MAILER_RATE_LIMIT messages per second.
+"""
+from typing import Optional, Sequence, Tuple, TYPE_CHECKING
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+import asyncio
 import logging
+import time
+
+from pydantic import SecretStr
 
-from fastapi_mail import FastMail, ConnectionConfig
+from .config import MAILER_RATE_LIMIT, MAILER_MAX_PER_CONNECTION, MAILER_IDLE_TIMEOUT
 
-from .config import TEMPLATES_PATH
+if TYPE_CHECKING:
+    from fastapi_mail import ConnectionConfig
+    import aiosmtplib
 
 # FIXME: Should probably be part of some common arkiapihelpers package
 LOGGER = logging.getLogger(__name__)
-MAILER: Optional[FastMail] = None
 
 
-def singleton() -> FastMail:
-    """Get singleton configured mailer instance"""
-    global MAILER  # pylint: disable=W0603
-    if MAILER is None:
-        MAILER = FastMail(
-            ConnectionConfig(TEMPLATE_FOLDER=TEMPLATES_PATH, _env_file=".env", _env_file_encoding="utf-8")
+class MailDispatcher:  # pylint: disable=R0902
+    """Queue messages with send(), the background task delivers them"""
+
+    def __init__(
+        self,
+        settings: Optional["ConnectionConfig"] = None,
+        rate_limit: float = MAILER_RATE_LIMIT,
+        max_per_connection: int = MAILER_MAX_PER_CONNECTION,
+        idle_timeout: float = MAILER_IDLE_TIMEOUT,
+    ) -> None:
+        self._settings = settings
+        self.rate_limit = rate_limit
+        self.max_per_connection = max_per_connection
+        self.idle_timeout = idle_timeout
+        self.connections = 0  # opened so far
+        self._queue: Optional["asyncio.Queue[Tuple[EmailMessage, asyncio.Future[None]]]"] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._smtp: Optional["aiosmtplib.SMTP"] = None
+        self._sent_on_connection = 0
+
+    @property
+    def settings(self) -> "ConnectionConfig":
+        """The MAIL_* settings from env/.env"""
+        if self._settings is None:
+            from fastapi_mail import ConnectionConfig  # pylint: disable=C0415 ; # slow import, rarely needed
+
+            self._settings = ConnectionConfig(_env_file=".env", _env_file_encoding="utf-8")
+        return self._settings
+
+    def build(self, subject: str, recipients: Sequence[str], body: str, subtype: str = "plain") -> EmailMessage:
+        """Create message from us"""
+        msg = EmailMessage()
+        sender = self.settings.MAIL_FROM
+        if self.settings.MAIL_FROM_NAME is not None:
+            sender = f"{self.settings.MAIL_FROM_NAME} <{self.settings.MAIL_FROM}>"
+        msg["From"] = sender
+        msg["To"] = ", ".join(recipients)
+        msg["Subject"] = subject
+        msg["Date"] = formatdate(localtime=True)
+        msg["Message-ID"] = make_msgid()
+        msg.set_content(body, subtype=subtype)
+        return msg
+
+    async def send(self, msg: EmailMessage) -> None:
+        """Queue the message and wait until it's delivered, raises if delivery failed"""
+        self.start()
+        assert self._queue is not None
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        await self._queue.put((msg, future))
+        await future
+
+    async def _connection(self) -> "aiosmtplib.SMTP":
+        """The open connection or a new one"""
+        if self._smtp is not None and self._smtp.is_connected and self._sent_on_connection < self.max_per_connection:
+            return self._smtp
+        await self.close()
+        import aiosmtplib  # pylint: disable=C0415 ; # only needed when there is mail to send
+
+        settings = self.settings
+        smtp = aiosmtplib.SMTP(
+            hostname=settings.MAIL_SERVER,
+            port=settings.MAIL_PORT,
+            timeout=settings.TIMEOUT,
+            use_tls=settings.MAIL_SSL_TLS,
+            start_tls=settings.MAIL_STARTTLS,
+            validate_certs=settings.VALIDATE_CERTS,
         )
-    return MAILER
+        await smtp.connect()
+        if settings.USE_CREDENTIALS:
+            password = settings.MAIL_PASSWORD
+            if isinstance(password, SecretStr):  # it's str only up to fastapi-mail 1.2.5
+                password = password.get_secret_value()
+            await smtp.login(settings.MAIL_USERNAME, password)
+        self._smtp = smtp
+        self._sent_on_connection = 0
+        self.connections += 1
+        LOGGER.debug(
+            "SMTP connection {} to {}:{} opened".format(self.connections, settings.MAIL_SERVER, settings.MAIL_PORT)
+        )
+        return smtp
+
+    async def close(self) -> None:
+        """Close the SMTP connection if open"""
+        if self._smtp is None:
+            return
+        smtp, self._smtp = self._smtp, None
+        try:
+            if smtp.is_connected:
+                await smtp.quit()
+        except Exception as exc:  # pylint: disable=W0703
+            LOGGER.debug("SMTP quit failed {}".format(exc))
+            smtp.close()
+
+    async def deliver(self, msg: EmailMessage) -> None:
+        """Send over the persistent connection, reconnect and retry once if the server had closed it"""
+        if self.settings.SUPPRESS_SEND:
+            return
+        import aiosmtplib  # pylint: disable=C0415 ; # only needed when there is mail to send
+
+        try:
+            await (await self._connection()).send_message(msg)
+        except aiosmtplib.SMTPServerDisconnected:
+            LOGGER.debug("SMTP server had disconnected, retrying")
+            await self.close()
+            await (await self._connection()).send_message(msg)
+        self._sent_on_connection += 1
+
+    async def run(self) -> None:
+        """Deliver queued messages, close the connection when idle"""
+        assert self._queue is not None
+        queue = self._queue
+        last_sent = 0.0
+        while True:
+            try:
+                msg, future = await asyncio.wait_for(queue.get(), timeout=self.idle_timeout)
+            except asyncio.TimeoutError:
+                await self.close()
+                msg, future = await queue.get()
+            if self.rate_limit:
+                await asyncio.sleep(max(last_sent + 1.0 / self.rate_limit - time.monotonic(), 0))
+            try:
+                await self.deliver(msg)
+                if not future.done():
+                    future.set_result(None)
+            except Exception as exc:  # pylint: disable=W0703
+                await self.close()
+                if not future.done():
+                    future.set_exception(exc)
+            last_sent = time.monotonic()
+
+    def start(self) -> None:
+        """Start the background task if not running"""
+        if self._task is not None and not self._task.done():
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self.run(), name="mail_dispatcher")
+
+    async def stop(self) -> None:
+        """Stop the background task and close the connection, messages still queued are failed"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._queue is not None and not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Mail dispatcher stopped"))
+        await self.close()
+
+
+DISPATCHER = MailDispatcher()
@@ -0,0 +1,120 @@
+"""Prometheus metrics
+
+When PROMETHEUS_MULTIPROC_DIR is set (see docker/entrypoint.sh) the metrics are aggregated across gunicorn workers.
+"""
+from typing import Any, Awaitable, Callable, Coroutine, MutableMapping, Set, TypeVar
+import asyncio
+import logging
+import os
+import time
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    REGISTRY,
+)
+
+LOGGER = logging.getLogger(__name__)
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+ReturnType = TypeVar("ReturnType")  # pylint: disable=C0103
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+ASGIApp = Callable[[Scope, Callable[[], Awaitable[Message]], Callable[[Message], Awaitable[None]]], Awaitable[None]]
+
+REQUEST_LATENCY = Histogram(
+    "takbackend_request_duration_seconds", "Request latency by route", ["route", "method", "status"]
+)
+OUTBOUND_LATENCY = Histogram(
+    "takbackend_outbound_duration_seconds", "Outbound call latency by target type", ["target", "operation"]
+)
+SEQUENCE_LOCK_WAIT = Histogram(
+    "takbackend_sequence_lock_wait_seconds", "Time waiting for the ClientSequence row lock in next_client"
+)
+QRCODE_RENDER = Histogram("takbackend_qrcode_render_seconds", "Time spent rendering QR codes")
+ZIP_BYTES = Counter("takbackend_zip_bytes_served", "Bytes of client zip served", ["route"])
+BACKGROUND_TASKS = Gauge(
+    "takbackend_background_tasks", "Background tasks running", ["name"], multiprocess_mode="livesum"
+)
+OUTBOX_DEPTH = Gauge(
+    "takbackend_outbox_depth", "Outbound calls queued but not yet started", ["queue"], multiprocess_mode="livesum"
+)
+DB_POOL_SIZE = Gauge("takbackend_db_pool_size", "Connections in the DB pool", multiprocess_mode="livesum")
+DB_POOL_IDLE = Gauge("takbackend_db_pool_idle", "Idle connections in the DB pool", multiprocess_mode="livesum")
+DB_POOL_MAX = Gauge("takbackend_db_pool_max", "Max connections in the DB pool", multiprocess_mode="livesum")
+MODELCACHE_HITS = Gauge("takbackend_modelcache_hits", "Model cache hits", ["cache"], multiprocess_mode="livesum")
+MODELCACHE_MISSES = Gauge("takbackend_modelcache_misses", "Model cache misses", ["cache"], multiprocess_mode="livesum")
+MODELCACHE_SIZE = Gauge("takbackend_modelcache_size", "Model cache entries", ["cache"], multiprocess_mode="livesum")
+FLEET_CERTSAPI = Gauge(
+    "takbackend_fleet_certsapi",
+    "Instances by certs-api state in the last probe sweep",
+    ["state"],
+    multiprocess_mode="livemax",
+)
+
+RUNNING_TASKS: Set["asyncio.Task[Any]"] = set()
+
+
+def spawn(coro: Coroutine[Any, Any, ReturnType], name: str) -> "asyncio.Task[ReturnType]":
+    """Create background task that is counted in BACKGROUND_TASKS (and not garbage collected while running)"""
+    task = asyncio.create_task(coro, name=name)
+    gauge = BACKGROUND_TASKS.labels(name)
+    gauge.inc()
+    RUNNING_TASKS.add(task)
+
+    def done(task: "asyncio.Task[Any]") -> None:
+        """Book-keeping"""
+        gauge.dec()
+        RUNNING_TASKS.discard(task)
+
+    task.add_done_callback(done)
+    return task
+
+
+def render_latest() -> bytes:
+    """Metrics in the text format, aggregated over all processes if in multiprocess mode"""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)  # type: ignore[no-untyped-call]
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def mark_process_dead(pid: int) -> None:
+    """Clean up the live gauges of dead worker, called from gunicorn child_exit hook"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)  # type: ignore[no-untyped-call]
+
+
+class MetricsMiddleware:  # pylint: disable=R0903
+    """Record request latency by route (endpoint) name"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(
+        self, scope: Scope, receive: Callable[[], Awaitable[Message]], send: Callable[[Message], Awaitable[None]]
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            """Catch the status"""
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router puts the matched endpoint to scope
+            endpoint = scope.get("endpoint")
+            route = getattr(endpoint, "__name__", type(endpoint).__name__) if endpoint else "unmatched"
+            REQUEST_LATENCY.labels(route, scope["method"], str(status_code)).observe(time.perf_counter() - started)
@@ -0,0 +1,148 @@
+"""In-process read-through caches for model lookups that rarely change
+
+Entries are bounded by TTL and size (LRU) and evicted via cachebus when the rows change in any worker. The loaders
+read from the primary, a lagging replica row loaded right after an eviction would stay cached for the whole TTL.
+"""
+from typing import Any, Awaitable, Callable, Dict, Generic, List, Optional, Set, Tuple, TypeVar
+from collections import OrderedDict
+import logging
+import time
+import uuid
+
+from fastapi import HTTPException
+from libadvian.binpackers import b64_to_uuid, ensure_utf8
+
+from . import cachebus
+from .replica import read_first, written_key
+from .config import MODELCACHE_TTL, MODELCACHE_SIZE
+from .models import db, Client, TAKInstance
+
+LOGGER = logging.getLogger(__name__)
+ModelType = TypeVar("ModelType")  # pylint: disable=C0103
+
+
+def pkstr_to_str(pkstr: str) -> Optional[str]:
+    """Normalize b64 or str UUID to str, None if it can't be parsed"""
+    try:
+        return str(b64_to_uuid(ensure_utf8(pkstr)))
+    except ValueError:
+        pass
+    try:
+        return str(uuid.UUID(pkstr))
+    except ValueError:
+        return None
+
+
+class ModelCache(Generic[ModelType]):  # pylint: disable=R0902
+    """TTL and size bounded read-through cache, deleted rows are not cached"""
+
+    def __init__(  # pylint: disable=R0913
+        self,
+        name: str,
+        loader: Callable[[str], Awaitable[Optional[ModelType]]],
+        kinds: Tuple[str, ...],
+        pk_attr: str = "pk",
+        ttl: float = MODELCACHE_TTL,
+        maxsize: int = MODELCACHE_SIZE,
+    ) -> None:
+        self.name = name
+        self.loader = loader
+        self.pk_attr = pk_attr
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, ModelType]]" = OrderedDict()
+        self._keys_by_pk: Dict[str, Set[str]] = {}
+        self._generation = 0
+        for kind in kinds:
+            cachebus.subscribe(kind, self.evict)
+        CACHES.append(self)
+
+    def _pk_of(self, value: ModelType) -> str:
+        """The primary key of the value as string"""
+        return str(getattr(value, self.pk_attr))
+
+    def _store(self, key: str, value: ModelType) -> None:
+        """Store the value, drop the least recently used if we're full"""
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        self._keys_by_pk.setdefault(self._pk_of(value), set()).add(key)
+        while len(self._entries) > self.maxsize:
+            dropped_key, (_, dropped) = self._entries.popitem(last=False)
+            self._keys_by_pk.get(self._pk_of(dropped), set()).discard(dropped_key)
+
+    async def get(self, key: str) -> Optional[ModelType]:
+        """Get from cache or load"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+        self.misses += 1
+        generation = self._generation
+        value = await self.loader(key)
+        # Do not cache deleted ones, and do not store if something was invalidated while we were loading
+        if value is not None and not getattr(value, "deleted", None) and generation == self._generation:
+            self._store(key, value)
+        return value
+
+    def prime(self, key: str, value: ModelType) -> None:
+        """Store an already loaded value (warm-up), deleted ones are not cached"""
+        if not getattr(value, "deleted", None):
+            self._store(key, value)
+
+    def evict(self, pkstr: str) -> None:
+        """Evict all entries for the given primary key, or everything with cachebus.ALL_KEYS"""
+        self._generation += 1
+        if pkstr == cachebus.ALL_KEYS:
+            self._entries.clear()
+            self._keys_by_pk.clear()
+            return
+        for key in self._keys_by_pk.pop(pkstr, set()):
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and size"""
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+        }
+
+
+async def get_or_404_replica(model: Any, pkstr: str, kind: str) -> Any:
+    """Like get_or_404 but read via the replica (if configured), kind is the cachebus kind of the model"""
+    key = pkstr_to_str(pkstr)
+    if key is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    obj = await read_first(model.query.where(model.pk == key), written_key(kind, key))
+    if obj is None or obj.deleted:
+        raise HTTPException(status_code=404, detail="Not found")
+    return obj
+
+
+async def get_or_404_cached(cache: "ModelCache[ModelType]", pkstr: str) -> ModelType:
+    """Like get_or_404 but via the cache"""
+    key = pkstr_to_str(pkstr)
+    if key is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    obj = await cache.get(key)
+    if obj is None or getattr(obj, "deleted", None):
+        raise HTTPException(status_code=404, detail="Not found")
+    return obj
+
+
+CACHES: List[ModelCache[Any]] = []
+CLIENTS: ModelCache[Client] = ModelCache(
+    "clients", lambda key: db.first(Client.query.where(Client.pk == key)), (cachebus.CLIENT,)
+)
+CLIENT_SHORTCODES: ModelCache[Client] = ModelCache(
+    "client_shortcodes", lambda code: db.first(Client.shortcode_query(code)), (cachebus.CLIENT,)
+)
+CERTSAPI_INSTANCES: ModelCache[TAKInstance] = ModelCache(
+    "certsapi_instances", lambda key: db.first(TAKInstance.certsapi_info_query(key)), (cachebus.TAKINSTANCE,)
+)
@@ -2,5 +2,6 @@
 from .base import db
 from .instance import TAKInstance
 from .clients import ClientSequence, Client
+from .archive import ARCHIVE_TABLES
 
-__all__ = ["TAKInstance", "db", "Client", "ClientSequence"]
+__all__ = ["TAKInstance", "db", "Client", "ClientSequence", "ARCHIVE_TABLES"]
@@ -0,0 +1,22 @@
+"""Archive tables for the soft-deleted rows moved out of the hot tables, see archival.py"""
+from typing import Any, Dict
+import sqlalchemy as sa
+
+from .base import db, utcnow
+from .instance import TAKInstance
+from .clients import ClientSequence, Client
+
+
+def archive_table(model: Any) -> sa.Table:
+    """Same columns as the model table (without defaults, foreign keys or indexes) plus archived timestamp"""
+    table = model.__table__
+    columns = [
+        sa.Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+        for column in table.columns
+    ]
+    columns.append(sa.Column("archived", sa.DateTime(timezone=True), nullable=False, server_default=utcnow))
+    return sa.Table(f"{table.name}_archive", db, *columns, schema=table.schema)
+
+
+# model -> its archive table, children first so the foreign keys of the hot tables never point to moved rows
+ARCHIVE_TABLES: Dict[Any, sa.Table] = {model: archive_table(model) for model in (Client, ClientSequence, TAKInstance)}
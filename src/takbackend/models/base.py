@@ -1,5 +1,7 @@
 """The Gino baseclass with db connection wrapping"""
 from typing import Any
+import secrets
+import string
 import uuid
 
 from gino import Gino
@@ -10,6 +12,13 @@ import sqlalchemy as sa
 utcnow = sa.func.current_timestamp()
 db = Gino()
 DBModel: Any = db.Model  # workaround mypy being unhappy about using @property as baseclass
+SHORTCODE_ALPHABET = string.digits + string.ascii_letters
+SHORTCODE_LENGTH = 8  # 62**8 is plenty, the unique index (or clients_shortcodes) catches the unlikely collision
+
+
+def generate_shortcode() -> str:
+    """Random base62 code for short urls"""
+    return "".join(secrets.choice(SHORTCODE_ALPHABET) for _ in range(SHORTCODE_LENGTH))
 
 
 class BaseModel(DBModel):  # pylint: disable=R0903
@@ -1,19 +1,51 @@
 """tak client instances book-keeping"""
-from typing import AsyncGenerator, List, cast
+from typing import Any, AsyncGenerator, List, Optional, cast
 import sqlalchemy as sa
 from sqlalchemy.dialects.postgresql import UUID as saUUID
 
-from .base import BaseModel, db
+from .base import BaseModel, db, generate_shortcode
 from .instance import TAKInstance
+from ..metrics import SEQUENCE_LOCK_WAIT
+from ..tracing import span
 
 
 DEFAULT_MAX_CLIENTS = 100
+# Current number of hash partitions of the clients table, 0 means it's a plain table
+CLIENTS_PARTITION_COUNT_SQL = "SELECT count(*) FROM pg_inherits WHERE inhparent = 'takbackend.clients'::regclass"
+# Unique indexes of partitioned table can't enforce global uniqueness so when partitioned the shortcodes are also
+# kept in this plain table by trigger, its primary key rejects duplicates (and thus the client insert)
+CLIENTS_SHORTCODES_DDL = [
+    "CREATE TABLE IF NOT EXISTS takbackend.clients_shortcodes (shortcode VARCHAR PRIMARY KEY, client UUID NOT NULL)",
+    "TRUNCATE takbackend.clients_shortcodes",
+    "INSERT INTO takbackend.clients_shortcodes (shortcode, client) SELECT shortcode, pk FROM takbackend.clients",
+    """CREATE OR REPLACE FUNCTION takbackend.clients_shortcodes_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM takbackend.clients_shortcodes WHERE shortcode = OLD.shortcode;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        INSERT INTO takbackend.clients_shortcodes (shortcode, client) VALUES (NEW.shortcode, NEW.pk);
+    END IF;
+    RETURN NULL;
+END
+$$""",
+    "CREATE TRIGGER clients_shortcodes_sync AFTER INSERT OR DELETE OR UPDATE OF shortcode ON takbackend.clients"
+    " FOR EACH ROW EXECUTE FUNCTION takbackend.clients_shortcodes_sync()",
+]
+CLIENTS_SHORTCODES_DROP_DDL = [
+    "DROP TABLE IF EXISTS takbackend.clients_shortcodes",
+    "DROP FUNCTION IF EXISTS takbackend.clients_shortcodes_sync()",
+]
 
 
 class MaxclientsError(ValueError):
     """Specific error for max_clients exceeded"""
 
 
+class SequenceDeletedError(ValueError):
+    """The sequence (or its instance) was deleted"""
+
+
 class ClientSequence(BaseModel):  # pylint: disable=R0903
     """Used to grab the next client name and redirect to unique url for that"""
 
@@ -23,13 +55,28 @@ class ClientSequence(BaseModel):  # pylint: disable=R0903
     prefix = sa.Column(sa.Unicode(), nullable=False)
     max_clients = sa.Column(sa.Integer, nullable=False, default=DEFAULT_MAX_CLIENTS)
     next_client_no = sa.Column(sa.Integer, nullable=False, default=1)
+    shortcode = sa.Column(sa.Unicode(), nullable=False, default=generate_shortcode)
 
     _idx = sa.Index("server_prefix_unique", "server", "prefix", unique=True)
+    _shortcode_idx = sa.Index("clientsequences_shortcode_unique", "shortcode", unique=True)
+    _live_server_idx = sa.Index(
+        "clientsequences_live_server_idx", "server", postgresql_where=sa.text("deleted IS NULL")
+    )
+    _deleted_idx = sa.Index("clientsequences_deleted_idx", "deleted", postgresql_where=sa.text("deleted IS NOT NULL"))
 
     async def next_client(self) -> "Client":
         """Atomic creation of next client"""
         async with db.transaction():
-            refresh = await ClientSequence.query.where(ClientSequence.pk == self.pk).with_for_update().gino.first()
+            with span("clientsequence.lock_wait", sequence=str(self.pk)), SEQUENCE_LOCK_WAIT.time():
+                live = ClientSequence.deleted == None  # pylint: disable=C0121 ; # "is None" will create invalid query
+                refresh = (
+                    await ClientSequence.query.where(ClientSequence.pk == self.pk)
+                    .where(live)
+                    .with_for_update()
+                    .gino.first()
+                )
+            if refresh is None:
+                raise SequenceDeletedError("sequence has been deleted")
             if refresh.next_client_no > refresh.max_clients:
                 raise MaxclientsError("max_clients exceeded")
             zeros_count = len(f"{refresh.max_clients}")
@@ -40,9 +87,41 @@ class ClientSequence(BaseModel):  # pylint: disable=R0903
             await refresh.update(next_client_no=refresh.next_client_no + 1).apply()
         return cast(Client, client_refresh)
 
+    async def allocate_clients(self, count: int) -> List["Client"]:
+        """Atomic creation of count next clients with single counter bump and multi-row insert"""
+        async with db.transaction():
+            bumped = (
+                await ClientSequence.update.values(next_client_no=ClientSequence.next_client_no + count)
+                .where(ClientSequence.pk == self.pk)
+                .where(ClientSequence.next_client_no + count - 1 <= ClientSequence.max_clients)
+                .where(ClientSequence.deleted == None)  # pylint: disable=C0121 ; # "is None" will create invalid query
+                .returning(ClientSequence.next_client_no, ClientSequence.max_clients, ClientSequence.prefix)
+                .gino.first()
+            )
+            if bumped is None:
+                raise MaxclientsError("max_clients exceeded")
+            next_client_no, max_clients, prefix = bumped
+            zeros_count = len(f"{max_clients}")
+            rows = [
+                {"server": self.server, "sequence": self.pk, "name": f"{prefix}{client_no:0{zeros_count}}"}
+                for client_no in range(next_client_no - count, next_client_no)
+            ]
+            clients = await Client.insert().values(rows).returning(*Client.__table__.columns).gino.load(Client).all()
+        return cast(List[Client], sorted(clients, key=lambda client: client.name))
+
+    @classmethod
+    async def by_shortcode(cls, code: str) -> Optional["ClientSequence"]:
+        """Lookup by shortcode, deleted ones are not returned"""
+        return cast(
+            Optional[ClientSequence],
+            await cls.query.where(cls.shortcode == code)
+            .where(cls.deleted == None)  # pylint: disable=C0121 ; # "is None" will create invalid query
+            .gino.first(),
+        )
+
     @classmethod
     async def create_for(cls, instance: TAKInstance, prefix: str, max_clients: int) -> "ClientSequence":
-        """Create one for server instance"""
+        """Create one for server instance, publishes the instance since the sequences are derived from it"""
         sequence = ClientSequence(
             server=instance.pk,
             prefix=prefix,
@@ -50,16 +129,22 @@ class ClientSequence(BaseModel):  # pylint: disable=R0903
         )
         await sequence.create()
         refresh = await ClientSequence.get(sequence.pk)
+        await instance.publish()
         return cast(ClientSequence, refresh)
 
+    @classmethod
+    def instance_sequences_query(cls, server_pk: Any) -> Any:
+        """Query for the live sequences of instance"""
+        return cls.query.where(cls.server == server_pk).where(
+            cls.deleted == None  # pylint: disable=C0121 ; # "is None" will create invalid query
+        )
+
     @classmethod
     async def iter_instance_sequences(cls, server: TAKInstance) -> AsyncGenerator["ClientSequence", None]:
         """Resolve roles user has (sorted in descending priority so they're easier to merge) and yields one by one"""
         async with db.acquire() as conn:  # Cursors need transaction
             async with conn.transaction():
-                async for cseq in ClientSequence.query.where(ClientSequence.server == server.pk).where(
-                    ClientSequence.deleted == None  # pylint: disable=C0121 ; # "is None" will create invalid query
-                ).gino.iterate():
+                async for cseq in cls.instance_sequences_query(server.pk).gino.iterate():
                     yield cseq
 
     @classmethod
@@ -79,5 +164,93 @@ class Client(BaseModel):  # pylint: disable=R0903
     server = sa.Column(saUUID(), sa.ForeignKey(TAKInstance.pk))
     sequence = sa.Column(saUUID(), sa.ForeignKey(ClientSequence.pk))
     name = sa.Column(sa.Unicode(), nullable=False)
+    shortcode = sa.Column(sa.Unicode(), nullable=False, default=generate_shortcode)
 
     _idx = sa.Index("server_name_unique", "server", "name", unique=True)
+    _shortcode_idx = sa.Index("clients_shortcode_unique", "shortcode", unique=True)
+    _live_sequence_idx = sa.Index("clients_live_sequence_idx", "sequence", postgresql_where=sa.text("deleted IS NULL"))
+    _live_server_idx = sa.Index("clients_live_server_idx", "server", postgresql_where=sa.text("deleted IS NULL"))
+    _deleted_idx = sa.Index("clients_deleted_idx", "deleted", postgresql_where=sa.text("deleted IS NOT NULL"))
+
+    @classmethod
+    def shortcode_query(cls, code: str) -> Any:
+        """Query for the live client with shortcode"""
+        return cls.query.where(cls.shortcode == code).where(
+            cls.deleted == None  # pylint: disable=C0121 ; # "is None" will create invalid query
+        )
+
+    @classmethod
+    async def by_shortcode(cls, code: str) -> Optional["Client"]:
+        """Lookup by shortcode, deleted ones are not returned"""
+        return cast(Optional[Client], await cls.shortcode_query(code).gino.first())
+
+    @classmethod
+    async def partition_count(cls) -> int:
+        """Number of hash partitions the table has, 0 for plain table"""
+        return int(await db.scalar(sa.text(CLIENTS_PARTITION_COUNT_SQL)))
+
+    @classmethod
+    async def repartition(cls, partitions: int) -> None:
+        """Rebuild the table with given number of hash partitions on server (0 for plain table).
+
+        Rows are copied over and the table is locked for the duration so do this in maintenance break. Lookups
+        by pk or shortcode alone (get, by_shortcode, the model caches) can't be pruned to one partition and check
+        the index of each partition, see test_clients_partitioning in the benchmarks for what it costs."""
+        async with db.transaction():
+            for statement in repartition_clients_ddl(partitions):
+                await db.status(sa.text(statement))
+
+
+def repartition_clients_ddl(partitions: int) -> List[str]:
+    """Statements to rebuild the clients table as hash partitioned on server (or plain when partitions is 0)
+
+    Primary key and unique indexes of partitioned table must contain the partition key so they get server appended,
+    the rest of the constraints and indexes are generated from the model metadata. Global shortcode uniqueness is
+    then enforced via the clients_shortcodes table (CLIENTS_SHORTCODES_DDL).
+
+    Migrations must not use this (the model changes), they carry a frozen copy of the statements."""
+    table = Client.__table__
+    name = f"{table.schema}.{table.name}"
+    temp = f"{table.name}_repartition"
+    statements = [f"CREATE TABLE {table.schema}.{temp} (LIKE {name} INCLUDING DEFAULTS)"]
+    if partitions:
+        statements[0] += " PARTITION BY HASH (server)"
+        statements.extend(
+            f"CREATE TABLE {table.schema}.{temp}_p{idx} PARTITION OF {table.schema}.{temp}"
+            f" FOR VALUES WITH (MODULUS {partitions}, REMAINDER {idx})"
+            for idx in range(partitions)
+        )
+    statements += [
+        f"INSERT INTO {table.schema}.{temp} SELECT * FROM {name}",
+        f"DROP TABLE {name}",  # takes the old partitions with it
+        f"ALTER TABLE {table.schema}.{temp} RENAME TO {table.name}",
+    ]
+    statements.extend(
+        f"ALTER TABLE {table.schema}.{temp}_p{idx} RENAME TO {table.name}_p{idx}" for idx in range(partitions)
+    )
+
+    def column_list(columns: List[str], unique: bool = True) -> str:
+        """Quoted column list, partition key appended for unique ones"""
+        if unique and partitions and "server" not in columns:
+            columns = columns + ["server"]
+        return ", ".join(f'"{column}"' for column in columns)
+
+    if not partitions:
+        statements.append(f"ALTER TABLE {name} ALTER COLUMN server DROP NOT NULL")
+    statements.append(f"ALTER TABLE {name} ADD CONSTRAINT {table.name}_pkey PRIMARY KEY ({column_list(['pk'])})")
+    for fkey in sorted(table.foreign_keys, key=lambda fkey: str(fkey.parent.name)):
+        referred = fkey.column.table
+        statements.append(
+            f"ALTER TABLE {name} ADD CONSTRAINT {table.name}_{fkey.parent.name}_fkey FOREIGN KEY ({fkey.parent.name})"
+            f" REFERENCES {referred.schema}.{referred.name} ({fkey.column.name})"
+        )
+    for index in sorted(table.indexes, key=lambda index: str(index.name)):
+        columns = column_list([column.name for column in index.columns], index.unique)
+        statement = f"CREATE {'UNIQUE ' if index.unique else ''}INDEX {index.name} ON {name} ({columns})"
+        where = index.dialect_options["postgresql"]["where"]
+        if where is not None:
+            statement += f" WHERE {where}"
+        statements.append(statement)
+    statements.extend(CLIENTS_SHORTCODES_DDL if partitions else CLIENTS_SHORTCODES_DROP_DDL)
+    statements.append(f"ANALYZE {name}")
+    return statements
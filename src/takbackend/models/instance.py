@@ -1,8 +1,16 @@
-"""tak server instance book-keeping"""
+"""tak server instance book-keeping
+
+Writes go through the helpers here (and in .clients) that publish the change via cachebus so no writer can forget it.
+"""
+from typing import Any, Dict, List, Optional, Sequence, cast
+import uuid
+from dataclasses import dataclass
+
 from sqlalchemy.dialects.postgresql import JSONB
 import sqlalchemy as sa
 
-from .base import BaseModel
+from .base import BaseModel, db, utcnow
+from .. import cachebus
 
 
 class TAKInstance(BaseModel):  # pylint: disable=R0903
@@ -21,3 +29,184 @@ class TAKInstance(BaseModel):  # pylint: disable=R0903
     tfcompleted = sa.Column(sa.DateTime(timezone=True), nullable=True)
     tfinputs = sa.Column(JSONB, nullable=False, server_default="{}")
     tfoutputs = sa.Column(JSONB, nullable=False, server_default="{}")
+
+    # Derived from tfoutputs when TF completes so the certs-api calls do not need to parse it
+    dns_name = sa.Column(sa.String(), nullable=True)
+    certsapi_base = sa.Column(sa.String(), nullable=True)
+    certsapi_token = sa.Column(sa.String(), nullable=True)  # encrypted, see security.encrypt_field
+    # Filled by the fleet prober (see prober.py), null until the first sweep after TF completed
+    certsapi_ready = sa.Column(sa.Boolean(), nullable=True)
+    certsapi_checked = sa.Column(sa.DateTime(timezone=True), nullable=True)
+
+    # Almost every query filters out the soft-deleted ones
+    _live_ownerid_idx = sa.Index(
+        "takinstances_live_ownerid_idx", "ownerid", postgresql_where=sa.text("deleted IS NULL")
+    )
+    _live_grouping_idx = sa.Index(
+        "takinstances_live_grouping_idx", "grouping", postgresql_where=sa.text("deleted IS NULL")
+    )
+    # For the archival job
+    _deleted_idx = sa.Index("takinstances_deleted_idx", "deleted", postgresql_where=sa.text("deleted IS NOT NULL"))
+
+    PRIVATE_COLUMNS = ("certsapi_base", "certsapi_token")
+    CERTSAPI_COLUMNS = (
+        "pk",
+        "ownerid",
+        "updated",
+        "deleted",
+        "tfcompleted",
+        "tfinputs",
+        "dns_name",
+        "certsapi_base",
+        "certsapi_token",
+    )
+
+    def to_public_dict(self, server_name_default: str = "unresolved") -> Dict[str, Any]:
+        """to_dict without the certs-api connection details and with server_name resolved"""
+        ret = {key: value for key, value in self.to_dict().items() if key not in self.PRIVATE_COLUMNS}
+        ret["server_name"] = self.tfinputs.get("server_name", server_name_default)
+        return ret
+
+    @classmethod
+    def list_query(cls, ownerid: Optional[str] = None) -> Any:
+        """Query for the live instances, optionally only for given owner"""
+        query = cls.query.where(cls.deleted == None)  # pylint: disable=C0121 ; # "is None" will create invalid query
+        if ownerid is not None:
+            query = query.where(cls.ownerid == ownerid)
+        return query
+
+    @classmethod
+    def selection_query(
+        cls, grouping: Optional[str] = None, pks: Optional[Sequence[uuid.UUID]] = None, ownerid: Optional[str] = None
+    ) -> Any:
+        """Query for the live instances matching grouping and/or pks, optionally limited to owner"""
+        if grouping is None and not pks:
+            raise ValueError("grouping or pks must be given")
+        query = cls.list_query(ownerid)
+        if grouping is not None:
+            query = query.where(cls.grouping == grouping)
+        if pks:
+            query = query.where(cls.pk.in_(pks))
+        return query
+
+    @classmethod
+    def certsapi_info_query(cls, pk: Any) -> Any:  # pylint: disable=C0103
+        """Query for only what's needed for talking to the certs api (no tfoutputs)"""
+        return cls.select(*cls.CERTSAPI_COLUMNS).where(cls.pk == pk)
+
+    @classmethod
+    async def get_certsapi_info(cls, pk: Any) -> Optional["TAKInstance"]:  # pylint: disable=C0103
+        """Load only what's needed for talking to the certs api (no tfoutputs)"""
+        return cast(Optional[TAKInstance], await cls.certsapi_info_query(pk).gino.first())
+
+    async def publish(self) -> None:
+        """Tell the caches of all workers this instance (and what's derived from it) changed"""
+        await cachebus.publish(cachebus.TAKINSTANCE, self.pk)
+
+    @classmethod
+    async def create_new(cls, **values: Any) -> "TAKInstance":
+        """Create and publish, returns the instance as stored"""
+        instance = cls(**values)
+        await instance.create()
+        refresh = cast(TAKInstance, await cls.get(instance.pk))
+        await refresh.publish()
+        return refresh
+
+    @classmethod
+    async def create_many(
+        cls, instance_rows: List[Dict[str, Any]], sequence_rows: Sequence[Dict[str, Any]] = ()
+    ) -> List["TAKInstance"]:
+        """Insert instances (with pk set) and their sequences in single transaction and publish, returns the
+        instances in the order of the rows"""
+        pks = [row["pk"] for row in instance_rows]
+        async with db.transaction():
+            await cls.insert().values(instance_rows).gino.status()
+            if sequence_rows:
+                await db.tables["takbackend.clientsequences"].insert().values(list(sequence_rows)).gino.status()
+            await cachebus.publish(cachebus.TAKINSTANCE, *pks)
+            created = {str(instance.pk): instance for instance in await cls.query.where(cls.pk.in_(pks)).gino.all()}
+        return [created[str(pk)] for pk in pks]
+
+    async def update_and_publish(self, **values: Any) -> None:
+        """Update the given values and publish"""
+        await self.update(**values).apply()
+        await self.publish()
+
+    async def delete_and_publish(self) -> None:
+        """Actually delete (not soft) and publish, normal deletes use soft_delete_many"""
+        await self.delete()
+        await self.publish()
+
+    @classmethod
+    async def delete_many(cls, pks: Sequence[uuid.UUID]) -> None:
+        """Actually delete (not soft) the instances and their sequences and publish, for undoing create_many"""
+        async with db.transaction():
+            sequences = db.tables["takbackend.clientsequences"]
+            await sequences.delete().where(sequences.c.server.in_(pks)).gino.status()
+            await cls.delete.where(cls.pk.in_(pks)).gino.status()
+            await cachebus.publish(cachebus.TAKINSTANCE, *pks)
+
+    @classmethod
+    async def soft_delete_many(  # pylint: disable=R0914
+        cls,
+        grouping: Optional[str] = None,
+        pks: Optional[Sequence[uuid.UUID]] = None,
+        ownerid: Optional[str] = None,
+    ) -> "SoftDeleted":
+        """Mark instances matching grouping and/or pks (optionally limited to owner) deleted, cascading to their
+        sequences and clients, all in single statement, and publish what was deleted"""
+        if grouping is None and not pks:
+            raise ValueError("grouping or pks must be given")
+        table = cls.__table__
+        query = (
+            table.update()
+            .values(deleted=utcnow)
+            .where(table.c.deleted == None)  # pylint: disable=C0121 ; # "is None" will create invalid query
+        )
+        if grouping is not None:
+            query = query.where(table.c.grouping == grouping)
+        if pks:
+            query = query.where(table.c.pk.in_(pks))
+        if ownerid is not None:
+            query = query.where(table.c.ownerid == ownerid)
+        instances_cte = query.returning(*table.columns).cte("deleted_instances")
+
+        select_columns = list(instances_cte.c)
+        joined = instances_cte
+        # Looked up from metadata since the models in .clients import this module
+        for childname, label in (("clientsequences", "sequence_pks"), ("clients", "client_pks")):
+            child = db.tables[f"takbackend.{childname}"]
+            child_cte = (
+                child.update()
+                .values(deleted=utcnow)
+                .where(child.c.server.in_(sa.select([instances_cte.c.pk])))
+                .where(child.c.deleted == None)  # pylint: disable=C0121 ; # "is None" will create invalid query
+                .returning(child.c.pk, child.c.server)
+                .cte(f"deleted_{childname}")
+            )
+            aggregated = (
+                sa.select([child_cte.c.server, sa.func.array_agg(child_cte.c.pk).label(label)])
+                .group_by(child_cte.c.server)
+                .alias(f"{childname}_by_server")
+            )
+            joined = joined.outerjoin(aggregated, aggregated.c.server == instances_cte.c.pk)
+            select_columns.append(aggregated.c[label])
+
+        result = SoftDeleted(instances=[], sequence_pks=[], client_pks=[])
+        for row in await db.all(sa.select(select_columns).select_from(joined)):
+            instance = cls()
+            instance.__values__.update({column.name: row[column.name] for column in table.columns})
+            result.instances.append(instance)
+            result.sequence_pks.extend(row["sequence_pks"] or [])
+            result.client_pks.extend(row["client_pks"] or [])
+        await cachebus.publish_soft_deleted(result)
+        return result
+
+
+@dataclass
+class SoftDeleted:
+    """What TAKInstance.soft_delete_many marked deleted"""
+
+    instances: List[TAKInstance]
+    sequence_pks: List[uuid.UUID]
+    client_pks: List[uuid.UUID]
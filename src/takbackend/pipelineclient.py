@@ -1,17 +1,43 @@
 """Client for calling the pipelines"""
-from typing import Dict, Any, cast
+from typing import Dict, Any, Awaitable, Iterable, List, Optional, Sequence, Tuple, cast
 from dataclasses import dataclass
+import asyncio
 import logging
 
-import aiohttp
-
 from .models import TAKInstance
 from .security import PipelineTokens
-from .config import PIPELINE_REF, PIPELINE_URL, PIPELINE_SUPPRESS
+from .metrics import OUTBOUND_LATENCY, OUTBOX_DEPTH
+from .config import PIPELINE_REF, PIPELINE_URL, PIPELINE_SUPPRESS, PIPELINE_CONCURRENCY
 
 LOGGER = logging.getLogger(__name__)
 
 
+async def run_bounded(
+    awaitables: Iterable[Awaitable[Any]], limit: int = PIPELINE_CONCURRENCY
+) -> List[Optional[BaseException]]:
+    """Await all with at most limit running at the same time, returns the exception (or None) for each in order"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def runner(awaitable: Awaitable[Any]) -> Optional[BaseException]:
+        """Wait for the semaphore and catch the exception"""
+        queued = OUTBOX_DEPTH.labels("pipeline")
+        queued.inc()
+        try:
+            await semaphore.acquire()
+        finally:
+            queued.dec()
+        try:
+            await awaitable
+        except Exception as exc:  # pylint: disable=W0703
+            LOGGER.exception("Pipeline call failed {}".format(exc))
+            return exc
+        finally:
+            semaphore.release()
+        return None
+
+    return await asyncio.gather(*(runner(awaitable) for awaitable in awaitables))
+
+
 @dataclass
 class PipeLineClient:
     """Wrap the pipeline calls to something nicer"""
@@ -24,6 +50,7 @@ class PipeLineClient:
 
     async def create(self, for_instance: TAKInstance, callback_url: str) -> None:
         """Call pipeline to spin up a new service"""
+        tokens = await PipelineTokens.singleton().ensure()
         post_data: Dict[str, Any] = {
             "resources": {
                 "repositories": {
@@ -33,7 +60,7 @@ class PipeLineClient:
                 },
             },
             "templateParameters": {
-                "SSH_PUBLIC_KEY": PipelineTokens.singleton().ssh_pub,
+                "SSH_PUBLIC_KEY": tokens.ssh_pub,
                 "WORKSPACE_NAME": str(for_instance.pk),
                 "CREATE": True,
                 "CALLBACK_URL": callback_url,
@@ -50,11 +77,16 @@ class PipeLineClient:
         if PIPELINE_SUPPRESS:
             LOGGER.warning("Pipeline runs supressed by config")
             return
+        import aiohttp  # pylint: disable=C0415 ; # slow import, most CLI commands import this module but never POST
+
+        await PipelineTokens.singleton().ensure()
         async with aiohttp.ClientSession(headers=self.default_headers) as session:
             LOGGER.debug("session.headers {}".format(session.headers))
             LOGGER.debug("POSTing {}".format(post_data))
             LOGGER.debug("to {}".format(PIPELINE_URL))
-            async with session.post(PIPELINE_URL, json=post_data) as resp:
+            with OUTBOUND_LATENCY.labels("pipeline", "run").time():
+                resp = await session.post(PIPELINE_URL, json=post_data)
+            async with resp:
                 if resp.status != 200:
                     LOGGER.error("Failure response {}".format(resp))
                     if resp.status == 400:
@@ -66,6 +98,7 @@ class PipeLineClient:
 
     async def delete(self, from_instance: TAKInstance) -> None:
         """Call pipeline to spin down existing service"""
+        tokens = await PipelineTokens.singleton().ensure()
         post_data = {
             "resources": {
                 "repositories": {
@@ -75,10 +108,31 @@ class PipeLineClient:
                 },
             },
             "templateParameters": {
-                "SSH_PUBLIC_KEY": PipelineTokens.singleton().ssh_pub,
+                "SSH_PUBLIC_KEY": tokens.ssh_pub,
                 "WORKSPACE_NAME": str(from_instance.pk),
                 "CREATE": False,
                 "SERVER_NAME": "not_actually_used",
             },
         }
         await self.do_post(post_data)
+
+    async def create_many(self, items: Sequence[Tuple[TAKInstance, str]]) -> List[Optional[BaseException]]:
+        """Call create for each (instance, callback_url) pair with bounded concurrency"""
+        return await run_bounded(self.create(instance, callback_url) for instance, callback_url in items)
+
+    async def delete_many(self, instances: Sequence[TAKInstance]) -> List[Optional[BaseException]]:
+        """Call delete for each instance with bounded concurrency"""
+        return await run_bounded(self.delete(instance) for instance in instances)
+
+    async def destroy_many(
+        self, instances: Sequence[TAKInstance]
+    ) -> Tuple[List[TAKInstance], List[Tuple[TAKInstance, BaseException]]]:
+        """Run the destroy pipelines and mark deleted only the instances whose destroy was accepted, the failed ones
+        stay live so the delete can be retried. Returns the deleted instances and the failed ones with their errors"""
+        errors = await self.delete_many(instances)
+        accepted = [instance.pk for instance, error in zip(instances, errors) if error is None]
+        failed = [(instance, error) for instance, error in zip(instances, errors) if error is not None]
+        if not accepted:
+            return [], failed
+        deleted = await TAKInstance.soft_delete_many(pks=accepted)
+        return deleted.instances, failed
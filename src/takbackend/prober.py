@@ -0,0 +1,124 @@
+"""Background sweep that records whether the certs-api of each live instance is up
+
+Only one worker/process sweeps at a time (advisory lock), the results go to certsapi_ready/certsapi_checked so the
+instance listing can show them without making any outbound calls itself.
+"""
+from typing import Any, Dict, List, Optional
+import asyncio
+import datetime
+import logging
+
+import aiohttp
+import sqlalchemy as sa
+
+from .certsapihelpers import ping_certsapi
+from .config import PROBE_INTERVAL, PROBE_CONCURRENCY, PROBE_TIMEOUT
+from .metrics import FLEET_CERTSAPI
+from .models import db, TAKInstance
+
+LOGGER = logging.getLogger(__name__)
+LOCK_KEY = 0x74616B70  # pg_try_advisory_lock key, only one worker/process sweeps at a time
+
+
+def sweep_query() -> Any:
+    """The live instances that have received their TF outputs"""
+    return TAKInstance.query.where(
+        TAKInstance.deleted == None  # pylint: disable=C0121 ; # "is None" will create invalid query
+    ).where(
+        TAKInstance.certsapi_base != None  # pylint: disable=C0121 ; # "is not None" will create invalid query
+    )
+
+
+async def probe(instances: List[TAKInstance], concurrency: int = PROBE_CONCURRENCY) -> Dict[bool, List[str]]:
+    """Ping the certs-apis, at most concurrency in flight, returns {up?: [pks]}"""
+    semaphore = asyncio.Semaphore(concurrency)
+    timeout = aiohttp.ClientTimeout(total=PROBE_TIMEOUT)
+
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+
+        async def probe_one(instance: TAKInstance) -> bool:
+            """Ping single instance, errors count as down"""
+            async with semaphore:
+                try:
+                    return await ping_certsapi(instance, session)
+                except Exception as exc:  # pylint: disable=W0703
+                    LOGGER.info("Ping of {} failed: {!r}".format(instance.pk, exc))
+                    return False
+
+        results = await asyncio.gather(*(probe_one(instance) for instance in instances))
+    ret: Dict[bool, List[str]] = {True: [], False: []}
+    for instance, result in zip(instances, results):
+        ret[result].append(str(instance.pk))
+    return ret
+
+
+async def sweep(min_age: float = PROBE_INTERVAL / 2) -> Optional[Dict[bool, List[str]]]:
+    """Probe all live instances and store the results, returns None if someone else is sweeping or did so less
+    than min_age seconds ago"""
+    async with db.acquire() as conn:
+        # Session level lock, released below (or when the connection dies)
+        if not await conn.scalar(sa.select([sa.func.pg_try_advisory_lock(LOCK_KEY)])):
+            LOGGER.debug("Fleet probe already running elsewhere")
+            return None
+        try:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            last = await conn.scalar(sa.select([sa.func.max(TAKInstance.certsapi_checked)]))
+            if last is not None and now - last < datetime.timedelta(seconds=min_age):
+                LOGGER.debug("Fleet probed {} ago, skipping".format(now - last))
+                return None
+            instances = await conn.all(sweep_query())
+            results = await probe(instances)
+            checked = datetime.datetime.now(datetime.timezone.utc)
+            for ready, pks in results.items():
+                if not pks:
+                    continue
+                # Keep updated as is so the probe does not look like a write to the replica freshness checks
+                await conn.status(
+                    TAKInstance.update.values(
+                        certsapi_ready=ready, certsapi_checked=checked, updated=TAKInstance.updated
+                    ).where(TAKInstance.pk.in_(pks))
+                )
+        finally:
+            await conn.scalar(sa.select([sa.func.pg_advisory_unlock(LOCK_KEY)]))
+    FLEET_CERTSAPI.labels("up").set(len(results[True]))
+    FLEET_CERTSAPI.labels("down").set(len(results[False]))
+    LOGGER.info("Fleet probed, {} up, {} down".format(len(results[True]), len(results[False])))
+    return results
+
+
+class FleetProber:
+    """Run sweep every PROBE_INTERVAL seconds in background"""
+
+    def __init__(self) -> None:
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    async def run(self) -> None:
+        """Sweep forever"""
+        while True:
+            try:
+                await sweep()
+            except Exception as exc:  # pylint: disable=W0703
+                LOGGER.exception("Fleet probe failed {}".format(exc))
+            await asyncio.sleep(PROBE_INTERVAL)
+
+    def start(self) -> None:
+        """Start in background unless disabled"""
+        if not PROBE_INTERVAL:
+            return
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self.run(), name="fleet_prober")
+
+    async def stop(self) -> None:
+        """Stop the background task"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+FLEET_PROBER = FleetProber()
@@ -0,0 +1,136 @@
+"""Opt-in per-request profiling for admins
+
+Only added to the app when PROFILING_ENABLED is set, so normally it costs nothing. When enabled requests without
+the PROFILING_HEADER only pay for one header lookup. Admins (JWT with the profiling ACL) sending the header get
+the request run under pyinstrument (sampling, follows the request across awaits) or cProfile if pyinstrument is not
+installed (deterministic and sees everything the event loop runs meanwhile), the result is stored in PROFILING_PATH
+and its name returned in the same header.
+
+The rate limit is shared by all the workers on the host through a lock file in PROFILING_PATH, the lock is held
+while profiling and the file contains the time the last profile was started.
+"""
+from typing import Any, Awaitable, Callable, MutableMapping, Optional, Tuple
+import cProfile
+import fcntl
+import importlib.util
+import logging
+import os
+import time
+import uuid
+
+from starlette.requests import Request
+from arkia11napi.security import JWTBearer, check_acl
+
+from .config import PROFILING_HEADER, PROFILING_PATH, PROFILING_MIN_INTERVAL
+
+# Imported only when the first profile is taken
+PYINSTRUMENT_AVAILABLE = importlib.util.find_spec("pyinstrument") is not None
+
+LOGGER = logging.getLogger(__name__)
+PROFILING_ACL = "fi.pvarki.takbackend.profiling:create"
+PROFILE_HEADER_BYTES = PROFILING_HEADER.lower().encode("latin-1")
+LOCKFILE_NAME = ".ratelimit.lock"
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+
+class ProfilingMiddleware:  # pylint: disable=R0903
+    """Profile the request if an admin asks for it"""
+
+    def __init__(self, app: ASGIApp, min_interval: float = PROFILING_MIN_INTERVAL) -> None:
+        self.app = app
+        self.min_interval = min_interval
+        self.bearer = JWTBearer(auto_error=False)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not any(key == PROFILE_HEADER_BYTES for key, _ in scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+        lockfd = self._acquire() if await self._is_admin(scope, receive) else None
+        if lockfd is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self._profiled(scope, receive, send)
+        finally:
+            self._release(lockfd)
+
+    async def _is_admin(self, scope: Scope, receive: Receive) -> bool:
+        """Check the JWT, the bearer only looks at the headers"""
+        jwt = await self.bearer(Request(scope, receive))
+        if not jwt:
+            return False
+        return bool(check_acl(jwt, PROFILING_ACL, auto_error=False))
+
+    def _acquire(self) -> Optional[int]:
+        """Rate limit shared by all workers on the host, one profiled request at a time and at most one per
+        min_interval. Returns the locked file descriptor to pass to _release or None if refused"""
+        PROFILING_PATH.mkdir(parents=True, exist_ok=True)
+        lockfd = os.open(PROFILING_PATH / LOCKFILE_NAME, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(lockfd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lockfd)
+            LOGGER.warning("Profiling request refused, another one is running")
+            return None
+        now = time.time()
+        try:
+            last_started = float(os.pread(lockfd, 64, 0) or 0)
+        except ValueError:
+            last_started = 0.0
+        if now - last_started < self.min_interval:
+            self._release(lockfd)
+            LOGGER.warning("Profiling request refused by rate limit")
+            return None
+        os.ftruncate(lockfd, 0)
+        os.pwrite(lockfd, str(now).encode("ascii"), 0)
+        return lockfd
+
+    @staticmethod
+    def _release(lockfd: int) -> None:
+        """Release the lock taken by _acquire"""
+        fcntl.flock(lockfd, fcntl.LOCK_UN)
+        os.close(lockfd)
+
+    async def _profiled(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Run the request under the profiler and store the result"""
+        filename, suffix = self._filename()
+
+        async def send_wrapper(message: Message) -> None:
+            """Tell the caller which file to look for"""
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((PROFILE_HEADER_BYTES, f"{filename}.{suffix}".encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        filepath = PROFILING_PATH / f"{filename}.{suffix}"
+        if PYINSTRUMENT_AVAILABLE:
+            from pyinstrument import Profiler  # pylint: disable=C0415
+
+            profiler = Profiler(async_mode="enabled")
+            profiler.start()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                profiler.stop()
+                filepath.write_text(profiler.output_html(), encoding="utf-8")
+        else:
+            cprofiler = cProfile.Profile()
+            cprofiler.enable()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                cprofiler.disable()
+                cprofiler.dump_stats(str(filepath))
+        LOGGER.info("Profile of {} {} stored to {}".format(scope["method"], scope["path"], filepath))
+
+    @staticmethod
+    def _filename() -> Tuple[str, str]:
+        """Unique filename (without suffix) and suffix for the profile output"""
+        stamp = time.strftime("%Y%m%dT%H%M%S")
+        suffix = "html" if PYINSTRUMENT_AVAILABLE else "pstats"
+        return f"{stamp}_{os.getpid()}_{uuid.uuid4().hex[:8]}", suffix
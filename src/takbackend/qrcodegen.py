@@ -6,27 +6,33 @@ import logging
 import io
 import base64
 
-import qrcode
 from libadvian.binpackers import ensure_str
 
+from .metrics import QRCODE_RENDER
+from .tracing import span
+
 LOGGER = logging.getLogger(__name__)
 
 
+@QRCODE_RENDER.time()
 def create_qrcode(data: str) -> bytes:
     """Return the image as bytes"""
-    qrgen = qrcode.QRCode(
-        version=None,
-        error_correction=qrcode.constants.ERROR_CORRECT_M,
-        box_size=8,
-        border=4,
-    )
-    qrgen.add_data(data)
-    qrgen.make(fit=True)
-    img = qrgen.make_image()
-    buffer = io.BytesIO()
-    img.save(buffer, "WEBP")
-    buffer.seek(0)
-    return buffer.read()
+    import qrcode  # pylint: disable=C0415 ; # qrcode + PIL are slow to import and only needed for owner instructions
+
+    with span("qrcode.render"):
+        qrgen = qrcode.QRCode(
+            version=None,
+            error_correction=qrcode.constants.ERROR_CORRECT_M,
+            box_size=8,
+            border=4,
+        )
+        qrgen.add_data(data)
+        qrgen.make(fit=True)
+        img = qrgen.make_image()
+        buffer = io.BytesIO()
+        img.save(buffer, "WEBP")
+        buffer.seek(0)
+        return buffer.read()
 
 
 def create_qrcode_b64(data: str) -> str:
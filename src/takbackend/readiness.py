@@ -0,0 +1,147 @@
+"""Watch provisioning instances and push their state transitions to the event streams
+
+There is one watcher per worker no matter how many streams are open, it checks all the watched instances with
+single query every READINESS_POLL_INTERVAL and pings the certs-apis of those that have their TF outputs. Instance
+invalidations via cachebus (like the TF callback) wake it up right away.
+"""
+from typing import AsyncGenerator, Dict, List, Optional, Set
+import asyncio
+import logging
+import time
+
+from . import cachebus
+from .certsapihelpers import ping_certsapi
+from .config import CERTSAPI_CONCURRENCY, READINESS_POLL_INTERVAL, READINESS_PING_TIMEOUT
+from .models import TAKInstance
+
+LOGGER = logging.getLogger(__name__)
+DISPATCHED = "dispatched"  # pipeline dispatched, waiting for the TF outputs
+TFOUTPUTS = "tfoutputs"  # TF outputs received, waiting for the certs-api to come up
+READY = "ready"
+FAILED = "failed"  # pipeline completed without usable TF outputs
+DELETED = "deleted"
+FINAL_STATES = (READY, FAILED, DELETED)
+
+
+async def load_instances(pkstrs: List[str]) -> Dict[str, TAKInstance]:
+    """Current rows of the instances from primary"""
+    query = TAKInstance.query.where(TAKInstance.pk.in_(pkstrs))
+    return {str(instance.pk): instance for instance in await query.gino.all()}
+
+
+class ReadinessWatcher:
+    """Shared watcher, streams get their state transitions from watch()"""
+
+    def __init__(self) -> None:
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._wakeup: Optional[asyncio.Event] = None  # created in the running loop, py3.8 binds it on creation
+        self._queues: Dict[str, Set["asyncio.Queue[str]"]] = {}
+        self._states: Dict[str, str] = {}
+        self._pinged: Dict[str, float] = {}
+        cachebus.subscribe(cachebus.TAKINSTANCE, self._invalidated)
+
+    def _invalidated(self, key: str) -> None:
+        """Check right away if a watched instance changed"""
+        if key == cachebus.ALL_KEYS or key in self._queues:
+            self.wake()
+
+    def wake(self) -> None:
+        """Make the watcher check now"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _state(self, pkstr: str, instance: Optional[TAKInstance], semaphore: asyncio.Semaphore) -> str:
+        """Resolve the current state, pings at most once per poll interval"""
+        if instance is None or instance.deleted:
+            return DELETED
+        if not instance.certsapi_base:
+            return FAILED if instance.tfcompleted else DISPATCHED
+        previous = self._states.get(pkstr)
+        if previous == READY:
+            return READY
+        if previous == TFOUTPUTS and time.monotonic() - self._pinged[pkstr] < READINESS_POLL_INTERVAL:
+            return TFOUTPUTS
+        async with semaphore:
+            self._pinged[pkstr] = time.monotonic()
+            try:
+                if await asyncio.wait_for(ping_certsapi(instance), timeout=READINESS_PING_TIMEOUT):
+                    return READY
+            except asyncio.TimeoutError:
+                LOGGER.debug("certs-api ping timed out for {}".format(pkstr))
+        return TFOUTPUTS
+
+    async def check(self) -> None:
+        """Resolve the states of all watched instances and notify the streams of changes"""
+        pkstrs = list(self._queues.keys())
+        if not pkstrs:
+            return
+        instances = await load_instances(pkstrs)
+        semaphore = asyncio.Semaphore(CERTSAPI_CONCURRENCY)
+        states = await asyncio.gather(*(self._state(pkstr, instances.get(pkstr), semaphore) for pkstr in pkstrs))
+        for pkstr, state in zip(pkstrs, states):
+            if self._states.get(pkstr) == state or pkstr not in self._queues:
+                continue
+            LOGGER.debug("Instance {} is now {}".format(pkstr, state))
+            self._states[pkstr] = state
+            for queue in self._queues[pkstr]:
+                queue.put_nowait(state)
+
+    async def run(self) -> None:
+        """Check forever, sleeping until woken up or the poll interval passes"""
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.check()
+            except Exception as exc:  # pylint: disable=W0703
+                LOGGER.exception("Readiness check failed {}".format(exc))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=READINESS_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def watch(self, pkstr: str, keepalive: float) -> AsyncGenerator[Optional[str], None]:
+        """Yield the current state and then every change until a final state, None every keepalive seconds
+        if nothing happened"""
+        queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._queues.setdefault(pkstr, set()).add(queue)
+        if pkstr in self._states:
+            queue.put_nowait(self._states[pkstr])
+        else:
+            self.wake()
+        try:
+            while True:
+                try:
+                    state = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield state
+                if state in FINAL_STATES:
+                    return
+        finally:
+            self._queues[pkstr].discard(queue)
+            if not self._queues[pkstr]:
+                del self._queues[pkstr]
+                self._states.pop(pkstr, None)
+                self._pinged.pop(pkstr, None)
+
+    def start(self) -> None:
+        """Start in background"""
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self.run(), name="readiness_watcher")
+
+    async def stop(self) -> None:
+        """Stop the background task"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+WATCHER = ReadinessWatcher()
@@ -0,0 +1,104 @@
+"""Optional read replica for the read-only endpoints
+
+When DB_REPLICA_DSN is set the read helpers here query the replica via its own pool. The replica lags behind
+so we read from the primary instead when:
+
+  - the row is not on the replica (yet)
+  - the row was updated less than REPLICA_FRESHNESS seconds ago
+  - something of the given kinds (listings) or the given row (see written_key) was written less than
+    REPLICA_FRESHNESS seconds ago in any worker (learned via cachebus), the replica copy of the row can't tell us
+    about writes it hasn't received
+"""
+from typing import Any, Dict, List, Optional
+import datetime
+import logging
+import time
+
+import gino
+
+from . import cachebus
+from .dbconfig import REPLICA_DSN, REPLICA_POOL_MIN_SIZE, REPLICA_POOL_MAX_SIZE, REPLICA_FRESHNESS, SSL
+from .models import db
+
+LOGGER = logging.getLogger(__name__)
+ENGINE: Optional[Any] = None
+LAST_WRITE: Dict[str, float] = {}  # kind or written_key -> time.monotonic() of last invalidation seen
+
+
+def written_key(kind: str, key: Any) -> str:
+    """LAST_WRITE key for the single row key of kind"""
+    return "{}:{}".format(kind, key)
+
+
+def _writer(kind: str) -> cachebus.InvalidationCallback:
+    """cachebus callback that records the write time of kind and the row, forgets the ones too old to matter"""
+
+    def record(key: str) -> None:
+        now = time.monotonic()
+        for stale in [seen for seen, when in LAST_WRITE.items() if now - when >= REPLICA_FRESHNESS]:
+            del LAST_WRITE[stale]
+        LAST_WRITE[kind] = now
+        LAST_WRITE[written_key(kind, key)] = now
+
+    return record
+
+
+for _kind in (cachebus.TAKINSTANCE, cachebus.CLIENTSEQUENCE, cachebus.CLIENT):
+    cachebus.subscribe(_kind, _writer(_kind))
+
+
+async def connect() -> None:
+    """Create the replica pool if configured"""
+    global ENGINE  # pylint: disable=W0603
+    if REPLICA_DSN is None or ENGINE is not None:
+        return
+    ENGINE = await gino.create_engine(
+        REPLICA_DSN, min_size=REPLICA_POOL_MIN_SIZE, max_size=REPLICA_POOL_MAX_SIZE, ssl=SSL
+    )
+    LOGGER.info("Read replica pool created")
+
+
+async def disconnect() -> None:
+    """Close the replica pool"""
+    global ENGINE  # pylint: disable=W0603
+    if ENGINE is None:
+        return
+    engine, ENGINE = ENGINE, None
+    await engine.close()
+
+
+def recently_updated(row: Any) -> bool:
+    """Was the row updated so recently the replica might not have it"""
+    updated = getattr(row, "updated", None)
+    if updated is None:
+        return True
+    return datetime.datetime.now(datetime.timezone.utc) - updated < datetime.timedelta(seconds=REPLICA_FRESHNESS)
+
+
+def recently_written(*kinds: str) -> bool:
+    """Has any of the kinds or rows (written_key) been written so recently the replica might not have it"""
+    now = time.monotonic()
+    seen = set(kinds)
+    for kind in kinds:
+        base, sep, _ = kind.partition(":")
+        if sep:
+            seen.add(written_key(base, cachebus.ALL_KEYS))
+    return any(now - LAST_WRITE[kind] < REPLICA_FRESHNESS for kind in seen if kind in LAST_WRITE)
+
+
+async def read_first(query: Any, *kinds: str) -> Any:
+    """First row of the query from replica, or from primary if needed or kinds/rows were recently written"""
+    if ENGINE is not None and not recently_written(*kinds):
+        row = await ENGINE.first(query)
+        if row is not None and not recently_updated(row):
+            return row
+    return await db.first(query)
+
+
+async def read_all(query: Any, *kinds: str) -> List[Any]:
+    """All rows of the query from replica, or from primary if kinds were recently written"""
+    if ENGINE is not None and not recently_written(*kinds):
+        rows = await ENGINE.all(query)
+        if not any(recently_updated(row) for row in rows):
+            return list(rows)
+    return list(await db.all(query))
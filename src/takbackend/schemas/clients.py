@@ -1,5 +1,5 @@
 """Pydantic schemas for clients and sequences"""
-from typing import Sequence
+from typing import Optional, Sequence
 import logging
 import uuid
 
@@ -40,6 +40,7 @@ class ClientSequenceDB(ClientSequenceCreate, DBBase):
     """Display/update ClientSequence objects"""
 
     next_client_no: int = Field(description="Next client number in sequence")
+    shortcode: str = Field(description="Code for the short url")
 
 
 class ClientSequencePager(PagerBase):
@@ -50,3 +51,26 @@ class ClientSequencePager(PagerBase):
 
 class ClientDB(DBBase):
     """Display/update Client objects"""
+
+    server: uuid.UUID = Field(description="UUID of the TAKInstance")
+    sequence: uuid.UUID = Field(description="UUID of the ClientSequence")
+    name: str = Field(description="Client name")
+    shortcode: str = Field(description="Code for the short url")
+
+
+class ClientPager(PagerBase):
+    """List clients (paginated)"""
+
+    items: Sequence[ClientDB] = Field(default_factory=list, description="The clients on this page")
+
+
+class ClientAllocatePartial(ClientPager):
+    """Clients were allocated but the zip bundle for them could not be created"""
+
+    error: Optional[str] = Field(default=None, description="Why the zip bundle could not be created")
+
+
+class ClientAllocate(CreateBase):
+    """Allocate many clients from ClientSequence at once"""
+
+    count: int = Field(gt=0, description="Number of clients to allocate")
@@ -1,11 +1,13 @@
 """Pydantic schemas for deployed instances"""
-from typing import Optional, Sequence, Dict, Any
+from typing import Optional, Sequence, Dict, Any, List
 import datetime
 import logging
+import uuid
 
-from pydantic import Field
+from pydantic import Field, validator
+from libadvian.binpackers import b64_to_uuid, ensure_str, ensure_utf8
 
-from .base import CreateBase, DBBase
+from .base import CreateBase, DBBase, SchemaBase
 from .pager import PagerBase
 
 
@@ -55,6 +57,15 @@ class TAKDBInstance(DBBase):
     tfcompleted: Optional[datetime.datetime] = Field(
         description="When was the TerraForm pipeline completed", nullable=True, default=None
     )
+    dns_name: Optional[str] = Field(description="DNS name of the server once TF completes", nullable=True, default=None)
+    certsapi_ready: Optional[bool] = Field(
+        description="Did the certs-api answer in the last background check, null if not checked yet",
+        nullable=True,
+        default=None,
+    )
+    certsapi_checked: Optional[datetime.datetime] = Field(
+        description="When was certsapi_ready last checked", nullable=True, default=None
+    )
     tfinputs: Optional[Dict[str, Any]] = Field(description="Inputs given to TerraForm, only visible to admins")
     tfoutputs: Optional[Dict[str, Any]] = Field(description="Outpust from TerraForm, only visible to admins")
     owner_instructions: Optional[str] = Field(
@@ -72,3 +83,54 @@ class TAKInstancePager(PagerBase):
     """List instances (paginated)"""
 
     items: Sequence[TAKDBInstance] = Field(default_factory=list, description="The instances on this page")
+
+
+class TAKInstanceBulkResult(SchemaBase):
+    """Result of single item in bulk operation"""
+
+    index: int = Field(description="Index of the item in the request")
+    success: bool = Field(description="Did the operation succeed for this item")
+    detail: Optional[str] = Field(description="Error details if not successful", nullable=True, default=None)
+    instance: Optional[TAKDBInstance] = Field(description="The instance if successful", nullable=True, default=None)
+
+
+class TAKInstanceBulkResults(SchemaBase):
+    """Results of bulk operation, one per item in request order"""
+
+    succeeded: int = Field(description="Number of successful items")
+    failed: int = Field(description="Number of failed items")
+    items: Sequence[TAKInstanceBulkResult] = Field(default_factory=list, description="Per item results")
+
+
+class TAKInstanceBulkDelete(SchemaBase):
+    """Select instances to delete by grouping and/or list of pks"""
+
+    grouping: Optional[str] = Field(description="Delete all instances in this grouping", nullable=True, default=None)
+    pks: Optional[List[uuid.UUID]] = Field(description="Delete instances with these UUIDs", nullable=True, default=None)
+
+    @classmethod
+    @validator("pks", pre=True, each_item=True)
+    def pks_must_be_uuid(cls, pkin: str) -> uuid.UUID:
+        """Make sure the given source for UUID can be parsed"""
+        try:
+            getpk = b64_to_uuid(ensure_utf8(pkin))
+        except ValueError:
+            getpk = uuid.UUID(ensure_str(pkin))
+        return getpk
+
+
+class TAKInstanceBulkDeleteFailure(SchemaBase):
+    """Instance whose destroy pipeline could not be triggered, it was not marked deleted"""
+
+    pk: uuid.UUID = Field(description="UUID of the instance")
+    detail: str = Field(description="Error details")
+
+
+class TAKInstanceBulkDeleted(SchemaBase):
+    """Instances whose destroy pipelines were triggered and that were marked deleted, and the ones that failed"""
+
+    count: int = Field(description="Number of instances marked deleted")
+    pks: Sequence[uuid.UUID] = Field(default_factory=list, description="UUIDs of the deleted instances")
+    failed: Sequence[TAKInstanceBulkDeleteFailure] = Field(
+        default_factory=list, description="Instances whose destroy pipeline failed, these are left as is"
+    )
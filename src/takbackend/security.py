@@ -1,11 +1,15 @@
 """Security stuff"""
-from typing import Optional, Any
+from typing import Optional, Any, Dict, TYPE_CHECKING
+import asyncio
+import base64
+import hashlib
+import hmac
 import logging
+import secrets
+import time
 from dataclasses import dataclass, field
 
-
-from azure.keyvault.secrets import SecretClient
-from azure.identity import DefaultAzureCredential
+from cryptography.fernet import Fernet
 
 
 from .config import (
@@ -14,46 +18,143 @@ from .config import (
     PIPELINE_SSHKEY_SECRETNAME,
     PIPELINE_SSHKEY_OVERRIDE,
     PIPELINE_TOKEN_OVERRIDE,
+    PIPELINE_TOKEN_TTL,
+    PIPELINE_TOKEN_REFRESH_MARGIN,
+    CLIENT_COOKIE_SECRET,
+    CLIENT_COOKIE_INSECURE_DEV,
+    FIELD_ENCRYPTION_KEY,
 )
 
+if TYPE_CHECKING:
+    from azure.keyvault.secrets.aio import SecretClient
+    from azure.identity.aio import DefaultAzureCredential
+
 
 LOGGER = logging.getLogger(__name__)
+REFRESH_RETRY_INTERVAL = 30
+SIGNING_KEY: Optional[bytes] = None
+FERNET: Optional[Fernet] = None
 
 
 @dataclass
-class PipelineTokens:
-    """Wrap the secret fetch to a singleton pattern"""
+class PipelineTokens:  # pylint: disable=R0902
+    """Wrap the secret fetch to a singleton pattern, values are cached and refreshed in the background"""
 
     bearer: Optional[str] = field(default=None, repr=False)
     ssh_pub: Optional[str] = field(default=None, repr=False)
+    fetched: Optional[float] = field(default=None)  # time.monotonic() of last successful fetch
+    ttl: int = field(default=PIPELINE_TOKEN_TTL)
 
     kvuri: str = field(default=f"https://{PIPELINE_TOKEN_KEYVAULT}.vault.azure.net")
-    _credentials: DefaultAzureCredential = field(init=False, repr=False)
-    _client: SecretClient = field(init=False, repr=False)
+    _credentials: "DefaultAzureCredential" = field(init=False, repr=False)
+    _client: "SecretClient" = field(init=False, repr=False)
+    _lock: Optional[asyncio.Lock] = field(default=None, init=False, repr=False)
+    _refresher: Optional["asyncio.Task[None]"] = field(default=None, init=False, repr=False)
 
     @property
-    def client(self) -> SecretClient:
+    def client(self) -> "SecretClient":
         """Init the client or return"""
         try:
             return self._client
         except AttributeError:
             pass
+        # The azure SDK is slow to import and not needed at all when the overrides are used
+        from azure.keyvault.secrets.aio import SecretClient  # pylint: disable=C0415
+        from azure.identity.aio import DefaultAzureCredential  # pylint: disable=C0415
+
         self._credentials = DefaultAzureCredential()
         self._client = SecretClient(vault_url=self.kvuri, credential=self._credentials)
         return self._client
 
+    @property
+    def needs_keyvault(self) -> bool:
+        """Are any of the values coming from the keyvault"""
+        return not (PIPELINE_TOKEN_OVERRIDE and PIPELINE_SSHKEY_OVERRIDE)
+
+    @property
+    def expired(self) -> bool:
+        """Has the TTL passed since last fetch"""
+        if self.fetched is None:
+            return True
+        return (time.monotonic() - self.fetched) > self.ttl
+
     def __post_init__(self) -> None:
-        """Fetch the keys here"""
+        """Set the overrides, keyvault values are fetched with fetch()"""
         if PIPELINE_TOKEN_OVERRIDE:
             self.bearer = PIPELINE_TOKEN_OVERRIDE
-        else:
-            secret = self.client.get_secret(PIPELINE_TOKEN_SECRETNAME)
-            self.bearer = secret.value
         if PIPELINE_SSHKEY_OVERRIDE:
             self.ssh_pub = PIPELINE_SSHKEY_OVERRIDE
-        else:
-            secret = self.client.get_secret(PIPELINE_SSHKEY_SECRETNAME)
-            self.ssh_pub = secret.value
+        if not self.needs_keyvault:
+            self.fetched = time.monotonic()
+
+    async def _get_secret(self, name: str) -> Optional[str]:
+        """Get single secret value from the keyvault"""
+        secret = await self.client.get_secret(name)
+        return secret.value
+
+    async def fetch(self) -> None:
+        """Fetch the keys from keyvault, the old values are kept until we have new ones"""
+        secretnames: Dict[str, str] = {}
+        if not PIPELINE_TOKEN_OVERRIDE:
+            secretnames["bearer"] = PIPELINE_TOKEN_SECRETNAME
+        if not PIPELINE_SSHKEY_OVERRIDE:
+            secretnames["ssh_pub"] = PIPELINE_SSHKEY_SECRETNAME
+        if not secretnames:
+            return
+        values = await asyncio.gather(*(self._get_secret(name) for name in secretnames.values()))
+        for attrname, value in zip(secretnames.keys(), values):
+            setattr(self, attrname, value)
+        self.fetched = time.monotonic()
+        LOGGER.debug("Pipeline secrets fetched from {}".format(self.kvuri))
+
+    async def ensure(self) -> "PipelineTokens":
+        """Make sure we have values, only blocks if nothing has been fetched yet"""
+        if self.fetched is not None:
+            return self
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.fetched is None:
+                await self.fetch()
+        return self
+
+    async def refresh_loop(self) -> None:
+        """Refresh the values before TTL expires, failures are retried and old values kept meanwhile"""
+        while True:
+            try:
+                await self.ensure()
+                assert self.fetched is not None
+                refresh_at = self.fetched + max(self.ttl - PIPELINE_TOKEN_REFRESH_MARGIN, REFRESH_RETRY_INTERVAL)
+                await asyncio.sleep(max(refresh_at - time.monotonic(), 0))
+                await self.fetch()
+            except Exception as exc:  # pylint: disable=W0703
+                LOGGER.exception("Could not refresh pipeline secrets: {}".format(exc))
+                if self.expired:
+                    LOGGER.error("Pipeline secrets are past their TTL")
+                await asyncio.sleep(REFRESH_RETRY_INTERVAL)
+
+    def start_refresher(self) -> None:
+        """Start the background refresh task (if needed and not already running)"""
+        if not self.needs_keyvault:
+            return
+        if self._refresher is not None and not self._refresher.done():
+            return
+        self._refresher = asyncio.create_task(self.refresh_loop(), name="pipelinetokens_refresh")
+
+    async def stop(self) -> None:
+        """Stop the refresher and close the keyvault client"""
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+        try:
+            await self._client.close()
+            await self._credentials.close()
+        except AttributeError:
+            pass
 
     @classmethod
     def singleton(cls, **kwargs: Any) -> "PipelineTokens":
@@ -66,3 +167,66 @@ class PipelineTokens:
 
 
 KVTOKEN_SINGLETON: Optional[PipelineTokens] = None
+
+
+def _signing_key() -> bytes:
+    """Key for signing values given to clients, CLIENT_COOKIE_SECRET must be set (and same for all the workers)"""
+    global SIGNING_KEY  # pylint: disable=W0603
+    if SIGNING_KEY is None:
+        if CLIENT_COOKIE_SECRET:
+            SIGNING_KEY = str(CLIENT_COOKIE_SECRET).encode("utf-8")
+        elif CLIENT_COOKIE_INSECURE_DEV:
+            LOGGER.warning("CLIENT_COOKIE_SECRET not set, using random signing key, do not do this in production")
+            SIGNING_KEY = secrets.token_bytes(32)
+        else:
+            raise RuntimeError("CLIENT_COOKIE_SECRET not set")
+    return SIGNING_KEY
+
+
+def init_signing_key() -> None:
+    """Resolve the signing key now so a missing CLIENT_COOKIE_SECRET fails the startup"""
+    _signing_key()
+
+
+def _signature(value: str) -> str:
+    """HMAC signature of the value"""
+    digest = hmac.new(_signing_key(), value.encode("utf-8"), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")
+
+
+def sign_value(value: str) -> str:
+    """Return value with signature appended"""
+    return f"{value}.{_signature(value)}"
+
+
+def unsign_value(signed: str) -> Optional[str]:
+    """Return the value if signature is valid, None otherwise"""
+    value, _, signature = signed.rpartition(".")
+    if not value or not hmac.compare_digest(signature, _signature(value)):
+        return None
+    return value
+
+
+def _fernet() -> Optional[Fernet]:
+    """Fernet for encrypting database fields, None if key not configured"""
+    global FERNET  # pylint: disable=W0603
+    if FERNET is None and FIELD_ENCRYPTION_KEY:
+        FERNET = Fernet(str(FIELD_ENCRYPTION_KEY).encode("utf-8"))
+    return FERNET
+
+
+def encrypt_field(value: str) -> Optional[str]:
+    """Encrypt value for storing in database, None if key not configured"""
+    fernet = _fernet()
+    if fernet is None:
+        LOGGER.warning("FIELD_ENCRYPTION_KEY not set, not storing encrypted field")
+        return None
+    return fernet.encrypt(value.encode("utf-8")).decode("ascii")
+
+
+def decrypt_field(value: str) -> str:
+    """Decrypt value encrypted with encrypt_field"""
+    fernet = _fernet()
+    if fernet is None:
+        raise RuntimeError("FIELD_ENCRYPTION_KEY not set")
+    return fernet.decrypt(value.encode("ascii")).decode("utf-8")
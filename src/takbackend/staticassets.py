@@ -0,0 +1,110 @@
+"""Static files with content-hashed urls, served precompressed from memory
+
+The assets are read, hashed and compressed (at the best levels) once at startup. The hashed urls
+(style.<hash>.css, see static_url) are cacheable forever, the plain names still work with short max-age.
+"""
+from typing import Any, Awaitable, Callable, Dict, MutableMapping, Tuple
+from dataclasses import dataclass, field
+from pathlib import Path
+import hashlib
+import logging
+import mimetypes
+
+from starlette.responses import Response, PlainTextResponse
+
+from .compression import available_encodings, choose_encoding, compress, encoded_etag
+from .config import STATIC_PATH, STATIC_MAX_AGE
+
+LOGGER = logging.getLogger(__name__)
+IMMUTABLE = "public, max-age=31536000, immutable"
+BEST_LEVELS = {"br": 11, "gzip": 9}
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+
+
+@dataclass
+class Asset:
+    """Single static file with its compressed variants"""
+
+    name: str  # relative path, like "style.css"
+    hashed_name: str  # like "style.0123456789ab.css"
+    media_type: str
+    etag: str  # of the identity variant, see encoded_etag
+    variants: Dict[str, bytes] = field(default_factory=dict, repr=False)  # content-coding -> body
+
+    @classmethod
+    def load(cls, directory: Path, path: Path) -> "Asset":
+        """Read, hash and compress"""
+        content = path.read_bytes()
+        digest = hashlib.sha256(content).hexdigest()[:12]
+        name = path.relative_to(directory).as_posix()
+        stem, dot, suffix = name.rpartition(".")
+        hashed_name = f"{stem}.{digest}.{suffix}" if dot else f"{name}.{digest}"
+        asset = cls(
+            name=name,
+            hashed_name=hashed_name,
+            media_type=mimetypes.guess_type(name)[0] or "application/octet-stream",
+            etag=f'"{digest}"',
+            variants={"identity": content},
+        )
+        for encoding in available_encodings():
+            compressed = compress(content, encoding, BEST_LEVELS[encoding])
+            if len(compressed) < len(content):
+                asset.variants[encoding] = compressed
+        return asset
+
+
+class HashedStaticFiles:  # pylint: disable=R0903
+    """ASGI app to mount in place of StaticFiles"""
+
+    def __init__(self, directory: Path) -> None:
+        self.assets: Dict[str, Tuple[Asset, bool]] = {}  # url path -> (asset, is hashed url)
+        self.hashed_names: Dict[str, str] = {}
+        for path in sorted(directory.rglob("*")):
+            if not path.is_file():
+                continue
+            asset = Asset.load(directory, path)
+            self.assets[asset.name] = (asset, False)
+            self.assets[asset.hashed_name] = (asset, True)
+            self.hashed_names[asset.name] = asset.hashed_name
+            LOGGER.debug("Static {} as {} {}".format(asset.name, asset.hashed_name, list(asset.variants.keys())))
+
+    def hashed_path(self, path: str) -> str:
+        """The hashed path for url_for, unknown paths are returned as is"""
+        return "/" + self.hashed_names.get(path.lstrip("/"), path.lstrip("/"))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        assert scope["type"] == "http"
+        if scope["method"] not in ("GET", "HEAD"):
+            await PlainTextResponse("Method Not Allowed", status_code=405)(scope, receive, send)
+            return
+        found = self.assets.get(scope["path"].lstrip("/"))
+        if found is None:
+            await PlainTextResponse("Not Found", status_code=404)(scope, receive, send)
+            return
+        asset, hashed = found
+        request_headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        compressed = [coding for coding in asset.variants if coding != "identity"]
+        encoding = choose_encoding(request_headers.get("accept-encoding", ""), compressed)
+        headers = {
+            "cache-control": IMMUTABLE if hashed else f"public, max-age={STATIC_MAX_AGE}",
+            "etag": encoded_etag(asset.etag, encoding or "identity"),
+            "vary": "Accept-Encoding",
+        }
+        if encoding is not None:
+            headers["content-encoding"] = encoding
+        if_none_match = [etag.strip() for etag in request_headers.get("if-none-match", "").split(",")]
+        if headers["etag"] in if_none_match or f"W/{headers['etag']}" in if_none_match or "*" in if_none_match:
+            headers.pop("content-encoding", None)
+            await Response(status_code=304, headers=headers)(scope, receive, send)
+            return
+        body = asset.variants[encoding or "identity"]
+        if scope["method"] == "HEAD":
+            headers["content-length"] = str(len(body))
+            body = b""
+        await Response(body, media_type=asset.media_type, headers=headers)(scope, receive, send)
+
+
+STATIC_FILES = HashedStaticFiles(STATIC_PATH)
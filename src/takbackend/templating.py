@@ -0,0 +1,27 @@
+"""Single Jinja2 environment per worker for the HTML views and the emails so each template is compiled only once"""
+from typing import Any, List
+
+from fastapi.templating import Jinja2Templates
+from jinja2 import pass_context
+
+from .config import TEMPLATES_PATH
+from .staticassets import STATIC_FILES
+
+TEMPLATES = Jinja2Templates(directory=str(TEMPLATES_PATH))
+
+
+@pass_context
+def static_url(context: Any, path: str) -> str:
+    """url_for("static", ...) with the content-hashed path so it can be cached forever"""
+    return str(context["request"].url_for("static", path=STATIC_FILES.hashed_path(path)))
+
+
+TEMPLATES.env.globals["static_url"] = static_url
+
+
+def compile_all() -> List[str]:
+    """Compile every template in TEMPLATES_PATH into the environment cache, returns the template names"""
+    names = TEMPLATES.env.list_templates()
+    for name in names:
+        TEMPLATES.env.get_template(name)
+    return names
@@ -0,0 +1,98 @@
+"""OpenTelemetry tracing, everything here is a no-op unless the tracing extra is installed and TRACING_EXPORTER is set
+
+FastAPI routes, asyncpg (and thus gino) queries and aiohttp client calls are instrumented automatically, the aiohttp
+instrumentation also injects the traceparent header so the pipeline and ready callback receivers can continue the trace.
+"""
+from typing import Any, Iterator, Optional, TYPE_CHECKING
+from contextlib import contextmanager
+import logging
+import os
+
+from .config import TRACING_EXPORTER, TRACING_FILE, TRACING_SERVICE_NAME
+
+if TYPE_CHECKING:
+    from fastapi import FastAPI
+    from opentelemetry.sdk.trace.export import SpanExporter
+
+# The opentelemetry packages are slow to import so they are only imported when TRACING_EXPORTER is set
+LOGGER = logging.getLogger(__name__)
+ENABLED = False
+TRACER: Optional[Any] = None
+
+
+def _exporter() -> Optional["SpanExporter"]:
+    """Exporter as configured by TRACING_EXPORTER"""
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter  # pylint: disable=C0415
+
+    if TRACING_EXPORTER == "console":
+        return ConsoleSpanExporter()
+    if TRACING_EXPORTER == "file":
+        # One file per process, gunicorn workers would otherwise interleave their writes
+        path = TRACING_FILE.format(pid=os.getpid())
+        out = open(path, "at", encoding="utf-8")  # pylint: disable=R1732 ; # kept open for the process lifetime
+        return ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + os.linesep)
+    if TRACING_EXPORTER == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (  # pylint: disable=C0415
+                OTLPSpanExporter,
+            )
+        except ImportError:
+            LOGGER.error("TRACING_EXPORTER=otlp but opentelemetry-exporter-otlp-proto-http is not installed")
+            return None
+        # Endpoint etc are configured with the standard OTEL_EXPORTER_OTLP_* env variables
+        return OTLPSpanExporter()
+    LOGGER.error("Unknown TRACING_EXPORTER {}".format(TRACING_EXPORTER))
+    return None
+
+
+def init_tracing(app: "FastAPI") -> None:
+    """Set up the provider and instrument the app and libraries"""
+    global ENABLED, TRACER  # pylint: disable=W0603
+    if not TRACING_EXPORTER or ENABLED:
+        return
+    # pylint: disable=C0415
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+        from opentelemetry.instrumentation.asyncpg import AsyncPGInstrumentor
+        from opentelemetry.instrumentation.aiohttp_client import AioHttpClientInstrumentor
+    except ImportError:
+        LOGGER.error("TRACING_EXPORTER is set but the tracing extra is not installed")
+        return
+    # pylint: enable=C0415
+    exporter = _exporter()
+    if exporter is None:
+        return
+    provider = TracerProvider(resource=Resource.create({"service.name": TRACING_SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    FastAPIInstrumentor.instrument_app(app, tracer_provider=provider)
+    AsyncPGInstrumentor().instrument(tracer_provider=provider)
+    AioHttpClientInstrumentor().instrument(tracer_provider=provider)
+    TRACER = trace.get_tracer(__name__)
+    ENABLED = True
+    LOGGER.info("Tracing enabled, exporting to {}".format(TRACING_EXPORTER))
+
+
+def shutdown_tracing() -> None:
+    """Flush pending spans"""
+    if not ENABLED:
+        return
+    from opentelemetry import trace  # pylint: disable=C0415
+
+    provider = trace.get_tracer_provider()
+    if hasattr(provider, "shutdown"):
+        provider.shutdown()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[None]:
+    """Manual span for things the instrumentations do not see (CPU work, multi-step operations)"""
+    if TRACER is None:
+        yield
+        return
+    with TRACER.start_as_current_span(name, attributes=attributes):
+        yield
@@ -1,23 +1,23 @@
 """callbacks for TF etc"""
 from typing import Dict, Any, List, cast
 import asyncio
+import datetime
 import logging
 
-import pendulum
 import aiohttp
 from aiohttp.client_exceptions import ClientError
 from fastapi import APIRouter, HTTPException, Request
 from starlette import status
 from arkia11napi.helpers import get_or_404
-from fastapi_mail import MessageSchema, MessageType
-from jinja2 import Environment, FileSystemLoader
 
 
 from ..models import TAKInstance
-from ..mailer import singleton as getmailer
-from ..config import TEMPLATES_PATH, ORDER_READY_SUBJECT
+from ..mailer import DISPATCHER as MAIL_DISPATCHER
+from ..config import ORDER_READY_SUBJECT
+from ..templating import TEMPLATES
 from ..schemas.instance import TAKDBInstance
-from ..certsapihelpers import ping_until_ok
+from ..certsapihelpers import ping_until_ok, certsapi_fields
+from ..metrics import spawn, OUTBOUND_LATENCY
 
 LOGGER = logging.getLogger(__name__)
 CALLBACKS_ROUTER = APIRouter()
@@ -27,38 +27,28 @@ async def queue_ready_email(instance: TAKInstance, request: Request) -> None:
     """Send the ready email"""
     instance.tfinputs = cast(Dict[str, Any], instance.tfinputs)
     instance.tfoutputs = cast(Dict[str, Any], instance.tfoutputs)
-    template = Environment(loader=FileSystemLoader(TEMPLATES_PATH), autoescape=True).get_template(
-        "order_ready_email.txt"
-    )
-    msg = MessageSchema(
-        subject=ORDER_READY_SUBJECT,
-        recipients=[instance.ready_email],
-        subtype=MessageType.plain,
-        body=template.render(
-            url=request.url_for("owner_instructions", pkstr=str(instance.pk)),
-            friendly_name=instance.tfinputs.get("server_name", "undefined"),
-        ),
+    template = TEMPLATES.env.get_template("order_ready_email.txt")
+    body = template.render(
+        url=request.url_for("owner_instructions", pkstr=str(instance.pk)),
+        friendly_name=instance.tfinputs.get("server_name", "undefined"),
     )
 
-    async def send_when_pings(msg: MessageSchema, instance: TAKInstance) -> None:
+    async def send_when_pings(body: str, instance: TAKInstance) -> None:
         """Ping certsapi and send the email when ping goes through"""
         if not await ping_until_ok(instance):
             return
         try:
-            mailer = getmailer()
-            await mailer.send_message(msg)
+            await MAIL_DISPATCHER.send(MAIL_DISPATCHER.build(ORDER_READY_SUBJECT, [instance.ready_email], body))
         except Exception as exc:  # pylint: disable=W0703
             LOGGER.exception("mail delivery failure {}".format(exc))
 
-    asyncio.create_task(send_when_pings(msg, instance), name="send_ready_email")
+    spawn(send_when_pings(body, instance), name="send_ready_email")
 
 
 async def queue_ready_callback(instance: TAKInstance, request: Request) -> None:
     """Do the ready callback"""
     instance.tfinputs = cast(Dict[str, Any], instance.tfinputs)
-    pdinstsrc = instance.to_dict()
-    pdinstsrc["server_name"] = instance.tfinputs.get("server_name", "undefined")
-    pdinst = TAKDBInstance.parse_obj(pdinstsrc)
+    pdinst = TAKDBInstance.parse_obj(instance.to_public_dict("undefined"))
     pdinst.tfoutputs = None
     pdinst.tfinputs = None
     pdinst.owner_instructions = request.url_for("owner_instructions", pkstr=str(instance.pk))
@@ -72,14 +62,16 @@ async def queue_ready_callback(instance: TAKInstance, request: Request) -> None:
             async with aiohttp.ClientSession() as session:
                 url = instance.ready_callback_url
                 LOGGER.debug("POSTing {} to {}".format(data_str, url))
-                async with session.post(url, data=data_str) as resp:
+                with OUTBOUND_LATENCY.labels("callback", "ready").time():
+                    resp = await session.post(url, data=data_str)
+                async with resp:
                     LOGGER.debug("Got response {}".format(resp))
                     if resp.status >= 400:
                         LOGGER.error("Got error from callback {}".format(resp))
         except ClientError as exc:
             LOGGER.exception("Callback failed {}".format(exc))
 
-    asyncio.create_task(do_when_pings(data_str, instance), name="do_ready_callback")
+    spawn(do_when_pings(data_str, instance), name="do_ready_callback")
 
 
 @CALLBACKS_ROUTER.post(
@@ -91,7 +83,13 @@ async def terraform_callback(request: Request, pkstr: str, tfoutputs: Dict[str,
     if instance.tfcompleted:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="May only be called once per instance")
     LOGGER.debug("called for {}, tfoutputs={}".format(pkstr, tfoutputs))
-    await instance.update(tfcompleted=pendulum.now("UTC"), tfoutputs=tfoutputs).apply()
+    values: Dict[str, Any] = {"tfcompleted": datetime.datetime.now(datetime.timezone.utc), "tfoutputs": tfoutputs}
+    try:
+        values.update(certsapi_fields(tfoutputs))
+    except ValueError as exc:
+        # Store what we got anyway, the instructions views will tell the users something is wrong
+        LOGGER.error("Invalid tfoutputs for {}: {}".format(pkstr, exc))
+    await instance.update_and_publish(**values)
 
     tasks: List[asyncio.Task[Any]] = []
     if instance.ready_email:
@@ -1,34 +1,119 @@
 """Views for Client objects"""
+from typing import Optional
 import logging
+import re
 
-from fastapi import APIRouter, Request
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import RedirectResponse
+from fastapi import APIRouter, Request, Response, HTTPException
+from fastapi.responses import RedirectResponse, HTMLResponse
 from starlette import status
 from arkia11napi.helpers import get_or_404
 
 
-from ..config import TEMPLATES_PATH
-from ..models import ClientSequence
+from ..config import CLIENT_COOKIE_MAX_AGE, PREVIEW_USER_AGENTS
+from ..models import ClientSequence, Client
+from ..models.clients import SequenceDeletedError
+from ..security import sign_value, unsign_value
+from ..modelcache import pkstr_to_str, CLIENTS
 
 
 LOGGER = logging.getLogger(__name__)
-TEMPLATES = Jinja2Templates(directory=str(TEMPLATES_PATH))
 CLIENTS_ROUTER = APIRouter()
+CLIENT_COOKIE_NAME = "takclient"
+PREVIEW_UA_RE = re.compile(PREVIEW_USER_AGENTS, re.IGNORECASE)
+PREFETCH_HEADERS = ("purpose", "sec-purpose", "x-purpose", "x-moz")
+
+
+def is_preview(request: Request) -> bool:
+    """Is this a link previewer, crawler or browser prefetch instead of actual user"""
+    for header in PREFETCH_HEADERS:
+        value = request.headers.get(header, "").lower()
+        if "prefetch" in value or "preview" in value:
+            return True
+    return bool(PREVIEW_UA_RE.search(request.headers.get("user-agent", "")))
+
+
+async def client_from_cookie(request: Request, sequence_pk: str) -> Optional[Client]:
+    """Resolve the client already allocated to this device from this sequence, if any"""
+    signed = request.cookies.get(CLIENT_COOKIE_NAME)
+    if not signed:
+        return None
+    value = unsign_value(signed)
+    if not value:
+        return None
+    cookie_sequence_pk, _, client_pk = value.partition(":")
+    if cookie_sequence_pk != sequence_pk:
+        return None
+    client = await CLIENTS.get(client_pk)
+    if not client or client.deleted or str(client.sequence) != sequence_pk:
+        return None
+    return client
+
+
+def preview_response() -> Response:
+    """Minimal page for previewers, nothing gets allocated"""
+    return HTMLResponse(
+        "<!DOCTYPE html><html><head><title>TAK</title></head><body></body></html>",
+        headers={"Cache-Control": "no-store"},
+    )
+
+
+def redirect_to_client(request: Request, client: Client) -> Response:
+    """Redirect to the client instructions and remember the client for this device"""
+    destination = request.url_for("client_shortcode", code=client.shortcode)
+    resp = RedirectResponse(str(destination), status_code=status.HTTP_302_FOUND)
+    resp.headers["Cache-Control"] = "no-store"
+    resp.set_cookie(
+        CLIENT_COOKIE_NAME,
+        sign_value(f"{client.sequence}:{client.pk}"),
+        max_age=CLIENT_COOKIE_MAX_AGE,
+        path=request.url.path,
+        secure=request.url.scheme == "https",
+        httponly=True,
+        samesite="lax",
+    )
+    return resp
+
+
+async def allocate_or_404(sequence: ClientSequence) -> Client:
+    """Next client from sequence, 404 if the sequence was deleted"""
+    try:
+        return await sequence.next_client()
+    except SequenceDeletedError as exc:
+        raise HTTPException(status_code=404, detail="Not found") from exc
+
 
-# FIXME: semantically GETs should be idempotent, but can we solve it in any reasonable way ??
 @CLIENTS_ROUTER.get(
     "/api/v1/tak/sequences/nextclient/{pkstr}",
     tags=["tak-clients"],
     response_class=RedirectResponse,
     name="get_next_client",
 )
-async def get_next_client(pkstr: str, request: Request) -> RedirectResponse:
-    """Get next client in sequence"""
-    sequence = await get_or_404(ClientSequence, pkstr)
+async def get_next_client(pkstr: str, request: Request) -> Response:
+    """Get next client in sequence, repeat visits from same device get the same client"""
+    if is_preview(request):
+        return preview_response()
+    sequence_pk = pkstr_to_str(pkstr)
+    client = await client_from_cookie(request, sequence_pk) if sequence_pk else None
+    if not client:
+        sequence = await get_or_404(ClientSequence, pkstr)
+        client = await allocate_or_404(sequence)
+    return redirect_to_client(request, client)
 
-    client = await sequence.next_client()
-    destination = request.url_for("get_client_instructions", pkstr=str(client.pk))
 
-    resp = RedirectResponse(str(destination), status_code=status.HTTP_302_FOUND)
-    return resp
+@CLIENTS_ROUTER.get(
+    "/s/{code}",
+    tags=["tak-clients"],
+    response_class=RedirectResponse,
+    name="sequence_shortcode",
+)
+async def get_next_client_short(code: str, request: Request) -> Response:
+    """Short url for get_next_client, used in the QR codes"""
+    if is_preview(request):
+        return preview_response()
+    sequence = await ClientSequence.by_shortcode(code)
+    if not sequence:
+        raise HTTPException(status_code=404, detail="Not found")
+    client = await client_from_cookie(request, str(sequence.pk))
+    if not client:
+        client = await allocate_or_404(sequence)
+    return redirect_to_client(request, client)
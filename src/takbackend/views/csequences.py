@@ -1 +1,84 @@
 """Views for ClientSequences"""
+from typing import Dict
+import io
+import logging
+import zipfile
+
+from fastapi import APIRouter, Depends, Request, Response, HTTPException
+from starlette import status
+from arkia11napi.helpers import get_or_404
+from arkia11napi.security import JWTBearer, check_acl
+
+
+from ..config import BULK_MAX_ITEMS
+from ..models import TAKInstance, ClientSequence
+from ..models.clients import MaxclientsError
+from ..schemas.clients import ClientAllocate, ClientAllocatePartial, ClientDB, ClientPager
+from ..certsapihelpers import get_or_create_client_zips
+from ..metrics import ZIP_BYTES
+from .instructions import ensure_ready
+
+
+LOGGER = logging.getLogger(__name__)
+CSEQUENCES_ROUTER = APIRouter(dependencies=[Depends(JWTBearer(auto_error=True))])
+
+
+def bundle_zips(zips: Dict[str, bytes]) -> bytes:
+    """Pack the client zips into single zip"""
+    buffer = io.BytesIO()
+    # The client zips are already compressed
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        for name, content in zips.items():
+            archive.writestr(f"{name}.zip", content)
+    return buffer.getvalue()
+
+
+@CSEQUENCES_ROUTER.post(
+    "/api/v1/tak/sequences/{pkstr}/clients",
+    tags=["tak-clients"],
+    response_model=ClientPager,
+    status_code=status.HTTP_201_CREATED,
+    responses={201: {"content": {"application/zip": {}}}, 207: {"model": ClientAllocatePartial}},
+)
+async def allocate_clients(request: Request, pkstr: str, allocate: ClientAllocate, bundle: bool = False) -> Response:
+    """Allocate many clients from the sequence at once, with bundle=true returns single zip of all client zips.
+    If the clients were allocated but the zip could not be created returns 207 with the clients and the error"""
+    sequence = await get_or_404(ClientSequence, pkstr)
+    if sequence.deleted:
+        raise HTTPException(status_code=404, detail="Not found")
+    instance = await get_or_404(TAKInstance, str(sequence.server))
+    if not check_acl(request.state.jwt, "fi.pvarki.takbackend.instance:read", auto_error=False):
+        if instance.ownerid != request.state.jwt["userid"]:
+            raise HTTPException(status_code=403, detail="Required privilege not granted.")
+    if allocate.count > BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"At most {BULK_MAX_ITEMS} clients per call"
+        )
+    if bundle:
+        # Check certs-api is up before using up the slots in the sequence
+        instance = await ensure_ready(instance)
+
+    try:
+        clients = await sequence.allocate_clients(allocate.count)
+    except MaxclientsError as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc)) from exc
+
+    items = [ClientDB.parse_obj(client.to_dict()) for client in clients]
+    if not bundle:
+        pager = ClientPager(count=len(clients), items=items)
+        return Response(content=pager.json(), media_type="application/json", status_code=status.HTTP_201_CREATED)
+
+    try:
+        zips = await get_or_create_client_zips(instance, [client.name for client in clients])
+    except Exception as exc:  # pylint: disable=W0703
+        LOGGER.exception("Could not create zips for clients allocated from {}".format(sequence.pk))
+        partial = ClientAllocatePartial(count=len(clients), items=items, error=f"Could not create zips: {exc}")
+        return Response(content=partial.json(), media_type="application/json", status_code=status.HTTP_207_MULTI_STATUS)
+    content = bundle_zips(zips)
+    ZIP_BYTES.labels("allocate_clients").inc(len(content))
+    return Response(
+        content=content,
+        media_type="application/zip",
+        status_code=status.HTTP_201_CREATED,
+        headers={"Content-Disposition": f'attachment;filename="{sequence.prefix}clients.zip"'},
+    )
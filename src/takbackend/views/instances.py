@@ -1,34 +1,38 @@
 """TAKInstance related endpoints"""
-from typing import List
+from typing import Any, Dict, List
 import logging
 import uuid
 
-import pendulum
 from fastapi import APIRouter, Depends, Request, HTTPException
-from fastapi.templating import Jinja2Templates
 from starlette import status
 from arkia11napi.helpers import get_or_404
 from arkia11napi.security import JWTBearer, check_acl
 
 
-from ..config import TEMPLATES_PATH
-from ..schemas.instance import TAKDBInstance, TAKInstanceCreate, TAKInstancePager
+from ..config import BULK_MAX_ITEMS
+from ..schemas.instance import (
+    TAKDBInstance,
+    TAKInstanceCreate,
+    TAKInstancePager,
+    TAKInstanceBulkResult,
+    TAKInstanceBulkResults,
+    TAKInstanceBulkDelete,
+    TAKInstanceBulkDeleted,
+    TAKInstanceBulkDeleteFailure,
+)
 from ..models import TAKInstance, ClientSequence
 from ..pipelineclient import PipeLineClient
+from .. import cachebus
+from ..modelcache import get_or_404_replica
+from ..replica import read_all
 
 
 LOGGER = logging.getLogger(__name__)
-TEMPLATES = Jinja2Templates(directory=str(TEMPLATES_PATH))
 INSTANCE_ROUTER = APIRouter(dependencies=[Depends(JWTBearer(auto_error=True))])
 
 
-@INSTANCE_ROUTER.post(
-    "/api/v1/tak/instances", tags=["tak-instances"], response_model=TAKDBInstance, status_code=status.HTTP_201_CREATED
-)
-async def create_instance(request: Request, pdinstance: TAKInstanceCreate) -> TAKDBInstance:
-    """Create a new TAKInstance"""
-    check_acl(request.state.jwt, "fi.pvarki.takbackend.instance:create")
-    LOGGER.debug("pdinstance={}".format(pdinstance))
+def instance_values(request: Request, pdinstance: TAKInstanceCreate) -> Dict[str, Any]:
+    """Map creation schema to values for database, DRY for single and bulk creation"""
     # Default to email from JWT if not given
     if not pdinstance.ready_email:
         if "email" in request.state.jwt:
@@ -37,25 +41,39 @@ async def create_instance(request: Request, pdinstance: TAKInstanceCreate) -> TA
     # Remove properties that are not present in database
     server_name = data.pop("server_name")
     del data["sequence_prefix"], data["sequence_max"]
-    # Create instance to database
-    takinstance = TAKInstance(**data)
-    takinstance.tfinputs = {
+    data["tfinputs"] = {
         "server_name": server_name,
     }
-    # pylint: disable=invalid-name
-    if not takinstance.pk:
-        takinstance.pk = uuid.uuid4()  # type: ignore
-    # pylint: enable=invalid-name
-    callback_url = request.url_for("tf_callback", pkstr=str(takinstance.pk))
-    await takinstance.create()
-    refresh = await TAKInstance.get(takinstance.pk)
+    data["pk"] = uuid.uuid4()
+    return data
+
+
+def instance_to_pd(request: Request, instance: TAKInstance) -> TAKDBInstance:
+    """Map database instance to response schema, tfdata only visible to those with privileges"""
+    ret = TAKDBInstance.parse_obj(instance.to_public_dict())
+    if not check_acl(request.state.jwt, "fi.pvarki.takbackend.tfdata:read", auto_error=False):
+        ret.tfinputs = None
+        ret.tfoutputs = None
+    return ret
+
+
+@INSTANCE_ROUTER.post(
+    "/api/v1/tak/instances", tags=["tak-instances"], response_model=TAKDBInstance, status_code=status.HTTP_201_CREATED
+)
+async def create_instance(request: Request, pdinstance: TAKInstanceCreate) -> TAKDBInstance:
+    """Create a new TAKInstance"""
+    check_acl(request.state.jwt, "fi.pvarki.takbackend.instance:create")
+    LOGGER.debug("pdinstance={}".format(pdinstance))
+    # Create instance to database
+    refresh = await TAKInstance.create_new(**instance_values(request, pdinstance))
+    callback_url = request.url_for("tf_callback", pkstr=str(refresh.pk))
     client = PipeLineClient()
     try:
-        await client.create(takinstance, callback_url)
+        await client.create(refresh, callback_url)
     except Exception as exc:
         LOGGER.exception("Could not trigger pipeline {}".format(exc))
         # Do not leave stuff laying around
-        await refresh.delete()
+        await refresh.delete_and_publish()
         raise
 
     if pdinstance.sequence_prefix and pdinstance.sequence_max:
@@ -63,33 +81,70 @@ async def create_instance(request: Request, pdinstance: TAKInstanceCreate) -> TA
             instance=refresh, prefix=pdinstance.sequence_prefix, max_clients=pdinstance.sequence_max
         )
 
-    retsrc = refresh.to_dict()
-    retsrc["server_name"] = refresh.tfinputs.get("server_name", "unresolved")
-    ret = TAKDBInstance.parse_obj(retsrc)
-    if not check_acl(request.state.jwt, "fi.pvarki.takbackend.tfdata:read", auto_error=False):
-        ret.tfinputs = None
-        ret.tfoutputs = None
-    return ret
+    return instance_to_pd(request, refresh)
+
+
+@INSTANCE_ROUTER.post(
+    "/api/v1/tak/instances/bulk",
+    tags=["tak-instances"],
+    response_model=TAKInstanceBulkResults,
+    status_code=status.HTTP_200_OK,
+)
+async def create_instances_bulk(request: Request, pdinstances: List[TAKInstanceCreate]) -> TAKInstanceBulkResults:
+    """Create many TAKInstances (and their ClientSequences) at once, results are given per item"""
+    check_acl(request.state.jwt, "fi.pvarki.takbackend.instance:create")
+    if len(pdinstances) > BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"At most {BULK_MAX_ITEMS} items per call"
+        )
+    if not pdinstances:
+        return TAKInstanceBulkResults(succeeded=0, failed=0, items=[])
+
+    instance_rows = [instance_values(request, pdinstance) for pdinstance in pdinstances]
+    sequence_rows = [
+        {"server": row["pk"], "prefix": pdinstance.sequence_prefix, "max_clients": pdinstance.sequence_max}
+        for row, pdinstance in zip(instance_rows, pdinstances)
+        if pdinstance.sequence_prefix and pdinstance.sequence_max
+    ]
+    instances = await TAKInstance.create_many(instance_rows, sequence_rows)
+
+    errors = await PipeLineClient().create_many(
+        [(instance, request.url_for("tf_callback", pkstr=str(instance.pk))) for instance in instances]
+    )
+    failed_pks = [instance.pk for instance, error in zip(instances, errors) if error is not None]
+    if failed_pks:
+        # Do not leave stuff laying around
+        await TAKInstance.delete_many(failed_pks)
+
+    results: List[TAKInstanceBulkResult] = []
+    for idx, (instance, error) in enumerate(zip(instances, errors)):
+        if error is not None:
+            results.append(
+                TAKInstanceBulkResult(index=idx, success=False, detail=f"Could not trigger pipeline: {error}")
+            )
+            continue
+        results.append(TAKInstanceBulkResult(index=idx, success=True, instance=instance_to_pd(request, instance)))
+    return TAKInstanceBulkResults(
+        succeeded=len(instances) - len(failed_pks),
+        failed=len(failed_pks),
+        items=results,
+    )
 
 
 @INSTANCE_ROUTER.get("/api/v1/tak/instances", tags=["tak-instances"], response_model=TAKInstancePager)
 async def list_instances(request: Request) -> TAKInstancePager:
     """List TAKInstance"""
-    query = TAKInstance.query.where(
-        TAKInstance.deleted == None  # pylint: disable=C0121 ; # "is None" will create invalid query
-    )
+    ownerid = None
     if not check_acl(request.state.jwt, "fi.pvarki.takbackend.instance:read", auto_error=False):
-        query = query.where(TAKInstance.ownerid == request.state.jwt["userid"])
+        ownerid = request.state.jwt["userid"]
 
-    instances = await query.gino.all()
+    instances = await read_all(TAKInstance.list_query(ownerid), cachebus.TAKINSTANCE)
     if not instances:
         return TAKInstancePager(items=[], count=0)
 
     pdinstances: List[TAKDBInstance] = []
     for instance in instances:
-        pdinstsrc = instance.to_dict()
-        pdinstsrc["server_name"] = instance.tfinputs.get("server_name", "undefined")
-        pdinst = TAKDBInstance.parse_obj(pdinstsrc)
+        pdinst = TAKDBInstance.parse_obj(instance.to_public_dict("undefined"))
         pdinst.tfoutputs = None
         pdinst.tfinputs = None
         if instance.tfcompleted or instance.tfoutputs:
@@ -105,17 +160,12 @@ async def list_instances(request: Request) -> TAKInstancePager:
 @INSTANCE_ROUTER.get("/api/v1/tak/instances/{pkstr}", tags=["tak-instances"], response_model=TAKDBInstance)
 async def get_instance(request: Request, pkstr: str) -> TAKDBInstance:
     """Get a single instance"""
-    instance = await get_or_404(TAKInstance, pkstr)
+    instance = await get_or_404_replica(TAKInstance, pkstr, cachebus.TAKINSTANCE)
     if not check_acl(request.state.jwt, "fi.pvarki.takbackend.instance:read", auto_error=False):
         if instance.ownerid != request.state.jwt["userid"]:
             raise HTTPException(status_code=403, detail="Required privilege not granted.")
 
-    retsrc = instance.to_dict()
-    retsrc["server_name"] = instance.tfinputs.get("server_name", "unresolved")
-    ret = TAKDBInstance.parse_obj(retsrc)
-    if not check_acl(request.state.jwt, "fi.pvarki.takbackend.tfdata:read", auto_error=False):
-        ret.tfinputs = None
-        ret.tfoutputs = None
+    ret = instance_to_pd(request, instance)
     if instance.tfcompleted or instance.tfoutputs:
         ret.owner_instructions = request.url_for("owner_instructions", pkstr=str(instance.pk))
 
@@ -135,4 +185,32 @@ async def delete_instance(request: Request, pkstr: str) -> None:
     except Exception as exc:
         LOGGER.exception("Could not trigger pipeline {}".format(exc))
         raise
-    await instance.update(deleted=pendulum.now("UTC")).apply()
+    await TAKInstance.soft_delete_many(pks=[instance.pk])
+
+
+@INSTANCE_ROUTER.post(
+    "/api/v1/tak/instances/bulkdelete",
+    tags=["tak-instances"],
+    response_model=TAKInstanceBulkDeleted,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def delete_instances_bulk(request: Request, selector: TAKInstanceBulkDelete) -> TAKInstanceBulkDeleted:
+    """Delete all instances in grouping and/or list of pks, only the ones whose destroy pipeline was triggered are
+    marked deleted"""
+    if selector.grouping is None and not selector.pks:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Give grouping or pks")
+    ownerid = None
+    if not check_acl(request.state.jwt, "fi.pvarki.takbackend.instance:read", auto_error=False):
+        ownerid = request.state.jwt["userid"]
+    selected = await TAKInstance.selection_query(
+        grouping=selector.grouping, pks=selector.pks, ownerid=ownerid
+    ).gino.all()
+    deleted, failed = await PipeLineClient().destroy_many(selected)
+    return TAKInstanceBulkDeleted(
+        count=len(deleted),
+        pks=[instance.pk for instance in deleted],
+        failed=[
+            TAKInstanceBulkDeleteFailure(pk=instance.pk, detail=f"Could not trigger pipeline: {error}")
+            for instance, error in failed
+        ],
+    )
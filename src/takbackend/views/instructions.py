@@ -1,26 +1,90 @@
 """Instruction views"""
-from typing import Dict, Any, Tuple, cast
+from typing import AsyncGenerator, Dict, Any, Tuple, cast
+import json
 import logging
+import time
 from pathlib import Path
 import base64
 import tempfile
 
 from fastapi import APIRouter, Request, Response, HTTPException
-from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
-from arkia11napi.helpers import get_or_404
+from fastapi.responses import HTMLResponse, StreamingResponse
 from libadvian.binpackers import ensure_str
 
 
-from ..config import TEMPLATES_PATH
 from ..models import TAKInstance, Client, ClientSequence
 from .. import config
 from ..qrcodegen import create_qrcode_b64
+from ..modelcache import get_or_404_cached, get_or_404_replica, CLIENTS, CLIENT_SHORTCODES, CERTSAPI_INSTANCES
+from ..replica import read_first, read_all, written_key
+from .. import cachebus
 from ..certsapihelpers import ping_certsapi, get_or_create_client_zip
+from ..metrics import ZIP_BYTES
+from ..tracing import span
+from ..templating import TEMPLATES
+from ..readiness import WATCHER
 
 LOGGER = logging.getLogger(__name__)
-TEMPLATES = Jinja2Templates(directory=str(TEMPLATES_PATH))
 INSTRUCTIONS_ROUTER = APIRouter()
+RETRY_AFTER = 120  # seconds
+
+
+async def ensure_ready(instance: TAKInstance) -> TAKInstance:
+    """Raise 409/501 unless the certs-api of the instance is up, returns the instance with certs-api credentials"""
+    retry_headers = {"Retry-After": str(RETRY_AFTER)}
+    if not instance.certsapi_base:
+        if instance.tfcompleted:
+            raise HTTPException(status_code=409, detail="Terraform information not available but pipeline completed")
+        raise HTTPException(status_code=501, detail="Terraform information not received yet", headers=retry_headers)
+    if not instance.certsapi_token:
+        # Token is not stored encrypted, need the tfoutputs after all
+        instance = await read_first(
+            TAKInstance.query.where(TAKInstance.pk == instance.pk), written_key(cachebus.TAKINSTANCE, instance.pk)
+        )
+    if not await ping_certsapi(instance):
+        raise HTTPException(
+            status_code=501, detail="TAK server is not yet fully up, try again in a few minutes", headers=retry_headers
+        )
+    return instance
+
+
+def provisioning_page(request: Request, exc: HTTPException, events_url: str) -> Response:
+    """For browsers render the not-ready-yet 501 as page that follows events_url and reloads when ready,
+    anything else is re-raised as is"""
+    if exc.status_code != 501 or "text/html" not in request.headers.get("accept", ""):
+        raise exc
+    return TEMPLATES.TemplateResponse(
+        "provisioning.html",
+        {"request": request, "detail": exc.detail, "events_url": events_url, "retry_after": RETRY_AFTER},
+        status_code=exc.status_code,
+        headers=exc.headers,
+    )
+
+
+async def readiness_events(pkstr: str) -> AsyncGenerator[str, None]:
+    """Server-sent events of the instance state transitions, ends on final state or after READINESS_STREAM_MAX"""
+    deadline = time.monotonic() + config.READINESS_STREAM_MAX
+    yield "retry: {}\n\n".format(config.READINESS_POLL_INTERVAL * 1000)
+    states = WATCHER.watch(pkstr, keepalive=config.READINESS_KEEPALIVE)
+    try:
+        async for state in states:
+            if state is not None:
+                yield "event: state\ndata: {}\n\n".format(json.dumps({"state": state}))
+            elif time.monotonic() > deadline:
+                return  # EventSource will reconnect
+            else:
+                yield ": keepalive\n\n"
+    finally:
+        await states.aclose()
+
+
+def readiness_response(pkstr: str) -> Response:
+    """Stream the readiness events"""
+    return StreamingResponse(
+        readiness_events(pkstr),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @INSTRUCTIONS_ROUTER.get(
@@ -31,20 +95,17 @@ INSTRUCTIONS_ROUTER = APIRouter()
 )
 async def get_owner_instructions(request: Request, pkstr: str) -> Response:
     """Show instructions for the owner"""
-    instance = await get_or_404(TAKInstance, pkstr)
-    retry_headers = {"Retry-After": "120"}
-    if not instance.tfoutputs:
-        if instance.tfcompleted:
-            raise HTTPException(status_code=409, detail="Terraform information not available but pipeline completed")
-        raise HTTPException(status_code=501, detail="Terraform information not received yet", headers=retry_headers)
-    if not await ping_certsapi(instance):
-        raise HTTPException(
-            status_code=501, detail="TAK server is not yet fully up, try again in a few minutes", headers=retry_headers
-        )
+    instance = await get_or_404_replica(TAKInstance, pkstr, cachebus.TAKINSTANCE)
+    try:
+        instance = await ensure_ready(instance)
+    except HTTPException as exc:
+        return provisioning_page(request, exc, request.url_for("instance_events", pkstr=str(instance.pk)))
 
     sequences = [
-        {"prefix": seq.prefix, "url": request.url_for("get_next_client", pkstr=seq.pk)}
-        for seq in await ClientSequence.list_instance_sequences(instance)
+        {"prefix": seq.prefix, "url": request.url_for("sequence_shortcode", code=seq.shortcode)}
+        for seq in await read_all(
+            ClientSequence.instance_sequences_query(instance.pk), cachebus.TAKINSTANCE, cachebus.CLIENTSEQUENCE
+        )
     ]
 
     instance.tfoutputs = cast(Dict[str, Any], instance.tfoutputs)
@@ -63,40 +124,31 @@ async def get_owner_instructions(request: Request, pkstr: str) -> Response:
     )
 
 
+async def client_instance(client: Client) -> TAKInstance:
+    """Resolve the instance for client and make sure it's ready"""
+    instance = await CERTSAPI_INSTANCES.get(str(client.server))
+    if instance is None or instance.deleted:
+        raise HTTPException(status_code=404, detail="Not found")
+    return await ensure_ready(instance)
+
+
 async def client_instructions_common(pkstr: str) -> Tuple[Client, TAKInstance]:
     """Dont' Repeat Yourself, the common stuff"""
-    client = await get_or_404(Client, pkstr)
-    instance = await TAKInstance.get(client.server)
-    retry_headers = {"Retry-After": "120"}
-    if not instance.tfoutputs:
-        if instance.tfcompleted:
-            raise HTTPException(status_code=409, detail="Terraform information not available but pipeline completed")
-        raise HTTPException(status_code=501, detail="Terraform information not received yet", headers=retry_headers)
-    if not await ping_certsapi(instance):
-        raise HTTPException(
-            status_code=501, detail="TAK server is not yet fully up, try again in a few minutes", headers=retry_headers
-        )
-
-    return client, instance
+    client = await get_or_404_cached(CLIENTS, pkstr)
+    return client, await client_instance(client)
 
 
-@INSTRUCTIONS_ROUTER.get(
-    "/api/v1/tak/clients/{pkstr}/instructions",
-    tags=["tak-clients"],
-    response_class=HTMLResponse,
-    name="get_client_instructions",
-)
-async def get_client_instructions(request: Request, pkstr: str) -> Response:
-    """Get instructions etc for this unique client"""
-    client, instance = await client_instructions_common(pkstr)
-
+async def render_client_instructions(request: Request, client: Client, instance: TAKInstance) -> Response:
+    """Render the instructions page for client"""
     with tempfile.NamedTemporaryFile(suffix=".zip") as tmp:
         if not await get_or_create_client_zip(instance, client.name, Path(tmp.name)):
             raise RuntimeError("Could not get client zip")
         with open(tmp.name, "rb") as fpntr:
-            client_zip_b64 = base64.b64encode(fpntr.read())
+            client_zip = fpntr.read()
+            ZIP_BYTES.labels("client_instructions").inc(len(client_zip))
+            with span("client_zip.base64", size=len(client_zip)):
+                client_zip_b64 = base64.b64encode(client_zip)
 
-    instance.tfoutputs = cast(Dict[str, Any], instance.tfoutputs)
     instance.tfinputs = cast(Dict[str, Any], instance.tfinputs)
     return TEMPLATES.TemplateResponse(
         "client_instructions.html",
@@ -111,6 +163,40 @@ async def get_client_instructions(request: Request, pkstr: str) -> Response:
     )
 
 
+@INSTRUCTIONS_ROUTER.get(
+    "/api/v1/tak/clients/{pkstr}/instructions",
+    tags=["tak-clients"],
+    response_class=HTMLResponse,
+    name="get_client_instructions",
+)
+async def get_client_instructions(request: Request, pkstr: str) -> Response:
+    """Get instructions etc for this unique client"""
+    client = await get_or_404_cached(CLIENTS, pkstr)
+    try:
+        instance = await client_instance(client)
+    except HTTPException as exc:
+        return provisioning_page(request, exc, request.url_for("client_events", pkstr=str(client.pk)))
+    return await render_client_instructions(request, client, instance)
+
+
+@INSTRUCTIONS_ROUTER.get(
+    "/c/{code}",
+    tags=["tak-clients"],
+    response_class=HTMLResponse,
+    name="client_shortcode",
+)
+async def get_client_instructions_short(request: Request, code: str) -> Response:
+    """Short url for get_client_instructions"""
+    client = await CLIENT_SHORTCODES.get(code)
+    if not client or client.deleted:
+        raise HTTPException(status_code=404, detail="Not found")
+    try:
+        instance = await client_instance(client)
+    except HTTPException as exc:
+        return provisioning_page(request, exc, request.url_for("client_events", pkstr=str(client.pk)))
+    return await render_client_instructions(request, client, instance)
+
+
 @INSTRUCTIONS_ROUTER.get(
     "/api/v1/tak/clients/{pkstr}/instructions/zip",
     tags=["tak-clients"],
@@ -124,9 +210,34 @@ async def get_client_zipfile(pkstr: str) -> Response:
     with tempfile.NamedTemporaryFile(suffix=".zip") as tmp:
         if not await get_or_create_client_zip(instance, client.name, Path(tmp.name)):
             raise RuntimeError("Could not get client zip")
-
+        content = tmp.read()
+        ZIP_BYTES.labels("get_client_zipfile").inc(len(content))
         return Response(
-            content=tmp.read(),
+            content=content,
             media_type="application/zip",
             headers={"Content-Disposition": f"""attachment;filename="{client.name}.zip"""},
         )
+
+
+@INSTRUCTIONS_ROUTER.get(
+    "/api/v1/tak/instances/{pkstr}/events",
+    tags=["tak-instances"],
+    name="instance_events",
+    responses={200: {"content": {"text/event-stream": {}}}},
+)
+async def get_instance_events(pkstr: str) -> Response:
+    """Server-sent "state" events while the instance is provisioned: dispatched, tfoutputs, ready (or failed/deleted)"""
+    instance = await get_or_404_cached(CERTSAPI_INSTANCES, pkstr)
+    return readiness_response(str(instance.pk))
+
+
+@INSTRUCTIONS_ROUTER.get(
+    "/api/v1/tak/clients/{pkstr}/events",
+    tags=["tak-clients"],
+    name="client_events",
+    responses={200: {"content": {"text/event-stream": {}}}},
+)
+async def get_client_events(pkstr: str) -> Response:
+    """Like get_instance_events but for the instance of the client"""
+    client = await get_or_404_cached(CLIENTS, pkstr)
+    return readiness_response(str(client.server))
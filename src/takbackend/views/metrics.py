@@ -0,0 +1,95 @@
+"""Prometheus metrics endpoint
+
+The pool and cache gauges are per worker and summed over the workers, so every worker refreshes its own every
+METRICS_COLLECT_INTERVAL seconds instead of just the one that happens to serve the scrape. The endpoint is closed
+unless METRICS_TOKEN is set (or METRICS_PUBLIC when it's only reachable from the internal network).
+"""
+from typing import Optional
+import asyncio
+import hmac
+import logging
+
+from fastapi import APIRouter, Request, Response, HTTPException
+from prometheus_client import CONTENT_TYPE_LATEST
+from starlette import status
+
+from ..config import METRICS_TOKEN, METRICS_PUBLIC, METRICS_COLLECT_INTERVAL
+from ..models import db
+from ..modelcache import CACHES
+from ..metrics import (
+    render_latest,
+    DB_POOL_SIZE,
+    DB_POOL_IDLE,
+    DB_POOL_MAX,
+    MODELCACHE_HITS,
+    MODELCACHE_MISSES,
+    MODELCACHE_SIZE,
+)
+
+LOGGER = logging.getLogger(__name__)
+METRICS_ROUTER = APIRouter()
+
+
+def update_collected() -> None:
+    """Update the gauges that are read from elsewhere instead of being updated as things happen"""
+    try:
+        pool = db.bind.raw_pool
+        DB_POOL_SIZE.set(pool.get_size())
+        DB_POOL_IDLE.set(pool.get_idle_size())
+        DB_POOL_MAX.set(pool.get_max_size())
+    except Exception as exc:  # pylint: disable=W0703 ; # the engine is not bound yet or similar
+        LOGGER.debug("Could not read pool stats: {}".format(exc))
+    for cache in CACHES:
+        stats = cache.stats()
+        MODELCACHE_HITS.labels(cache.name).set(stats["hits"])
+        MODELCACHE_MISSES.labels(cache.name).set(stats["misses"])
+        MODELCACHE_SIZE.labels(cache.name).set(stats["size"])
+
+
+class CollectedUpdater:
+    """Run update_collected every METRICS_COLLECT_INTERVAL seconds in background"""
+
+    def __init__(self) -> None:
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    async def run(self) -> None:
+        """Update forever"""
+        while True:
+            try:
+                update_collected()
+            except Exception as exc:  # pylint: disable=W0703
+                LOGGER.exception("Updating collected metrics failed {}".format(exc))
+            await asyncio.sleep(METRICS_COLLECT_INTERVAL)
+
+    def start(self) -> None:
+        """Start in background"""
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self.run(), name="collected_metrics")
+
+    async def stop(self) -> None:
+        """Stop the background task"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+COLLECTED_UPDATER = CollectedUpdater()
+
+
+@METRICS_ROUTER.get("/metrics", include_in_schema=False, name="metrics")
+async def get_metrics(request: Request) -> Response:
+    """Metrics in Prometheus text format, requires bearer METRICS_TOKEN unless METRICS_PUBLIC is set"""
+    if METRICS_TOKEN:
+        given = request.headers.get("authorization", "")
+        if not hmac.compare_digest(given.encode("utf-8"), f"Bearer {METRICS_TOKEN}".encode("utf-8")):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+    elif not METRICS_PUBLIC:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="METRICS_TOKEN is not configured")
+    update_collected()
+    return Response(content=render_latest(), media_type=CONTENT_TYPE_LATEST)
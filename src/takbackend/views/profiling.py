@@ -0,0 +1,24 @@
+"""Download the stored request profiles"""
+import logging
+
+from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi.responses import FileResponse
+from arkia11napi.security import JWTBearer, check_acl
+
+from ..config import PROFILING_PATH
+from ..profiling import PROFILING_ACL
+
+LOGGER = logging.getLogger(__name__)
+PROFILING_ROUTER = APIRouter(dependencies=[Depends(JWTBearer(auto_error=True))])
+
+
+@PROFILING_ROUTER.get("/api/v1/profiles/{name}", tags=["misc"], response_class=FileResponse, name="get_profile")
+async def get_profile(request: Request, name: str) -> FileResponse:
+    """Get profile output by the name returned in the profiling header"""
+    check_acl(request.state.jwt, PROFILING_ACL)
+    filepath = PROFILING_PATH / name
+    # Only plain filenames from the profiles directory
+    if filepath.name != name or not filepath.is_file():
+        raise HTTPException(status_code=404, detail="Not found")
+    media_type = "text/html" if filepath.suffix == ".html" else "application/octet-stream"
+    return FileResponse(filepath, media_type=media_type, filename=name)
@@ -0,0 +1,111 @@
+"""Warm up a freshly started worker before it accepts traffic
+
+Without this the first requests after each (re)start pay for growing the DB pool from DB_POOL_MIN_SIZE, compiling
+the templates, fetching the pipeline secrets from the keyvault and importing/initializing the QR code renderer.
+"""
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import contextlib
+import logging
+import time
+
+import sqlalchemy as sa
+
+from .config import WARMUP_DB_CONNECTIONS, WARMUP_PRELOAD_INSTANCES, WARMUP_TIMEOUT
+from .dbconfig import POOL_MAX_SIZE, REPLICA_POOL_MAX_SIZE
+from .models import db, TAKInstance
+from .modelcache import CERTSAPI_INSTANCES
+from .qrcodegen import create_qrcode
+from .security import PipelineTokens
+from .templating import compile_all
+from . import replica
+
+LOGGER = logging.getLogger(__name__)
+READY = False
+TIMINGS: Dict[str, Optional[float]] = {}  # step -> seconds, None if the step failed
+
+
+async def open_connections(bind: Any, count: int) -> None:
+    """Hold count connections at the same time so the pool actually grows, and ping each"""
+    async with contextlib.AsyncExitStack() as stack:
+        for _ in range(count):
+            conn = await stack.enter_async_context(bind.acquire())
+            await conn.scalar(sa.select([sa.literal(1)]))
+
+
+async def open_pools() -> None:
+    """Open WARMUP_DB_CONNECTIONS to primary and replica (if configured)"""
+    await open_connections(db, min(WARMUP_DB_CONNECTIONS, POOL_MAX_SIZE))
+    if replica.ENGINE is not None:
+        await open_connections(replica.ENGINE, min(WARMUP_DB_CONNECTIONS, REPLICA_POOL_MAX_SIZE))
+
+
+async def compile_templates() -> None:
+    """Compile all templates"""
+    names = compile_all()
+    LOGGER.debug("Compiled templates {}".format(names))
+
+
+async def fetch_tokens() -> None:
+    """Fetch the pipeline secrets"""
+    await PipelineTokens.singleton().ensure()
+
+
+async def render_qrcode() -> None:
+    """Import and exercise the QR code renderer"""
+    create_qrcode("warmup")
+
+
+async def preload_instances() -> None:
+    """Load the most recently updated ready instances to the certs-api info cache"""
+    if not WARMUP_PRELOAD_INSTANCES:
+        return
+    query = (
+        TAKInstance.select(*TAKInstance.CERTSAPI_COLUMNS)
+        .where(TAKInstance.deleted == None)  # pylint: disable=C0121 ; # "is None" will create invalid query
+        .where(TAKInstance.certsapi_base != None)  # pylint: disable=C0121 ; # "is not None" will create invalid query
+        .order_by(TAKInstance.updated.desc())
+        .limit(WARMUP_PRELOAD_INSTANCES)
+    )
+    # Read from the primary like the cache loaders do, replica lag could prime stale rows
+    for instance in await db.all(query):
+        CERTSAPI_INSTANCES.prime(str(instance.pk), instance)
+
+
+STEPS: Dict[str, Callable[[], Awaitable[None]]] = {
+    "db_pools": open_pools,
+    "templates": compile_templates,
+    "pipeline_tokens": fetch_tokens,
+    "qrcode": render_qrcode,
+    "preload_instances": preload_instances,
+}
+
+
+async def _timed(name: str, step: Callable[[], Awaitable[None]]) -> None:
+    """Run the step and record how long it took, failures are logged but do not stop the others"""
+    started = time.monotonic()
+    try:
+        await step()
+        TIMINGS[name] = time.monotonic() - started
+    except Exception as exc:  # pylint: disable=W0703
+        TIMINGS[name] = None
+        LOGGER.exception("Warm-up step {} failed: {}".format(name, exc))
+
+
+async def warm_up(timeout: float = WARMUP_TIMEOUT) -> bool:
+    """Run all the warm-up steps concurrently, at most timeout seconds, and mark us ready.
+
+    Returns False if some step failed or did not complete in time, we are marked ready in any case since the
+    things warmed up here will happen on first use anyway."""
+    global READY  # pylint: disable=W0603
+    started = time.monotonic()
+    tasks = [asyncio.create_task(_timed(name, step), name=f"warmup_{name}") for name, step in STEPS.items()]
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending)
+        LOGGER.warning("Warm-up timed out after {}s".format(timeout))
+    READY = True
+    LOGGER.info("Warm-up done in {:.3f}s {}".format(time.monotonic() - started, TIMINGS))
+    return all(TIMINGS.get(name) is not None for name in STEPS)
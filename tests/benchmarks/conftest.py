@@ -0,0 +1,114 @@
+"""Benchmark fixtures: the real app served by uvicorn against the docker Postgres, plus stub certs-api and pipeline"""
+from typing import Any, AsyncGenerator, Generator
+import asyncio
+import logging
+import os
+import socket
+
+import pytest
+import pytest_asyncio
+import sqlalchemy
+import uvicorn
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from cryptography.fernet import Fernet
+
+from takbackend.api import APP, WRAPPER
+from takbackend.models import db
+from takbackend import security, pipelineclient
+
+from .helpers import BenchmarkResults
+
+# pylint: disable=W0621
+LOGGER = logging.getLogger(__name__)
+STUB_LATENCY = 0.01  # seconds, simulated network + work for the stub servers
+STUB_ZIP = os.urandom(30 * 1024)  # Roughly the size of real client zips
+
+
+@pytest.fixture(scope="session")
+def benchmark_results() -> Generator[BenchmarkResults, None, None]:
+    """Session wide results"""
+    results = BenchmarkResults()
+    yield results
+    results.write()
+
+
+@pytest_asyncio.fixture(scope="session")
+async def certsapi_stub() -> AsyncGenerator[str, None]:
+    """Minimal certs-api, returns the api base"""
+    created = set()
+
+    async def ping(_request: web.Request) -> web.Response:
+        await asyncio.sleep(STUB_LATENCY)
+        return web.json_response({"ok": True})
+
+    async def get_client(request: web.Request) -> web.Response:
+        await asyncio.sleep(STUB_LATENCY)
+        if request.match_info["name"] not in created:
+            return web.Response(status=404)
+        return web.Response(body=STUB_ZIP, content_type="application/zip")
+
+    async def create_client(request: web.Request) -> web.Response:
+        await asyncio.sleep(STUB_LATENCY * 5)  # cert generation is the slow part
+        data = await request.json()
+        created.add(data["name"])
+        return web.Response(body=STUB_ZIP, content_type="application/zip")
+
+    app = web.Application()
+    app.router.add_get("/api/v1", ping)
+    app.router.add_get("/api/v1/clients/{name}", get_client)
+    app.router.add_post("/api/v1/clients", create_client)
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    yield str(server.make_url("/api"))
+    await server.close()
+
+
+@pytest_asyncio.fixture(scope="session")
+async def pipeline_stub(monkeysession: Any) -> AsyncGenerator[str, None]:
+    """Minimal pipeline runs endpoint, patched into pipelineclient"""
+
+    async def run(_request: web.Request) -> web.Response:
+        await asyncio.sleep(STUB_LATENCY)
+        return web.json_response({"id": 1, "state": "inProgress"})
+
+    app = web.Application()
+    app.router.add_post("/runs", run)
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    url = str(server.make_url("/runs"))
+    monkeysession.setattr(pipelineclient, "PIPELINE_URL", url)
+    monkeysession.setattr(pipelineclient, "PIPELINE_SUPPRESS", False)
+    yield url
+    await server.close()
+
+
+def free_port() -> int:
+    """Ask the OS for a free port"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+@pytest_asyncio.fixture(scope="session")
+async def app_server(dockerdb: str, monkeysession: Any, pipeline_stub: str) -> AsyncGenerator[str, None]:
+    """Serve the real app with uvicorn, returns the base url"""
+    _ = dockerdb, pipeline_stub
+    monkeysession.setattr(security, "PIPELINE_TOKEN_OVERRIDE", "benchmarktoken")
+    monkeysession.setattr(security, "PIPELINE_SSHKEY_OVERRIDE", "ssh-ed25519 AAAA benchmark")
+    monkeysession.setattr(security, "KVTOKEN_SINGLETON", None)
+    monkeysession.setattr(security, "FERNET", Fernet(Fernet.generate_key()))
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(APP, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    task = asyncio.create_task(server.serve(), name="benchmark_uvicorn")
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    async with WRAPPER.gino.acquire() as conn:
+        async with conn.transaction():
+            await conn.status(sqlalchemy.text("CREATE SCHEMA IF NOT EXISTS takbackend"))
+            await db.gino.create_all()
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    await task
@@ -0,0 +1,129 @@
+"""Benchmark helpers
+
+Results of the run are written to results.json, set BENCHMARK_UPDATE_BASELINE=1 to also write them to baseline.json
+"""
+from typing import Any, Dict, List, Optional, Sequence
+import json
+import logging
+import os
+import statistics
+import time
+import uuid
+from pathlib import Path
+
+import sqlalchemy
+import pendulum
+
+from takbackend.models import TAKInstance, ClientSequence, Client, db
+from takbackend import security, modelcache
+
+LOGGER = logging.getLogger(__name__)
+BENCHMARK_PATH = Path(__file__).parent
+BASELINE_PATH = BENCHMARK_PATH / "baseline.json"
+RESULTS_PATH = BENCHMARK_PATH / "results.json"
+# How much worse than baseline is still ok, the machines running these are not identical
+TOLERANCE = float(os.environ.get("BENCHMARK_TOLERANCE", "0.25"))
+UPDATE_BASELINE = bool(os.environ.get("BENCHMARK_UPDATE_BASELINE"))
+SEED_CHUNK = 1000
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    idx = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+class BenchmarkResults:
+    """Collect results and compare to baseline, keys ending with _rps are higher-is-better, others lower-is-better"""
+
+    def __init__(self) -> None:
+        self.baseline: Dict[str, Optional[float]] = json.loads(BASELINE_PATH.read_text(encoding="utf-8"))
+        self.results: Dict[str, float] = {}
+
+    def record(self, key: str, value: float) -> None:
+        """Record the value and fail if it regressed from baseline or there is no baseline for it"""
+        self.results[key] = round(value, 3)
+        LOGGER.info("benchmark {}={:.3f}".format(key, value))
+        if UPDATE_BASELINE:
+            return
+        expected = self.baseline.get(key)
+        assert expected is not None, f"{key} has no baseline, run with BENCHMARK_UPDATE_BASELINE=1 to record it"
+        if key.endswith("_rps"):
+            assert value >= expected * (1 - TOLERANCE), f"{key} regressed: {value:.3f} vs baseline {expected}"
+        else:
+            assert value <= expected * (1 + TOLERANCE), f"{key} regressed: {value:.3f} vs baseline {expected}"
+
+    def record_latencies(self, key: str, latencies: Sequence[float]) -> None:
+        """Record p50 and p95 in milliseconds"""
+        self.record(f"{key}_p50_ms", statistics.median(latencies) * 1000)
+        self.record(f"{key}_p95_ms", percentile(latencies, 95) * 1000)
+
+    def write(self) -> None:
+        """Write the results (and baseline if asked to)"""
+        data = json.dumps(dict(sorted(self.results.items())), indent=2) + "\n"
+        RESULTS_PATH.write_text(data, encoding="utf-8")
+        if UPDATE_BASELINE:
+            merged = dict(self.baseline)
+            merged.update(self.results)
+            BASELINE_PATH.write_text(json.dumps(dict(sorted(merged.items())), indent=2) + "\n", encoding="utf-8")
+
+
+async def timed(coro: Any) -> float:
+    """Await and return the time it took"""
+    started = time.perf_counter()
+    await coro
+    return time.perf_counter() - started
+
+
+async def truncate_all() -> None:
+    """Empty the tables and caches between benchmarks"""
+    await db.status(
+        sqlalchemy.text("TRUNCATE takbackend.clients, takbackend.clientsequences, takbackend.takinstances CASCADE")
+    )
+    if await Client.partition_count():
+        # TRUNCATE does not fire the row triggers that keep this in sync
+        await db.status(sqlalchemy.text("TRUNCATE takbackend.clients_shortcodes"))
+    for cache in modelcache.CACHES:
+        cache.evict(modelcache.cachebus.ALL_KEYS)
+
+
+def instance_values(ownerid: str, certsapi_base: Optional[str] = None) -> Dict[str, Any]:
+    """Values for a completed instance"""
+    values: Dict[str, Any] = {
+        "pk": uuid.uuid4(),
+        "ownerid": ownerid,
+        "color": "green",
+        "grouping": "benchmark",
+        "tfinputs": {"server_name": "benchmark"},
+        "tfoutputs": {},
+    }
+    if certsapi_base:
+        values.update(
+            {
+                "tfcompleted": pendulum.now("UTC"),
+                "dns_name": "benchmark.example.com",
+                "certsapi_base": certsapi_base,
+                "certsapi_token": security.encrypt_field("benchmarktoken"),
+            }
+        )
+    return values
+
+
+async def seed_instances(ownerid: str, count: int) -> List[uuid.UUID]:
+    """Insert count instances for ownerid in chunks"""
+    pks: List[uuid.UUID] = []
+    for offset in range(0, count, SEED_CHUNK):
+        rows = [instance_values(ownerid) for _ in range(min(SEED_CHUNK, count - offset))]
+        await TAKInstance.insert().values(rows).gino.status()
+        pks.extend(row["pk"] for row in rows)
+    await db.status(sqlalchemy.text("ANALYZE takbackend.takinstances"))
+    return pks
+
+
+async def seed_ready_instance(certsapi_base: str, sequences: int = 1, max_clients: int = 100) -> TAKInstance:
+    """Completed instance pointing to the stub with given number of sequences"""
+    instance = await TAKInstance.create(**instance_values(str(uuid.uuid4()), certsapi_base))
+    for idx in range(sequences):
+        await ClientSequence.create(server=instance.pk, prefix=f"seq{idx:03d}", max_clients=max_clients)
+    return instance
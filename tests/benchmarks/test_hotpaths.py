@@ -0,0 +1,148 @@
+"""Benchmarks for the API hot paths, run with: pytest -m benchmark --no-cov tests/benchmarks"""
+from typing import Any, List
+import asyncio
+import time
+import uuid
+
+import aiohttp
+import pytest
+import sqlalchemy
+
+from takbackend.models import ClientSequence, Client, db
+from takbackend.dbdevhelpers import seed
+
+from .helpers import BenchmarkResults, seed_instances, seed_ready_instance, truncate_all, timed
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.asyncio]
+CONTENTION_WORKERS = 20
+CONTENTION_REQUESTS = 10  # per worker
+LIST_REPEATS = 5
+INSTRUCTION_CLIENTS = 10
+WARM_REPEATS = 5
+OWNER_SEQUENCES = 50
+OWNER_REPEATS = 10
+PARTITION_INSTANCES = 2000
+PARTITION_CLIENTS = 500  # per instance, 1M clients total
+PARTITION_SAMPLES = 500
+
+
+async def test_next_client_contention(app_server: str, certsapi_stub: str, benchmark_results: BenchmarkResults) -> None:
+    """Many devices hitting the same sequence QR code at once"""
+    await truncate_all()
+    await seed_ready_instance(certsapi_stub, sequences=1, max_clients=CONTENTION_WORKERS * CONTENTION_REQUESTS)
+    sequence = await ClientSequence.query.gino.first()
+    url = f"{app_server}/s/{sequence.shortcode}"
+    latencies: List[float] = []
+    locations: List[str] = []
+
+    async def worker() -> None:
+        """No cookie jar so every request is a new device"""
+        async with aiohttp.ClientSession(cookie_jar=aiohttp.DummyCookieJar()) as session:
+            for _ in range(CONTENTION_REQUESTS):
+                started = time.perf_counter()
+                async with session.get(url, allow_redirects=False) as resp:
+                    assert resp.status == 302
+                    locations.append(resp.headers["Location"])
+                latencies.append(time.perf_counter() - started)
+
+    elapsed = await timed(asyncio.gather(*(worker() for _ in range(CONTENTION_WORKERS))))
+    # Every request must have gotten its own client
+    assert len(set(locations)) == CONTENTION_WORKERS * CONTENTION_REQUESTS
+    benchmark_results.record("next_client_contention_rps", len(latencies) / elapsed)
+    benchmark_results.record_latencies("next_client_contention", latencies)
+
+
+@pytest.mark.parametrize("rows", [1000, 10000, 100000])
+async def test_list_instances(app_server: str, jwt_issuer: Any, benchmark_results: BenchmarkResults, rows: int) -> None:
+    """List instances for owner with many rows"""
+    await truncate_all()
+    ownerid = str(uuid.uuid4())
+    await seed_instances(ownerid, rows)
+    token = jwt_issuer.issue({"userid": ownerid})
+    latencies: List[float] = []
+    async with aiohttp.ClientSession(headers={"Authorization": f"Bearer {token}"}) as session:
+        for idx in range(LIST_REPEATS + 1):
+            started = time.perf_counter()
+            async with session.get(f"{app_server}/api/v1/tak/instances") as resp:
+                assert resp.status == 200
+                data = await resp.json()
+            if idx:  # first one is warm-up
+                latencies.append(time.perf_counter() - started)
+    assert data["count"] == rows
+    benchmark_results.record_latencies(f"list_instances_{rows}", latencies)
+
+
+async def test_client_instructions(app_server: str, certsapi_stub: str, benchmark_results: BenchmarkResults) -> None:
+    """Client instructions page, cold (client not yet in certs-api, nothing cached) and warm"""
+    await truncate_all()
+    await seed_ready_instance(certsapi_stub, sequences=1)
+    sequence = await ClientSequence.query.gino.first()
+    clients: List[Client] = [await sequence.next_client() for _ in range(INSTRUCTION_CLIENTS)]
+    cold: List[float] = []
+    warm: List[float] = []
+    async with aiohttp.ClientSession() as session:
+        for client in clients:
+            started = time.perf_counter()
+            async with session.get(f"{app_server}/c/{client.shortcode}") as resp:
+                assert resp.status == 200
+                await resp.read()
+            cold.append(time.perf_counter() - started)
+        for _ in range(WARM_REPEATS):
+            for client in clients:
+                started = time.perf_counter()
+                async with session.get(f"{app_server}/c/{client.shortcode}") as resp:
+                    assert resp.status == 200
+                    await resp.read()
+                warm.append(time.perf_counter() - started)
+    benchmark_results.record_latencies("client_instructions_cold", cold)
+    benchmark_results.record_latencies("client_instructions_warm", warm)
+
+
+async def test_owner_instructions(app_server: str, certsapi_stub: str, benchmark_results: BenchmarkResults) -> None:
+    """Owner instructions page with a QR code for each of many sequences"""
+    await truncate_all()
+    instance = await seed_ready_instance(certsapi_stub, sequences=OWNER_SEQUENCES)
+    latencies: List[float] = []
+    async with aiohttp.ClientSession() as session:
+        for _ in range(OWNER_REPEATS):
+            started = time.perf_counter()
+            async with session.get(f"{app_server}/api/v1/tak/instances/{instance.pk}/instructions") as resp:
+                assert resp.status == 200
+                await resp.read()
+            latencies.append(time.perf_counter() - started)
+    benchmark_results.record_latencies(f"owner_instructions_{OWNER_SEQUENCES}_sequences", latencies)
+
+
+@pytest.mark.parametrize("partitions", [0, 16])
+async def test_clients_partitioning(app_server: str, benchmark_results: BenchmarkResults, partitions: int) -> None:
+    """Client allocation and lookups with 1M clients, plain table vs hash partitioned on server"""
+    _ = app_server
+    await truncate_all()
+    await Client.repartition(partitions)
+    try:
+        await seed(PARTITION_INSTANCES, sequences=1, clients=PARTITION_CLIENTS, grouping="benchmark")
+        # Seeded sequences are full, make room for the allocations
+        await db.status(sqlalchemy.text("UPDATE takbackend.clientsequences SET max_clients = max_clients + 1"))
+        sample = await Client.query.order_by(sqlalchemy.func.random()).limit(PARTITION_SAMPLES).gino.all()
+        sequences = await ClientSequence.query.order_by(sqlalchemy.func.random()).limit(PARTITION_SAMPLES).gino.all()
+        by_pk: List[float] = []
+        by_shortcode: List[float] = []
+        allocate: List[float] = []
+        for client in sample:
+            started = time.perf_counter()
+            assert (await Client.get(client.pk)).pk == client.pk
+            by_pk.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            assert (await Client.by_shortcode(client.shortcode)).pk == client.pk
+            by_shortcode.append(time.perf_counter() - started)
+        for sequence in sequences:
+            started = time.perf_counter()
+            await sequence.next_client()
+            allocate.append(time.perf_counter() - started)
+    finally:
+        await truncate_all()
+        await Client.repartition(0)
+    label = f"{partitions}_partitions" if partitions else "plain"
+    benchmark_results.record_latencies(f"clients_1m_{label}_get", by_pk)
+    benchmark_results.record_latencies(f"clients_1m_{label}_by_shortcode", by_shortcode)
+    benchmark_results.record_latencies(f"clients_1m_{label}_next_client", allocate)
@@ -14,7 +14,7 @@ import arkia11napi.security
 
 from takbackend.api import WRAPPER
 from takbackend import models
-from takbackend import config
+from takbackend import config, security
 
 # pylint: disable=W0621
 init_logging(logging.DEBUG)
@@ -39,9 +39,9 @@ def dockerdb(docker_ip: str, docker_services: Any, monkeysession: Any) -> Genera
     mp_values = {
         "HOST": docker_ip,
         "PORT": docker_services.port_for("db", 5432),
-        "PASSWORD": "apitestpwd",  # pragma: allowlist secret
+        "PASSWORD": "pptbackendpwd",  # pragma: allowlist secret
         "USER": "postgres",
-        "DATABASE": "a11napitest",
+        "DATABASE": "pptbackendtest",
         "RETRY_LIMIT": "10",
         "RETRY_INTERVAL": "3",
     }
@@ -96,6 +96,7 @@ def jwt_issuer(monkeysession: Any) -> Generator[arkia11napi.security.JWTHandler,
     monkeysession.setenv("JWT_COOKIE_DOMAIN", "")
     monkeysession.setenv("PIPELINE_SUPPRESS", "1")
     monkeysession.setattr(config, "PIPELINE_SUPPRESS", True)
+    monkeysession.setattr(security, "CLIENT_COOKIE_SECRET", "testcookiesecret")  # pragma: allowlist secret
     monkeysession.setattr(arkia11napi.security, "HDL_SINGLETON", arkia11napi.security.JWTHandler())
     singleton = arkia11napi.security.JWTHandler.singleton()
     yield singleton
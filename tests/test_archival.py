@@ -0,0 +1,67 @@
+"""Soft-delete cascade and archival against the docker db"""
+from typing import AsyncGenerator
+import uuid
+
+import pytest
+import pytest_asyncio
+import sqlalchemy
+from asyncpg.exceptions import DuplicateSchemaError
+
+from takbackend import models
+from takbackend.archival import archive_deleted
+from takbackend.dbdevhelpers import create_all, drop_all, seed
+from takbackend.models.clients import SequenceDeletedError
+
+# pylint: disable=W0621
+
+
+@pytest_asyncio.fixture(scope="module")
+async def bound_db(dockerdb: str) -> AsyncGenerator[None, None]:
+    """Bind and create tables"""
+    await models.db.set_bind(dockerdb)
+    try:
+        await create_all()
+    except DuplicateSchemaError:
+        await models.db.gino.create_all()
+    yield None
+    await drop_all()
+    await models.db.pop_bind().close()
+
+
+async def count(table: str) -> int:
+    """Rows in table"""
+    return int(await models.db.scalar(sqlalchemy.text(f"SELECT count(*) FROM takbackend.{table}")))
+
+
+@pytest.mark.asyncio
+async def test_cascade_and_archive(bound_db: None) -> None:
+    """Deleting instance deletes its sequences and clients, old deleted rows get archived"""
+    _ = bound_db
+    grouping = str(uuid.uuid4())
+    seeded = await seed(2, sequences=2, clients=3, grouping=grouping)
+    before = {table: await count(table) for table in ("takinstances", "clientsequences", "clients")}
+    sequence = await models.ClientSequence.by_shortcode(seeded["sequence_shortcodes"][0])
+    assert sequence
+
+    deleted = await models.TAKInstance.soft_delete_many(grouping=grouping)
+    assert len(deleted.instances) == 2
+    assert len(deleted.sequence_pks) == 4
+    assert len(deleted.client_pks) == 12
+    with pytest.raises(SequenceDeletedError):
+        await sequence.next_client()
+
+    # Nothing is old enough yet
+    moved = await archive_deleted(older_than_days=1, batch_size=5)
+    assert moved == {"clients": 0, "clientsequences": 0, "takinstances": 0}
+
+    for table in ("takinstances", "clientsequences", "clients"):
+        await models.db.status(
+            sqlalchemy.text(
+                f"UPDATE takbackend.{table} SET deleted = now() - interval '2 days' WHERE deleted IS NOT NULL"
+            )
+        )
+    moved = await archive_deleted(older_than_days=1, batch_size=5)
+    assert moved == {"clients": 12, "clientsequences": 4, "takinstances": 2}
+    for table, rows in before.items():
+        assert await count(table) == rows - moved[table]
+        assert await count(f"{table}_archive") == moved[table]
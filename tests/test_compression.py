@@ -0,0 +1,86 @@
+"""Test the response compression and the hashed static files"""
+from typing import AsyncGenerator, Dict
+import gzip
+
+from fastapi import FastAPI, Response
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from takbackend.compression import CompressionMiddleware, accepted_encodings
+from takbackend.staticassets import STATIC_FILES, IMMUTABLE
+
+APP = FastAPI()
+APP.mount("/static", STATIC_FILES, name="static")
+APP.add_middleware(CompressionMiddleware, minimum_size=100)
+
+
+@APP.get("/big")
+async def big() -> Dict[str, str]:
+    """Compressible"""
+    return {"data": "x" * 1000}
+
+
+@APP.get("/tagged")
+async def tagged() -> Response:
+    """Compressible with ETag"""
+    return Response("x" * 1000, media_type="text/plain", headers={"ETag": '"abc"'})
+
+
+@APP.get("/small")
+async def small() -> Dict[str, str]:
+    """Below minimum size"""
+    return {"data": "x"}
+
+
+@APP.get("/zip")
+async def zipfile() -> Response:
+    """Already compressed"""
+    return Response(b"PK" * 1000, media_type="application/zip")
+
+
+@APP.get("/stream")
+async def stream() -> Response:
+    """Streamed, like the readiness events"""
+
+    async def chunks() -> AsyncGenerator[str, None]:
+        """Two chunks"""
+        yield "x" * 1000
+        yield "y"
+
+    return StreamingResponse(chunks(), media_type="text/event-stream")
+
+
+def test_compression() -> None:
+    """Only big enough single body compressible responses are compressed"""
+    client = TestClient(APP)
+    resp = client.get("/big", headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["content-encoding"] == "gzip"
+    assert int(resp.headers["content-length"]) < 1000
+    assert resp.json()["data"] == "x" * 1000
+    for path in ("/small", "/zip", "/stream"):
+        assert "content-encoding" not in client.get(path, headers={"Accept-Encoding": "gzip"}).headers
+    assert "content-encoding" not in client.get("/big", headers={"Accept-Encoding": "gzip;q=0"}).headers
+    assert accepted_encodings("br;q=1.0, gzip;q=0, identity") == ["br", "identity"]
+    assert client.get("/tagged", headers={"Accept-Encoding": "gzip"}).headers["etag"] == '"abc-gz"'
+    assert client.get("/tagged", headers={"Accept-Encoding": "identity"}).headers["etag"] == '"abc"'
+
+
+def test_static_files() -> None:
+    """Hashed urls are immutable and precompressed, the plain names still work"""
+    client = TestClient(APP)
+    hashed = STATIC_FILES.hashed_path("style.css")
+    assert hashed != "/style.css"
+    resp = client.get(f"/static{hashed}", headers={"Accept-Encoding": "gzip"})
+    assert resp.status_code == 200
+    assert resp.headers["cache-control"] == IMMUTABLE
+    assert resp.headers["content-encoding"] == "gzip"
+    plain = client.get("/static/style.css", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.headers["cache-control"] != IMMUTABLE
+    assert gzip.decompress(STATIC_FILES.assets["style.css"][0].variants["gzip"]) == plain.content
+    # Each encoding is its own representation with its own ETag
+    assert resp.headers["etag"] != plain.headers["etag"]
+    assert client.get(f"/static{hashed}", headers={"If-None-Match": resp.headers["etag"]}).status_code == 304
+    identity_match = {"If-None-Match": plain.headers["etag"], "Accept-Encoding": "gzip"}
+    assert client.get(f"/static{hashed}", headers=identity_match).status_code == 200
+    assert client.get("/static/nope.css").status_code == 404
@@ -0,0 +1,60 @@
+"""Import time budget for the API workers and the CLI, measured with python -X importtime in fresh interpreter
+
+Set IMPORT_BUDGET_SCALE to loosen the budgets on slow machines.
+"""
+from typing import Dict, Tuple
+import os
+import subprocess
+import sys
+
+import pytest
+
+BUDGET_SCALE = float(os.environ.get("IMPORT_BUDGET_SCALE", "1.0"))
+# Only imported when actually needed (keyvault secrets, QR codes, emails, tracing, profiling)
+LAZY = ("azure", "qrcode", "PIL", "fastapi_mail", "opentelemetry", "pyinstrument")
+# module -> (budget in seconds, top level packages that must not get imported)
+BUDGETS: Dict[str, Tuple[float, Tuple[str, ...]]] = {
+    "takbackend.console": (0.6, LAZY + ("aiohttp", "fastapi", "pendulum")),
+    "takbackend.api": (2.0, LAZY),
+}
+REPORT_TOP = 15
+
+
+def importtime(module: str) -> Dict[str, Tuple[int, int]]:
+    """Import module in fresh interpreter, returns {imported module: (self us, cumulative us)}"""
+    env = {key: value for key, value in os.environ.items() if not key.startswith(("TRACING_", "PROFILING_"))}
+    cmd = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    subprocess.run(cmd, capture_output=True, check=True, env=env)  # First run may be writing the .pyc files
+    proc = subprocess.run(cmd, capture_output=True, text=True, check=True, env=env)
+    timings: Dict[str, Tuple[int, int]] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        selftime, cumulative, name = line[len("import time:") :].split("|")
+        if not selftime.strip().isdigit():
+            continue  # header
+        timings[name.strip()] = (int(selftime), int(cumulative))
+    return timings
+
+
+def report(timings: Dict[str, Tuple[int, int]]) -> str:
+    """The slowest top level packages by cumulative time"""
+    toplevel: Dict[str, int] = {}
+    for name, (_, cumulative) in timings.items():
+        package = name.split(".")[0]
+        toplevel[package] = max(toplevel.get(package, 0), cumulative)
+    slowest = sorted(toplevel.items(), key=lambda item: item[1], reverse=True)[:REPORT_TOP]
+    return "\n".join(f"{cumulative / 1000:8.1f} ms  {package}" for package, cumulative in slowest)
+
+
+@pytest.mark.parametrize("module", sorted(BUDGETS.keys()))
+def test_import_budget(module: str) -> None:
+    """Cold import stays within budget and the heavy optional packages are not imported"""
+    if module == "takbackend.api":
+        pytest.importorskip("arkia11napi")
+    budget, forbidden = BUDGETS[module]
+    timings = importtime(module)
+    total = timings[module][1] / 1_000_000
+    imported = {name.split(".")[0] for name in timings}
+    assert not imported & set(forbidden), f"{module} imports {imported & set(forbidden)}\n{report(timings)}"
+    assert total <= budget * BUDGET_SCALE, f"{module} took {total:.3f}s, budget {budget}s\n{report(timings)}"
@@ -0,0 +1,139 @@
+"""Test the mail dispatcher against local SMTP stand-in"""
+from typing import AsyncGenerator, List, Tuple
+import asyncio
+import base64
+import time
+
+import pytest
+import pytest_asyncio
+from pydantic import SecretStr
+
+from takbackend.mailer import MailDispatcher
+
+pytest.importorskip("fastapi_mail")
+pytest.importorskip("aiosmtplib")
+
+# pylint: disable=W0621
+
+
+class FakeSMTPServer:
+    """Just enough SMTP to receive mail, records connections, logins and message bodies"""
+
+    def __init__(self) -> None:
+        self.connections = 0
+        self.messages: List[bytes] = []
+        self.logins: List[Tuple[str, str]] = []
+        self.server: "asyncio.AbstractServer"
+        self.port = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Handle single connection"""
+        self.connections += 1
+        writer.write(b"220 localhost ESMTP fake\r\n")
+        while line := await reader.readline():
+            command = line.decode().strip().upper()
+            if command.startswith("EHLO"):
+                writer.write(b"250-localhost\r\n250-AUTH PLAIN\r\n250 8BITMIME\r\n")
+            elif command.startswith("AUTH PLAIN "):
+                _, username, password = base64.b64decode(line.split()[2]).decode().split("\0")
+                self.logins.append((username, password))
+                writer.write(b"235 authenticated\r\n")
+            elif command == "DATA":
+                writer.write(b"354 go ahead\r\n")
+                await writer.drain()
+                data = b""
+                while not data.endswith(b"\r\n.\r\n"):
+                    data += await reader.readline()
+                self.messages.append(data)
+                writer.write(b"250 queued\r\n")
+            elif command == "QUIT":
+                writer.write(b"221 bye\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(b"250 ok\r\n")
+            await writer.drain()
+        writer.close()
+
+    async def start(self) -> None:
+        """Listen on random port"""
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        """Stop listening"""
+        self.server.close()
+        await self.server.wait_closed()
+
+
+@pytest_asyncio.fixture
+async def smtpserver() -> AsyncGenerator[FakeSMTPServer, None]:
+    """Running fake SMTP server"""
+    server = FakeSMTPServer()
+    await server.start()
+    yield server
+    await server.stop()
+
+
+def dispatcher(server: FakeSMTPServer, username: str = "", password: str = "", **kwargs: float) -> MailDispatcher:
+    """Dispatcher configured for the fake server, logs in if username is given"""
+    from fastapi_mail import ConnectionConfig  # pylint: disable=C0415
+
+    settings = ConnectionConfig(
+        MAIL_USERNAME=username,
+        MAIL_PASSWORD=password,
+        MAIL_PORT=server.port,
+        MAIL_SERVER="127.0.0.1",
+        MAIL_STARTTLS=False,
+        MAIL_SSL_TLS=False,
+        USE_CREDENTIALS=bool(username),
+        MAIL_FROM="noreply@example.com",
+        TIMEOUT=5,
+    )
+    return MailDispatcher(settings, **kwargs)  # type: ignore[arg-type]
+
+
+@pytest.mark.asyncio
+async def test_burst_reuses_connection(smtpserver: FakeSMTPServer) -> None:
+    """Burst of mails goes over single connection, reconnecting after max_per_connection"""
+    mailer = dispatcher(smtpserver, rate_limit=0, max_per_connection=4)
+    try:
+        msgs = [mailer.build("Ready", [f"user{idx}@example.com"], f"body {idx}") for idx in range(10)]
+        await asyncio.gather(*(mailer.send(msg) for msg in msgs))
+    finally:
+        await mailer.stop()
+    assert len(smtpserver.messages) == 10
+    assert smtpserver.connections == 3
+    assert b"body 9" in b"".join(smtpserver.messages)
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_and_idle(smtpserver: FakeSMTPServer) -> None:
+    """Sends are spaced by the rate limit, idle connection is closed and reopened when needed"""
+    mailer = dispatcher(smtpserver, rate_limit=20, idle_timeout=0.1)
+    try:
+        started = time.monotonic()
+        await asyncio.gather(*(mailer.send(mailer.build("Ready", ["user@example.com"], "body")) for _ in range(5)))
+        assert time.monotonic() - started >= 4 / 20
+        assert smtpserver.connections == 1
+        await asyncio.sleep(0.3)
+        await mailer.send(mailer.build("Ready", ["user@example.com"], "body"))
+    finally:
+        await mailer.stop()
+    assert smtpserver.connections == 2
+    assert len(smtpserver.messages) == 6
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("secret", [False, True])
+async def test_login(smtpserver: FakeSMTPServer, secret: bool) -> None:
+    """The plain password is used for login, also when the settings have it as SecretStr"""
+    mailer = dispatcher(smtpserver, username="mailer", password="hunter2")  # pragma: allowlist secret
+    if secret:
+        mailer.settings.MAIL_PASSWORD = SecretStr("hunter2")  # type: ignore[assignment]
+    try:
+        await mailer.send(mailer.build("Ready", ["user@example.com"], "body"))
+    finally:
+        await mailer.stop()
+    assert smtpserver.logins == [("mailer", "hunter2")]
+    assert len(smtpserver.messages) == 1
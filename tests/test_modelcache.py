@@ -0,0 +1,46 @@
+"""Test the model cache"""
+from typing import Optional
+from dataclasses import dataclass
+
+import pytest
+
+from takbackend import cachebus
+from takbackend.modelcache import ModelCache
+
+
+@dataclass
+class FakeRow:
+    """Stand-in for model instance"""
+
+    pk: str  # pylint: disable=C0103
+    deleted: Optional[str] = None
+
+
+@pytest.mark.asyncio
+async def test_read_through_and_evict() -> None:
+    """Second get is a hit, invalidation and deleted rows cause loads"""
+    loads = []
+
+    async def loader(key: str) -> Optional[FakeRow]:
+        loads.append(key)
+        return FakeRow(pk=key, deleted="yes" if key == "gone" else None)
+
+    cache: ModelCache[FakeRow] = ModelCache("test", loader, ("testkind",), maxsize=2)
+    assert (await cache.get("a")).pk == "a"
+    assert (await cache.get("a")).pk == "a"
+    assert loads == ["a"]
+    assert cache.stats()["hits"] == 1
+
+    cachebus.dispatch("testkind", "a")
+    await cache.get("a")
+    assert loads == ["a", "a"]
+
+    await cache.get("gone")
+    await cache.get("gone")
+    assert loads.count("gone") == 2
+
+    await cache.get("b")
+    await cache.get("c")
+    assert cache.stats()["size"] == 2
+    cachebus.dispatch("testkind", cachebus.ALL_KEYS)
+    assert cache.stats()["size"] == 0
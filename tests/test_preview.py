@@ -0,0 +1,42 @@
+"""Test link previewer detection"""
+import pytest
+from starlette.requests import Request
+
+pytest.importorskip("arkia11napi")
+
+from takbackend.views.clients import is_preview  # pylint: disable=C0413
+
+
+def request(user_agent: str) -> Request:
+    """Request with the given User-Agent"""
+    return Request({"type": "http", "headers": [(b"user-agent", user_agent.encode("latin-1"))]})
+
+
+@pytest.mark.parametrize(
+    "user_agent",
+    [
+        "TelegramBot (like TwitterBot)",
+        "Mozilla/5.0 (compatible; Discordbot/2.0; +https://discordapp.com)",
+        "Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)",
+        "facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)",
+        "WhatsApp/2.23.20.0 A",
+        "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    ],
+)
+def test_previewers(user_agent: str) -> None:
+    """Crawlers and link previewers are detected"""
+    assert is_preview(request(user_agent))
+
+
+@pytest.mark.parametrize(
+    "user_agent",
+    [
+        "Mozilla/5.0 (Linux; Android 10; CUBOT X30) AppleWebKit/537.36 Chrome/90.0 Mobile Safari/537.36",
+        "Mozilla/5.0 (Linux; Android 13) AppleWebKit/537.36 Chrome/116.0 Mobile Safari/537.36 Telegram-Android/10.0.1",
+        "Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 discord/1.0.9015 Chrome/108.0 Electron/22.3.2 Safari/537.36",
+        "Mozilla/5.0 (Macintosh) AppleWebKit/537.36 Slack/4.33.90 Chrome/114.0 Electron/25.2.0 Safari/537.36",
+    ],
+)
+def test_browsers(user_agent: str) -> None:
+    """In-app browsers and phones with unfortunate names are not"""
+    assert not is_preview(request(user_agent))
@@ -0,0 +1,41 @@
+"""Test the fleet prober"""
+from typing import Any, List
+from dataclasses import dataclass
+import asyncio
+
+import pytest
+
+from takbackend import prober
+
+
+@dataclass
+class FakeInstance:
+    """Stand-in for TAKInstance"""
+
+    pk: str  # pylint: disable=C0103
+
+
+@pytest.mark.asyncio
+async def test_probe_concurrency(monkeypatch: Any) -> None:
+    """At most concurrency pings in flight, failures count as down"""
+    inflight: List[int] = [0, 0]  # current, max
+
+    async def ping_certsapi(instance: FakeInstance, _session: Any) -> bool:
+        """Even ones are up, every fifth raises"""
+        inflight[0] += 1
+        inflight[1] = max(inflight)
+        try:
+            await asyncio.sleep(0.01)
+            number = int(instance.pk)
+            if number % 5 == 0:
+                raise RuntimeError("connection reset")
+            return number % 2 == 0
+        finally:
+            inflight[0] -= 1
+
+    monkeypatch.setattr(prober, "ping_certsapi", ping_certsapi)
+    instances: List[Any] = [FakeInstance(str(number)) for number in range(1, 51)]
+    results = await prober.probe(instances, concurrency=4)
+    assert inflight[1] == 4
+    assert results[True] == [str(number) for number in range(1, 51) if number % 2 == 0 and number % 5]
+    assert len(results[True]) + len(results[False]) == 50
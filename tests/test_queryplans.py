@@ -0,0 +1,90 @@
+"""Make sure the hot queries keep using the indexes, seeds the docker db and checks EXPLAIN output"""
+from typing import Any, AsyncGenerator, Dict, List
+import json
+import logging
+
+import pytest
+import pytest_asyncio
+import sqlalchemy
+from asyncpg.exceptions import DuplicateSchemaError
+
+from takbackend import models
+from takbackend.dbdevhelpers import create_all, drop_all, seed
+
+# pylint: disable=W0621
+LOGGER = logging.getLogger(__name__)
+SEED_INSTANCES = 2000
+SEED_OWNERS = 200
+INDEX_SCANS = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+
+@pytest_asyncio.fixture(scope="module")
+async def seeded_db(dockerdb: str) -> AsyncGenerator[Dict[str, Any], None]:
+    """Bind, create tables and seed with realistic amount of rows, a third of them soft-deleted"""
+    await models.db.set_bind(dockerdb)
+    try:
+        await create_all()
+    except DuplicateSchemaError:
+        await models.db.gino.create_all()
+    owners: List[str] = []
+    per_owner = SEED_INSTANCES // SEED_OWNERS
+    for idx in range(SEED_OWNERS):
+        result = await seed(per_owner, sequences=3, clients=5, grouping=f"group{idx % 20}")
+        owners.append(result["ownerid"])
+    for model in (models.TAKInstance, models.ClientSequence, models.Client):
+        table = f"takbackend.{model.__tablename__}"
+        await models.db.status(sqlalchemy.text(f"UPDATE {table} SET deleted = now() WHERE random() < 0.33"))
+        await models.db.status(sqlalchemy.text(f"ANALYZE {table}"))
+    instance = await models.TAKInstance.list_query(owners[0]).gino.first()
+    yield {"ownerid": owners[0], "instance_pk": instance.pk}
+    await drop_all()
+    await models.db.pop_bind().close()
+
+
+async def explain(query: Any) -> Dict[str, Any]:
+    """EXPLAIN the gino query, returns the top plan node"""
+    sql, params = models.db.compile(query)
+    async with models.db.acquire() as conn:
+        raw = await conn.raw_connection.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *params)
+    return dict(json.loads(raw)[0]["Plan"])
+
+
+def index_scans(plan: Dict[str, Any]) -> List[str]:
+    """Names of the indexes scanned anywhere in the plan"""
+    found = []
+    if plan.get("Node Type") in INDEX_SCANS:
+        found.append(plan.get("Index Name", ""))
+    for child in plan.get("Plans", []):
+        found.extend(index_scans(child))
+    return found
+
+
+@pytest.mark.asyncio
+async def test_owner_listing_uses_partial_index(seeded_db: Dict[str, Any]) -> None:
+    """Non-admin instance listing"""
+    plan = await explain(models.TAKInstance.list_query(seeded_db["ownerid"]))
+    LOGGER.debug("plan={}".format(plan))
+    assert "takinstances_live_ownerid_idx" in index_scans(plan)
+
+
+@pytest.mark.asyncio
+async def test_instance_sequences_uses_partial_index(seeded_db: Dict[str, Any]) -> None:
+    """Sequences of instance for the owner instructions"""
+    plan = await explain(models.ClientSequence.instance_sequences_query(seeded_db["instance_pk"]))
+    LOGGER.debug("plan={}".format(plan))
+    assert "clientsequences_live_server_idx" in index_scans(plan)
+
+
+@pytest.mark.asyncio
+async def test_shortcode_lookups_use_index(seeded_db: Dict[str, Any]) -> None:
+    """The short url lookups"""
+    _ = seeded_db
+    for model, index in (
+        (models.ClientSequence, "clientsequences_shortcode_unique"),
+        (models.Client, "clients_shortcode_unique"),
+    ):
+        query = model.query.where(model.shortcode == "notfound").where(
+            model.deleted == None  # pylint: disable=C0121 ; # "is None" will create invalid query
+        )
+        plan = await explain(query)
+        assert index in index_scans(plan)
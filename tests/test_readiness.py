@@ -0,0 +1,79 @@
+"""Test the shared readiness watcher"""
+from typing import Any, Dict, List, Optional
+from dataclasses import dataclass
+import asyncio
+import datetime
+
+import pytest
+
+from takbackend import readiness, cachebus
+
+
+@dataclass
+class FakeInstance:
+    """Stand-in for TAKInstance"""
+
+    pk: str  # pylint: disable=C0103
+    deleted: Optional[datetime.datetime] = None
+    tfcompleted: Optional[datetime.datetime] = None
+    certsapi_base: Optional[str] = None
+
+
+@pytest.mark.asyncio
+async def test_state_transitions(monkeypatch: Any) -> None:
+    """Streams get the transitions from single watcher, certs-api is pinged once per check for all streams"""
+    instance = FakeInstance("somepk")
+    pings: List[str] = []
+    certsapi_up = False
+
+    async def load_instances(pkstrs: List[str]) -> Dict[str, FakeInstance]:
+        """Our one instance"""
+        return {instance.pk: instance} if instance.pk in pkstrs else {}
+
+    async def ping_certsapi(pinged: FakeInstance) -> bool:
+        """Record the ping"""
+        pings.append(pinged.pk)
+        return certsapi_up
+
+    monkeypatch.setattr(readiness, "load_instances", load_instances)
+    monkeypatch.setattr(readiness, "ping_certsapi", ping_certsapi)
+    watcher = readiness.ReadinessWatcher()
+    watcher.start()
+    try:
+        streams = [watcher.watch("somepk", keepalive=10) for _ in range(3)]
+        assert [await stream.asend(None) for stream in streams] == [readiness.DISPATCHED] * 3
+
+        # TF callback
+        instance.certsapi_base = "https://example.com/api"
+        instance.tfcompleted = datetime.datetime.now(datetime.timezone.utc)
+        cachebus.dispatch(cachebus.TAKINSTANCE, "somepk")
+        assert [await stream.asend(None) for stream in streams] == [readiness.TFOUTPUTS] * 3
+        assert pings == ["somepk"]
+
+        certsapi_up = True
+        watcher._pinged["somepk"] = 0  # pylint: disable=W0212
+        watcher.wake()
+        assert [await stream.asend(None) for stream in streams] == [readiness.READY] * 3
+        for stream in streams:
+            with pytest.raises(StopAsyncIteration):
+                await stream.asend(None)
+        assert not watcher._queues  # pylint: disable=W0212
+    finally:
+        await watcher.stop()
+
+
+@pytest.mark.asyncio
+async def test_keepalive(monkeypatch: Any) -> None:
+    """None is yielded when nothing happens"""
+
+    async def load_instances(_pkstrs: List[str]) -> Dict[str, FakeInstance]:
+        """Nothing yet"""
+        await asyncio.sleep(1)
+        return {}
+
+    monkeypatch.setattr(readiness, "load_instances", load_instances)
+    watcher = readiness.ReadinessWatcher()
+    stream = watcher.watch("otherpk", keepalive=0.01)
+    assert await stream.asend(None) is None
+    await stream.aclose()
+    assert not watcher._queues  # pylint: disable=W0212
@@ -0,0 +1,77 @@
+"""Test the read replica routing"""
+from typing import Any, List, Optional
+from dataclasses import dataclass
+import datetime
+
+import pytest
+
+from takbackend import cachebus, replica
+
+
+@dataclass
+class FakeRow:
+    """Stand-in for model instance"""
+
+    name: str
+    updated: datetime.datetime
+
+
+class FakeBind:
+    """Stand-in for the replica engine and the primary"""
+
+    def __init__(self, name: str, rows: List[FakeRow]) -> None:
+        self.name = name
+        self.rows = rows
+        self.queries = 0
+
+    async def first(self, _query: Any) -> Optional[FakeRow]:
+        """First row"""
+        self.queries += 1
+        return self.rows[0] if self.rows else None
+
+    async def all(self, _query: Any) -> List[FakeRow]:
+        """All rows"""
+        self.queries += 1
+        return self.rows
+
+
+def ago(seconds: float) -> datetime.datetime:
+    """Timestamp seconds ago"""
+    return datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=seconds)
+
+
+@pytest.mark.asyncio
+async def test_read_routing(monkeypatch: Any) -> None:
+    """Old rows come from replica, fresh and missing ones from primary"""
+    primary = FakeBind("primary", [FakeRow("primary", ago(0))])
+    standby = FakeBind("replica", [FakeRow("replica", ago(replica.REPLICA_FRESHNESS * 2))])
+    monkeypatch.setattr(replica, "db", primary)
+    monkeypatch.setattr(replica, "ENGINE", standby)
+    monkeypatch.setattr(replica, "LAST_WRITE", {})
+
+    assert (await replica.read_first(None)).name == "replica"
+    assert [row.name for row in await replica.read_all(None, cachebus.TAKINSTANCE)] == ["replica"]
+    assert primary.queries == 0
+
+    # Writes seen via cachebus send listings to primary
+    cachebus.dispatch(cachebus.TAKINSTANCE, "somepk")
+    assert [row.name for row in await replica.read_all(None, cachebus.TAKINSTANCE)] == ["primary"]
+    assert [row.name for row in await replica.read_all(None, cachebus.CLIENT)] == ["replica"]
+
+    # Single rows too, even when the replica copy looks old
+    assert (await replica.read_first(None, replica.written_key(cachebus.TAKINSTANCE, "somepk"))).name == "primary"
+    assert (await replica.read_first(None, replica.written_key(cachebus.TAKINSTANCE, "otherpk"))).name == "replica"
+    cachebus.dispatch(cachebus.TAKINSTANCE, cachebus.ALL_KEYS)
+    assert (await replica.read_first(None, replica.written_key(cachebus.TAKINSTANCE, "otherpk"))).name == "primary"
+
+    # Recently updated or missing rows
+    standby.rows = [FakeRow("replica", ago(0))]
+    assert (await replica.read_first(None)).name == "primary"
+    standby.rows = []
+    assert (await replica.read_first(None)).name == "primary"
+
+    # Without replica everything is from primary
+    monkeypatch.setattr(replica, "ENGINE", None)
+    standby.queries = 0
+    assert (await replica.read_first(None)).name == "primary"
+    assert standby.queries == 0
@@ -0,0 +1,29 @@
+"""Test security helpers"""
+from typing import Any
+
+import pytest
+
+from takbackend import security
+from takbackend.security import sign_value, unsign_value, init_signing_key
+
+
+def test_sign_roundtrip(monkeypatch: Any) -> None:
+    """Signed values come back, tampered ones do not"""
+    monkeypatch.setattr(security, "SIGNING_KEY", None)
+    monkeypatch.setattr(security, "CLIENT_COOKIE_SECRET", "testsecret")  # pragma: allowlist secret
+    signed = sign_value("seq:client")
+    assert unsign_value(signed) == "seq:client"
+    assert unsign_value(signed.replace("client", "other")) is None
+    assert unsign_value("seq:client") is None
+
+
+def test_signing_key_required(monkeypatch: Any) -> None:
+    """Startup fails without CLIENT_COOKIE_SECRET unless the insecure dev mode is enabled"""
+    monkeypatch.setattr(security, "SIGNING_KEY", None)
+    monkeypatch.setattr(security, "CLIENT_COOKIE_SECRET", None)
+    monkeypatch.setattr(security, "CLIENT_COOKIE_INSECURE_DEV", False)
+    with pytest.raises(RuntimeError):
+        init_signing_key()
+    monkeypatch.setattr(security, "CLIENT_COOKIE_INSECURE_DEV", True)
+    init_signing_key()
+    assert unsign_value(sign_value("seq:client")) == "seq:client"
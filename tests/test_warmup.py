@@ -0,0 +1,37 @@
+"""Test the worker warm-up"""
+from typing import Any
+import asyncio
+
+import pytest
+
+from takbackend import warmup
+
+
+@pytest.mark.asyncio
+async def test_warm_up_failures_and_timeout(monkeypatch: Any) -> None:
+    """Failing and hanging steps do not block readiness forever, the rest still run"""
+
+    async def good() -> None:
+        """Works"""
+
+    async def bad() -> None:
+        """Fails"""
+        raise RuntimeError("no keyvault for you")
+
+    async def hangs() -> None:
+        """Never completes"""
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(warmup, "STEPS", {"good": good, "bad": bad, "hangs": hangs})
+    monkeypatch.setattr(warmup, "TIMINGS", {})
+    monkeypatch.setattr(warmup, "READY", False)
+    assert not await warmup.warm_up(timeout=0.1)
+    assert warmup.READY
+    assert warmup.TIMINGS["good"] is not None
+    assert warmup.TIMINGS["bad"] is None
+    assert "hangs" not in warmup.TIMINGS
+
+
+def test_compile_all() -> None:
+    """All templates compile"""
+    assert "owner_instructions.html" in warmup.compile_all()